@@ -13,10 +13,15 @@ from functools import wraps
 import json
 import time
 from datetime import datetime, timedelta
-from flask import Flask, request, render_template, redirect, url_for, jsonify, send_file, abort, session
-from werkzeug.utils import secure_filename
+from flask import Flask, request, render_template, redirect, url_for, jsonify, send_file, send_from_directory, abort, session
+from werkzeug.utils import safe_join, secure_filename
 import hashlib
+import gzip
+import mimetypes
 import random
+import threading
+import atexit
+from collections import OrderedDict, deque
 import docx  # Added for DOCX parsing
 
 import io
@@ -39,6 +44,12 @@ try:
 except Exception:
     pd = None
 
+# Optional: brotli for Content-Encoding negotiation (gzip is always available)
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
 from io import BytesIO
 from flask import send_file
 
@@ -57,7 +68,13 @@ def fix_subject_data(data, subject):
 
 
 BASE_DIR = os.path.dirname(__file__)
-DB = os.path.join(BASE_DIR, 'cbt.db')
+# pooled WAL-mode connections (see db.py); DB path can be overridden with CBT_DB_PATH
+from db import (db_conn, db_execute, db_stats, db_write, db_write_async, migrate_db,
+                normalize_student_name, release_thread_connections)
+# content-addressed question images, resized in a worker pool (see images.py)
+import images
+import grading
+import journal
 
 # ensure a secret key for session (set a secure value in production)
 # store the secret value now and assign it to the Flask app after the app is created
@@ -67,26 +84,6 @@ APP_SECRET_KEY = os.environ.get('FLASK_SECRET', 'dev-secret-key-please-change')
 ADMIN_USERNAME = os.environ.get('ADMIN_USERNAME', 'admin')
 ADMIN_PASSWORD = os.environ.get('ADMIN_PASSWORD', 'adminpass')
 
-def ensure_column(table: str, column: str, definition: str):
-    """
-    Ensure a column exists on a table; create it if missing.
-    Uses a direct sqlite connection so it can be called before db_conn() is defined.
-    """
-    try:
-        conn = sqlite3.connect(DB)
-        cur = conn.cursor()
-        cur.execute(f"PRAGMA table_info({table})")
-        cols = [row[1] for row in cur.fetchall()]
-        if column not in cols:
-            cur.execute(f"ALTER TABLE {table} ADD COLUMN {column} {definition}")
-            conn.commit()
-    except Exception:
-        # keep silent; caller may handle errors
-        pass
-    finally:
-        try: conn.close()
-        except Exception: pass
-
 def is_admin_request():
     """
     Return True if the request is authenticated as admin.
@@ -107,124 +104,20 @@ def is_admin_request():
     return admin_pass == ADMIN_PASSWORD
 
 def init_db():
-    conn = sqlite3.connect(DB)
-    c = conn.cursor()
-    c.execute('''CREATE TABLE IF NOT EXISTS exams (
-        id TEXT PRIMARY KEY,
-        title TEXT,
-        duration_minutes INTEGER,
-        started INTEGER DEFAULT 0,
-        teacher_id TEXT
-    )''')
-    c.execute('''CREATE TABLE IF NOT EXISTS questions (
-        id TEXT PRIMARY KEY,
-        exam_id TEXT,
-        question TEXT,
-        choices TEXT,
-        answer_index INTEGER,
-        image TEXT
-    )''')
-
-    
-    c.execute('''CREATE TABLE IF NOT EXISTS sessions (
-        token TEXT PRIMARY KEY,
-        exam_id TEXT,
-        start_time INTEGER
-    )''')
-    # classes + class_students: pre-registered classes (SS1..SS3) and their student lists
-    c.execute('''CREATE TABLE IF NOT EXISTS classes (
-        id TEXT PRIMARY KEY,
-        name TEXT UNIQUE
-    )''')
-    c.execute('''CREATE TABLE IF NOT EXISTS class_students (
-        id TEXT PRIMARY KEY,
-        class_name TEXT,
-        student_name TEXT
-    )''')
-    c.execute('''CREATE TABLE IF NOT EXISTS results (
-        id TEXT PRIMARY KEY,
-        token TEXT,
-        answers TEXT,
-        score INTEGER,
-        submitted_at INTEGER
-    )''')
-    c.execute('''CREATE TABLE IF NOT EXISTS registered_students (
-        id TEXT PRIMARY KEY,
-        exam_id TEXT,
-        student_name TEXT
-    )''')
-    # audit / teacher
-    c.execute('''CREATE TABLE IF NOT EXISTS teachers (
-        id TEXT PRIMARY KEY,
-        name TEXT UNIQUE,
-        password_hash TEXT,
-        token TEXT UNIQUE
-    )''')
-    # audit logs
-    c.execute('''CREATE TABLE IF NOT EXISTS audit_logs (
-        id TEXT PRIMARY KEY,
-        ts INTEGER,
-        action TEXT,
-        teacher_id TEXT,
-        exam_id TEXT,
-        details TEXT
-    )''')
-    conn.commit()
-
-    # use module-level helper to ensure optional columns
-    ensure_column('results', 'name', 'TEXT')
-    ensure_column('results', 'total', 'INTEGER')
-    ensure_column('results', 'student_id', 'TEXT')
-    ensure_column('sessions', 'student_name', 'TEXT')
-    ensure_column('sessions', 'end_time', 'INTEGER')
-    ensure_column('sessions', 'class', 'TEXT')   # store student's class in session
-    ensure_column('exams', 'teacher_id', 'TEXT')
-    # audit fields for questions
-    ensure_column('questions', 'created_by', 'TEXT')
-    ensure_column('questions', 'created_at', 'INTEGER')
-    ensure_column('questions', 'updated_by', 'TEXT')
-    ensure_column('questions', 'updated_at', 'INTEGER')
-    # ensure we can persist per-session ordering
-    ensure_column('sessions', 'question_state', 'TEXT')   # JSON: list of {id,question,choices,correct_index}
-    ensure_column('sessions', 'question_order', 'TEXT')   # persisted per-session ordering (added)
-    ensure_column('results', 'answers_detail', 'TEXT')    # JSON: detailed per-question responses for auditing
-
-    # teacher approval / subject columns (for pending approvals and subject selection)
-    ensure_column('teachers', 'approved', 'INTEGER DEFAULT 0')   # 0 = pending, 1 = approved
-    ensure_column('teachers', 'subject', 'TEXT')
-
-    # add exam tag and session tag columns (new)
-    ensure_column('exams', 'tag', 'TEXT')
-    ensure_column('sessions', 'tag', 'TEXT')
-
-    # ensure some default classes exist (safe to call multiple times)
-    try:
-        for cname in ('SS1','SS2','SS3'):
-            c.execute('INSERT OR IGNORE INTO classes (id,name) VALUES (?,?)', (str(uuid.uuid4())[:8], cname))
-        conn.commit()
-    except Exception:
-        pass
-
-    # indexes for faster lookup on larger datasets
-    try:
-        # c.execute("
-        c.execute("CREATE INDEX IF NOT EXISTS idx_regstudents_exam ON registered_students(exam_id)")
-        c.execute("CREATE INDEX IF NOT EXISTS idx_questions_exam ON questions(exam_id)")
-        conn.commit()
-    except Exception:
-        pass
-
-    conn.close()
+    """Apply any pending schema migrations (a single SELECT when the DB is current)."""
+    applied = migrate_db()
+    if applied:
+        app.logger.info("applied schema migrations: %s", applied)
 
 app = Flask(__name__)
 # assign the previously read secret to the Flask app now that `app` exists
 app.secret_key = APP_SECRET_KEY
 init_db()
 
-def db_conn():
-    conn = sqlite3.connect(DB)
-    conn.row_factory = sqlite3.Row
-    return conn
+@app.teardown_request
+def _release_db_connections(exc=None):
+    # hand back any pooled connection a handler forgot to close (e.g. on an exception path)
+    release_thread_connections()
 
 def _hash_password(password: str) -> str:
     return hashlib.sha256((password or '').encode('utf-8')).hexdigest()
@@ -238,7 +131,9 @@ def get_teacher_by_token(token):
     return t
 
 def get_teacher_from_request():
-    token = request.headers.get('X-Teacher-Token') or (request.json and request.json.get('teacher_token'))
+    # get_json(silent=True): multipart uploads and GETs carry no JSON body
+    data = request.get_json(silent=True) or {}
+    token = request.headers.get('X-Teacher-Token') or data.get('teacher_token')
     if not token: return None
     return get_teacher_by_token(token)
 
@@ -264,6 +159,16 @@ def student_landing():
 def login_page():
     return render_template('login.html')
 
+def parse_sampling(data):
+    """(sample_size, sample_by_topic) from a request body; sample_size None means every question."""
+    try:
+        sample_size = int(data.get('sample_size') or 0) or None
+    except Exception:
+        sample_size = None
+    if sample_size is not None and sample_size < 1:
+        sample_size = None
+    return sample_size, 1 if data.get('stratify') or data.get('sample_by_topic') else 0
+
 @app.route('/api/create_exam', methods=['POST'])
 def create_exam():
     data = request.json or {}
@@ -276,6 +181,7 @@ def create_exam():
     subject = (data.get('subject') or '').strip() or None
     # allow admin to optionally assign a teacher_id when creating exam
     teacher_id = (data.get('teacher_id') or '').strip() or None
+    sample_size, sample_by_topic = parse_sampling(data)
     exam_id = str(uuid.uuid4())[:8]
     conn = db_conn(); c = conn.cursor()
     # if teacher_id invalid, ignore it
@@ -283,8 +189,9 @@ def create_exam():
         c.execute('SELECT id FROM teachers WHERE id=?', (teacher_id,))
         if not c.fetchone():
             teacher_id = None
-    c.execute('INSERT INTO exams (id,title,duration_minutes,tag,teacher_id) VALUES (?,?,?,?,?)', (exam_id, title, duration, tag, teacher_id))
-    conn.commit(); conn.close()
+    conn.close()
+    db_execute('INSERT INTO exams (id,title,duration_minutes,tag,teacher_id,sample_size,sample_by_topic) VALUES (?,?,?,?,?,?,?)',
+               (exam_id, title, duration, tag, teacher_id, sample_size, sample_by_topic))
     return jsonify({'exam_id': exam_id})
 
 @app.route('/api/add_question', methods=['POST'])
@@ -309,12 +216,14 @@ def add_question():
         conn.close(); return jsonify({'error': 'exam not found'}), 400
     if er['teacher_id'] and er['teacher_id'] != teacher['id']:
         conn.close(); return jsonify({'error': 'not allowed to add questions for this exam'}), 403
+    conn.close()
+    image_path = (data.get('image_path') or '').strip() or None
+    topic = (data.get('topic') or '').strip() or None
     qid = str(uuid.uuid4())[:8]
     now = int(time.time())
-    c.execute('INSERT INTO questions (id, exam_id, question, choices, answer_index, image, created_by, created_at) VALUES (?,?,?,?,?,?,?,?)',
-          (qid, exam_id, q, json.dumps(choices), answer_index, image, teacher['id'], now))
-
-    conn.commit(); conn.close()
+    db_execute('INSERT INTO questions (id, exam_id, question, choices, answer_index, image_path, topic, created_by, created_at) VALUES (?,?,?,?,?,?,?,?,?)',
+               (qid, exam_id, q, json.dumps(choices), answer_index, image_path, topic, teacher['id'], now))
+    invalidate_exam_blueprint(exam_id)
     log_audit('add_question', teacher['id'], exam_id, {'question_id': qid, 'answer_index': answer_index})
     return jsonify({'ok': True, 'question_id': qid})
 
@@ -376,7 +285,7 @@ def list_exams():
     c.execute('''
         SELECT e.id, e.title, e.duration_minutes, e.started, e.teacher_id,
                COALESCE(t.subject, '') AS subject,
-               COALESCE(e.tag, '') AS tag
+               COALESCE(e.tag, '') AS tag, e.sample_size, e.sample_by_topic
         FROM exams e
         LEFT JOIN teachers t ON e.teacher_id = t.id
         ORDER BY subject DESC
@@ -391,32 +300,48 @@ def list_exams():
             'started': bool(r['started']),
             'teacher_id': r['teacher_id'],
             'subject': r['subject'] or '',
-            'tag': r['tag'] or ''
+            'tag': r['tag'] or '',
+            'sample_size': r['sample_size'],
+            'sample_by_topic': bool(r['sample_by_topic'])
         })
     return jsonify(out)
 
 @app.route('/api/questions/<exam_id>')
 @app.route('/api/questions/<exam_id>')
 def get_questions(exam_id):
-    conn = db_conn()
-    c = conn.cursor()
-    c.execute('SELECT id, question, choices, answer_index, image_path FROM questions WHERE exam_id=?', (exam_id,))
-    rows = c.fetchall()
-    conn.close()
-
+    bp = get_exam_blueprint(exam_id)
     qs = []
-    for r in rows:
+    for q in bp['questions']:
         qs.append({
-            'id': r['id'],
-            'question': r['question'],
-            'choices': json.loads(r['choices'] or '[]'),
-            'answer_index': r['answer_index'],
-            'image_path': r['image_path'] or ''
+            'id': q['id'],
+            'question': q['question'],
+            'choices': q['choices'],
+            'answer_index': q['answer_index'],
+            'image_path': q['image_path'],
+            'topic': q['topic']
         })
     return jsonify(qs)
 
 
 
+QUESTION_IMAGE_DIR = os.path.join(BASE_DIR, 'static', 'uploads', 'questions')
+
+def store_question_image(file_storage):
+    """
+    Save an uploaded question image under its content hash and return its /static URL.
+    Identical uploads share one file, and two different 'diagram.png's can no longer
+    overwrite each other. Resizing and the _md/_sm variants happen in images.py's worker
+    pool, so a batch of phone photos does not hold up the upload request.
+    """
+    name = images.store(file_storage.read(), secure_filename(file_storage.filename or ''), QUESTION_IMAGE_DIR)
+    return f'/static/uploads/questions/{name}'
+
+def _write_uploaded_questions(conn, exam_id, rows, overwrite):
+    c = conn.cursor()
+    if overwrite:
+        c.execute('DELETE FROM questions WHERE exam_id=?', (exam_id,))
+    c.executemany('INSERT INTO questions (id, exam_id, question, choices, answer_index, image_path, topic) VALUES (?,?,?,?,?,?,?)', rows)
+
 @app.route('/api/upload_questions', methods=['POST'])
 def upload_questions():
     """
@@ -430,16 +355,11 @@ def upload_questions():
     overwrite = request.form.get('overwrite') == '1'
     # Handle optional image uploads
     uploaded_images = request.files.getlist('images')
-    image_dir = os.path.join(BASE_DIR, 'static', 'uploads', 'questions')
-    os.makedirs(image_dir, exist_ok=True)
-    image_map = {}  # filename -> saved_path
+    image_map = {}  # uploaded filename -> content-addressed URL
 
     for img in uploaded_images:
         if img and img.filename:
-            safe_name = secure_filename(img.filename)
-            save_path = os.path.join(image_dir, safe_name)
-            img.save(save_path)
-            image_map[safe_name] = f"/static/uploads/questions/{safe_name}"
+            image_map[secure_filename(img.filename)] = store_question_image(img)
 
 
     if not exam_id or not file:
@@ -499,8 +419,11 @@ def upload_questions():
                         image_map_lower = {k.lower(): v for k, v in image_map.items()}
                         image_col = image_map_lower.get(filename, '')
 
+                topic = row.get('topic') if 'topic' in df.columns else None
+                topic = str(topic).strip() if topic is not None and not (isinstance(topic, float) and pd.isna(topic)) else None
+
                 # ✅ Add image path into each entry
-                entries.append((str(question).strip(), choices, int(answer_index), image_col))
+                entries.append((str(question).strip(), choices, int(answer_index), image_col, topic))
 
         elif ext == '.docx' and Document:
             doc = Document(file)
@@ -576,7 +499,7 @@ def upload_questions():
                     ans = (r.get('answer') or '').strip().upper()
                     amap = {'A':0,'B':1,'C':2,'D':3}
                     answer_index = amap.get(ans, 0)
-                entries.append((question, choices, answer_index))
+                entries.append((question, choices, answer_index, None, (r.get('topic') or '').strip() or None))
     except Exception as e:
         conn.close()
         app.logger.exception("upload parsing error: %s", e)
@@ -586,13 +509,13 @@ def upload_questions():
         conn.close()
         return jsonify({'error': 'No valid questions found in file. Ensure correct format.'}), 400
 
-    c = conn.cursor()
-    inserted = 0
-    if overwrite:
-        c.execute('DELETE FROM questions WHERE exam_id=?', (exam_id,))
-    
+    conn.close()
+    rows = []
     for e in entries:
-        if len(e) == 4:
+        topic = None
+        if len(e) == 5:
+            question, choices, answer_index, image_ref, topic = e
+        elif len(e) == 4:
             question, choices, answer_index, image_ref = e
         else:
             question, choices, answer_index = e
@@ -605,12 +528,12 @@ def upload_questions():
         image_path = image_ref if image_ref else None
 
         qid = str(uuid.uuid4())[:8]
-        now = int(time.time())
-        c.execute('INSERT INTO questions (id, exam_id, question, choices, answer_index, image_path) VALUES (?,?,?,?,?,?)',
-                (qid, exam_id, question, json.dumps(choices), int(answer_index), image_path))
-        inserted += 1
+        rows.append((qid, exam_id, question, json.dumps(choices), int(answer_index), image_path, topic))
 
-    conn.commit(); conn.close()
+    # overwrite + bulk insert as one write job (one transaction)
+    db_write(_write_uploaded_questions, exam_id, rows, overwrite)
+    invalidate_exam_blueprint(exam_id)
+    inserted = len(rows)
     app.logger.info("Uploaded %d questions to exam %s by teacher=%s", inserted, exam_id, teacher['id'] if teacher else '-')
 
     # single audit event for the bulk upload action (notifies admin via audit_logs)
@@ -621,6 +544,586 @@ def upload_questions():
 
     return jsonify({'ok': True, 'count': inserted})
 
+# =====================================
+# Exam blueprints & per-session presentation state
+# =====================================
+#
+# A session no longer stores a copy of every question. sessions.question_state holds
+# only the presentation: question order plus, per question, the permutation of its
+# stored choices ({"v":2,"order":[qid,...],"perm":[[2,0,3,1],...]}). Rendering and
+# grading rebuild the presented paper from the exam's blueprint.
+
+def load_exam_blueprint(exam_id):
+    """
+    Parsed questions of an exam: {'exam_id', 'questions': [...], 'by_id': {qid: q}} plus the
+    sampling settings and precomputed id arrays ('ids', and 'strata' = {topic: [qid, ...]})
+    so a K-of-N draw never has to touch the question table.
+    """
+    conn = db_conn(); c = conn.cursor()
+    try:
+        c.execute('SELECT id, question, choices, answer_index, image_path, topic FROM questions WHERE exam_id=? ORDER BY rowid', (exam_id,))
+        rows = c.fetchall()
+        c.execute('SELECT sample_size, sample_by_topic FROM exams WHERE id=?', (exam_id,))
+        ex = c.fetchone()
+    finally:
+        conn.close()
+    questions = []
+    for r in rows:
+        try:
+            choices = json.loads(r['choices'] or '[]')
+        except Exception:
+            choices = []
+        questions.append({
+            'id': r['id'],
+            'question': r['question'],
+            'choices': choices,
+            'answer_index': int(r['answer_index'] or 0),
+            'image_path': r['image_path'] or '',
+            'topic': r['topic'] or ''
+        })
+    strata = {}
+    for q in questions:
+        strata.setdefault(q['topic'], []).append(q['id'])
+    return {
+        'exam_id': exam_id,
+        'questions': questions,
+        'by_id': {q['id']: q for q in questions},
+        'ids': [q['id'] for q in questions],
+        'strata': strata,
+        'sample_size': int(ex['sample_size']) if ex and ex['sample_size'] else None,
+        'stratify': bool(ex and ex['sample_by_topic']),
+    }
+
+def stratum_quotas(sizes, k):
+    """Split k draws over strata proportionally to their sizes (largest remainder)."""
+    total = sum(sizes.values())
+    exact = {t: k * n / total for t, n in sizes.items()}
+    quotas = {t: int(v) for t, v in exact.items()}
+    short = k - sum(quotas.values())
+    for t in sorted(exact, key=lambda t: exact[t] - quotas[t], reverse=True)[:short]:
+        quotas[t] += 1
+    return quotas
+
+def draw_question_ids(blueprint, rng=random):
+    """The question ids one student gets: all of them, or a K-of-N sample (optionally per topic)."""
+    ids = blueprint['ids']
+    k = blueprint.get('sample_size')
+    if not k or k >= len(ids):
+        return list(ids)
+    if not blueprint.get('stratify') or len(blueprint['strata']) < 2:
+        return rng.sample(ids, k)
+    quotas = stratum_quotas({t: len(v) for t, v in blueprint['strata'].items()}, k)
+    drawn = []
+    for topic, pool in blueprint['strata'].items():
+        drawn.extend(rng.sample(pool, quotas[topic]))
+    return drawn
+
+def build_presentation(blueprint, rng=random):
+    """
+    Draw the student's questions, shuffle their order and each question's choices; returns the
+    compact session state. The draw is recorded by 'order' itself, so nothing else is stored.
+    """
+    by_id = blueprint['by_id']
+    qlist = [by_id[qid] for qid in draw_question_ids(blueprint, rng)]
+    rng.shuffle(qlist)
+    perms = []
+    for q in qlist:
+        perm = list(range(len(q['choices'])))
+        rng.shuffle(perm)
+        perms.append(perm)
+    return {'v': 2, 'order': [q['id'] for q in qlist], 'perm': perms}
+
+def dump_question_state(state):
+    return json.dumps(state, separators=(',', ':'))
+
+def load_question_state(raw):
+    try:
+        return json.loads(raw or '[]')
+    except Exception:
+        return []
+
+def present_questions(state, blueprint):
+    """
+    Rebuild the student's paper: [{id, question, choices, correct_index, image_path, perm}].
+    choices/correct_index are in presented order; perm maps a presented option back to
+    its index in the stored choices (None for legacy sessions that stored full question text).
+    Questions deleted since the session started are skipped.
+    """
+    by_id = blueprint['by_id']
+    if isinstance(state, list):
+        # legacy sessions: full question text + shuffled choices were copied into the row
+        out = []
+        for q in state:
+            bq = by_id.get(q.get('id'))
+            out.append({
+                'id': q.get('id'),
+                'question': q.get('question') or '',
+                'choices': q.get('choices') or [],
+                'correct_index': int(q.get('correct_index') or 0),
+                'image_path': (bq['image_path'] if bq else '') or q.get('image_path') or '',
+                'perm': None
+            })
+        return out
+    out = []
+    for qid, perm in zip(state.get('order') or [], state.get('perm') or []):
+        q = by_id.get(qid)
+        if not q:
+            continue
+        choices = q['choices']
+        perm = [i for i in perm if 0 <= i < len(choices)]
+        try:
+            correct = perm.index(q['answer_index'])
+        except ValueError:
+            correct = -1
+        out.append({
+            'id': qid,
+            'question': q['question'],
+            'choices': [choices[i] for i in perm],
+            'correct_index': correct,
+            'image_path': q['image_path'],
+            'perm': perm
+        })
+    return out
+
+def public_questions(presented):
+    """Strip answer keys / permutations before sending a paper to the browser."""
+    return [{'id': q['id'], 'question': q['question'], 'choices': q['choices'], 'image_path': q['image_path']}
+            for q in presented]
+
+def exam_content(blueprint):
+    """
+    (hash, json bytes) of the exam's shared, answer-free content: {qid: {question, choices, image_path}}
+    with choices in stored order. Built once per blueprint; the hash changes whenever the content does.
+    """
+    content = blueprint.get('content')
+    if content is None:
+        body = json.dumps({
+            'exam_id': blueprint['exam_id'],
+            'questions': {q['id']: {'question': q['question'], 'choices': q['choices'], 'image_path': q['image_path']}
+                          for q in blueprint['questions']},
+        }, separators=(',', ':'), sort_keys=True).encode('utf-8')
+        content = (hashlib.sha256(body).hexdigest()[:20], body)
+        blueprint['content'] = content
+    return content
+
+def shares_exam_content(blueprint):
+    # a K-of-N exam must not hand every student the whole bank
+    k = blueprint.get('sample_size')
+    return not k or k >= len(blueprint['questions'])
+
+# =====================================
+# Exam blueprint cache
+# =====================================
+#
+# When a class logs in together every start_exam / exam_page / submit needs the same
+# parsed questions. Blueprints are kept in an LRU keyed by exam_id and loaded at most
+# once per miss (concurrent misses for one exam wait for the first loader). Any write
+# to an exam's questions must call invalidate_exam_blueprint(exam_id).
+# Cached blueprints are shared: treat them as read-only.
+
+class LRUCache:
+    """Small thread-safe LRU with hit/miss/eviction counters."""
+
+    def __init__(self, maxsize):
+        self.maxsize = max(1, maxsize)
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key, default=None):
+        with self._lock:
+            if key in self._data:
+                self._data.move_to_end(key)
+                self.hits += 1
+                return self._data[key]
+            self.misses += 1
+            return default
+
+    def peek(self, key, default=None):
+        """Lookup without touching order or counters."""
+        with self._lock:
+            return self._data.get(key, default)
+
+    def put(self, key, value):
+        with self._lock:
+            self._data[key] = value
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def pop(self, key):
+        with self._lock:
+            return self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def stats(self):
+        with self._lock:
+            total = self.hits + self.misses
+            return {'size': len(self._data), 'maxsize': self.maxsize, 'hits': self.hits,
+                    'misses': self.misses, 'evictions': self.evictions,
+                    'hit_ratio': round(self.hits / total, 3) if total else 0}
+
+BLUEPRINT_CACHE_SIZE = int(os.environ.get('CBT_BLUEPRINT_CACHE_SIZE', '64'))
+_blueprint_cache = LRUCache(BLUEPRINT_CACHE_SIZE)
+_blueprint_generation = {}        # exam_id -> bumped on every invalidation
+_blueprint_locks = {}             # exam_id -> lock held while loading
+_blueprint_locks_guard = threading.Lock()
+_blueprint_invalidations = 0
+
+def get_exam_blueprint(exam_id):
+    """Cached load_exam_blueprint()."""
+    bp = _blueprint_cache.get(exam_id)
+    if bp is not None:
+        return bp
+    with _blueprint_locks_guard:
+        lock = _blueprint_locks.setdefault(exam_id, threading.Lock())
+    with lock:
+        bp = _blueprint_cache.peek(exam_id)
+        if bp is not None:
+            return bp
+        generation = _blueprint_generation.get(exam_id, 0)
+        bp = load_exam_blueprint(exam_id)
+        # don't cache a load that raced with an invalidation
+        if _blueprint_generation.get(exam_id, 0) == generation:
+            _blueprint_cache.put(exam_id, bp)
+    return bp
+
+def invalidate_exam_blueprint(exam_id):
+    global _blueprint_invalidations
+    with _blueprint_locks_guard:
+        _blueprint_generation[exam_id] = _blueprint_generation.get(exam_id, 0) + 1
+        _blueprint_invalidations += 1
+    _blueprint_cache.pop(exam_id)
+    session_pool.discard(exam_id)
+
+def blueprint_cache_stats():
+    out = _blueprint_cache.stats()
+    out['invalidations'] = _blueprint_invalidations
+    return out
+
+# =====================================
+# Pre-generated session pool
+# =====================================
+#
+# Opening an exam (set_exam_state started=1) pre-builds shuffled presentation states
+# in the background, so start_exam only pops a ready-serialized state during the
+# login storm. The pool is sized from the exam's roster and refilled below a
+# low-water mark; it is dropped when the exam's questions change or the exam closes.
+
+SESSION_POOL_DEFAULT = int(os.environ.get('CBT_SESSION_POOL_DEFAULT', '60'))
+SESSION_POOL_MAX = int(os.environ.get('CBT_SESSION_POOL_MAX', '600'))
+
+class SessionStatePool:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._states = {}        # exam_id -> deque of (generation, state_json)
+        self._targets = {}       # exam_id -> pool size
+        self._open = set()       # exams the pool is kept full for (opened, or seen open by start_exam)
+        self._refilling = set()
+        self.taken = 0
+        self.built_inline = 0
+        self.prebuilt = 0
+
+    def target_size(self, exam_id):
+        """Roster size: registered students for the exam, else the class named by the exam tag."""
+        conn = db_conn(); c = conn.cursor()
+        try:
+            c.execute('SELECT COUNT(1) AS cnt FROM registered_students WHERE exam_id=?', (exam_id,))
+            n = c.fetchone()['cnt']
+            if not n:
+                c.execute('''SELECT COUNT(1) AS cnt FROM class_students cs
+                             JOIN exams e ON cs.class_name = e.tag WHERE e.id=?''', (exam_id,))
+                n = c.fetchone()['cnt']
+        finally:
+            conn.close()
+        return max(1, min(SESSION_POOL_MAX, n or SESSION_POOL_DEFAULT))
+
+    def open_exam(self, exam_id):
+        with self._lock:
+            self._open.add(exam_id)
+            self._targets.pop(exam_id, None)
+        self._schedule_refill(exam_id)
+
+    def close_exam(self, exam_id):
+        with self._lock:
+            self._open.discard(exam_id)
+            self._states.pop(exam_id, None)
+            self._targets.pop(exam_id, None)
+
+    def discard(self, exam_id):
+        """Questions changed: drop prebuilt states and rebuild if the exam is open."""
+        with self._lock:
+            self._states.pop(exam_id, None)
+            is_open = exam_id in self._open
+        if is_open:
+            self._schedule_refill(exam_id)
+
+    def take(self, exam_id, is_open=False):
+        """
+        Pop a serialized state for exam_id, or None if the pool is empty / stale.
+        is_open: the caller checked exams.started, so keep the pool filled for it (covers
+        exams opened before a server restart). Closed exams never get a pool.
+        """
+        generation = _blueprint_generation.get(exam_id, 0)
+        state = None
+        with self._lock:
+            if is_open:
+                self._open.add(exam_id)
+            is_open = exam_id in self._open
+            dq = self._states.get(exam_id)
+            while dq:
+                gen, candidate = dq.popleft()
+                if gen == generation:
+                    state = candidate
+                    break
+            remaining = len(dq) if dq else 0
+            target = self._targets.get(exam_id, SESSION_POOL_DEFAULT)
+            if state is not None:
+                self.taken += 1
+            else:
+                self.built_inline += 1
+        if is_open and remaining <= max(5, target // 5):
+            self._schedule_refill(exam_id)
+        return state
+
+    def _schedule_refill(self, exam_id):
+        with self._lock:
+            if exam_id in self._refilling:
+                return
+            self._refilling.add(exam_id)
+        threading.Thread(target=self._refill, args=(exam_id,), name=f'session-pool-{exam_id}', daemon=True).start()
+
+    def _refill(self, exam_id):
+        try:
+            with self._lock:
+                if exam_id not in self._open:
+                    return
+                target = self._targets.get(exam_id)
+            if target is None:
+                target = self.target_size(exam_id)
+                with self._lock:
+                    self._targets[exam_id] = target
+            generation = _blueprint_generation.get(exam_id, 0)
+            blueprint = get_exam_blueprint(exam_id)
+            if not blueprint['questions']:
+                return
+            with self._lock:
+                have = len(self._states.get(exam_id) or ())
+            built = [(generation, dump_question_state(build_presentation(blueprint))) for _ in range(max(0, target - have))]
+            with self._lock:
+                if exam_id not in self._open:
+                    return          # exam closed while we were building
+                dq = self._states.setdefault(exam_id, deque())
+                dq.extend(built)
+                self.prebuilt += len(built)
+        except Exception:
+            app.logger.exception("session pool refill failed for exam %s", exam_id)
+        finally:
+            with self._lock:
+                self._refilling.discard(exam_id)
+
+    def stats(self):
+        with self._lock:
+            return {'exams': {eid: {'ready': len(dq), 'target': self._targets.get(eid)} for eid, dq in self._states.items()},
+                    'taken': self.taken, 'built_inline': self.built_inline, 'prebuilt': self.prebuilt}
+
+session_pool = SessionStatePool()
+
+# =====================================
+# Server-side autosave
+# =====================================
+#
+# The exam page posts answer deltas to /api/autosave/<token> as the student clicks. Deltas
+# are merged in memory (last answer per question wins) and a background thread flushes
+# everything collected every CBT_AUTOSAVE_FLUSH_MS as a single writer job, so a lab full
+# of clicking students costs one transaction per interval instead of one per click.
+AUTOSAVE_FLUSH_MS = int(os.environ.get('CBT_AUTOSAVE_FLUSH_MS', '2000'))
+AUTOSAVE_MAX_DELTAS = 500
+
+def _write_autosaves(conn, upserts, deletes):
+    c = conn.cursor()
+    if upserts:
+        # a flush can land after _write_result cleared the drafts: never resurrect them
+        c.executemany('INSERT OR REPLACE INTO autosaves (token, question_id, answer, updated_at) '
+                      'SELECT ?,?,?,? WHERE NOT EXISTS (SELECT 1 FROM results WHERE token=?)',
+                      [(t, q, a, ts, t) for t, q, a, ts in upserts])
+    if deletes:
+        c.executemany('DELETE FROM autosaves WHERE token=? AND question_id=?', deletes)
+
+class AutosaveBuffer:
+    def __init__(self, interval_ms):
+        self.interval = max(0.05, interval_ms / 1000.0)
+        self._lock = threading.Lock()
+        self._pending = {}       # token -> {question_id: (answer or None, ts)}
+        self._wake = threading.Event()
+        self._thread = None
+        self.deltas = 0
+        self.flushes = 0
+        self.rows_flushed = 0
+        self.flush_errors = 0
+
+    def add(self, token, answers):
+        now = int(time.time())
+        with self._lock:
+            slot = self._pending.setdefault(token, {})
+            for qid, ans in answers.items():
+                slot[str(qid)] = (ans, now)
+            self.deltas += len(answers)
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='autosave-flush', daemon=True)
+                self._thread.start()
+
+    def answers(self, token):
+        """Saved answers for token: flushed rows overlaid with anything still buffered."""
+        conn = db_conn(); c = conn.cursor()
+        c.execute('SELECT question_id, answer FROM autosaves WHERE token=?', (token,))
+        out = {r['question_id']: r['answer'] for r in c.fetchall()}
+        conn.close()
+        with self._lock:
+            for qid, (ans, _) in (self._pending.get(token) or {}).items():
+                if ans is None:
+                    out.pop(qid, None)
+                else:
+                    out[qid] = ans
+        return out
+
+    def discard(self, token):
+        """Forget buffered deltas for a submitted session (its rows are deleted with the result)."""
+        with self._lock:
+            self._pending.pop(token, None)
+
+    def flush(self, wait=True):
+        with self._lock:
+            pending, self._pending = self._pending, {}
+        if not pending:
+            return 0
+        upserts, deletes = [], []
+        for token, slot in pending.items():
+            for qid, (ans, ts) in slot.items():
+                if ans is None:
+                    deletes.append((token, qid))
+                else:
+                    upserts.append((token, qid, ans, ts))
+        try:
+            job = db_write_async(_write_autosaves, upserts, deletes)
+            if wait:
+                job.result(timeout=30)
+        except Exception:
+            self.flush_errors += 1
+            app.logger.exception("autosave flush failed (%d rows)", len(upserts) + len(deletes))
+            # put them back unless newer deltas arrived meanwhile
+            with self._lock:
+                for token, slot in pending.items():
+                    cur = self._pending.setdefault(token, {})
+                    for qid, v in slot.items():
+                        cur.setdefault(qid, v)
+            return 0
+        self.flushes += 1
+        self.rows_flushed += len(upserts) + len(deletes)
+        return len(upserts) + len(deletes)
+
+    def _run(self):
+        while True:
+            self._wake.wait(self.interval)
+            self._wake.clear()
+            try:
+                self.flush()
+            except Exception:
+                app.logger.exception("autosave flush loop error")
+
+    def stats(self):
+        with self._lock:
+            buffered = sum(len(v) for v in self._pending.values())
+            return {'buffered': buffered, 'sessions': len(self._pending), 'deltas': self.deltas,
+                    'flushes': self.flushes, 'rows_flushed': self.rows_flushed, 'flush_errors': self.flush_errors,
+                    'interval_ms': int(self.interval * 1000)}
+
+autosave_buffer = AutosaveBuffer(AUTOSAVE_FLUSH_MS)
+atexit.register(autosave_buffer.flush)
+
+# token -> end_time of sessions that may autosave, so a click does not cost a sessions lookup
+_autosave_sessions = LRUCache(int(os.environ.get('CBT_AUTOSAVE_SESSION_CACHE', '4096')))
+
+def _write_session(conn, token, exam_id, start_time, end_time, student_name, state_json, exam_tag, student_class):
+    """Returns (token, created, submitted) - the existing attempt's token when (exam, name) is taken."""
+    c = conn.cursor()
+    try:
+        c.execute('INSERT INTO attempts (exam_id, normalized_name, token, started_at) VALUES (?,?,?,?)',
+                  (exam_id, normalize_student_name(student_name), token, start_time))
+    except sqlite3.IntegrityError:
+        c.execute('SELECT token, submitted_at FROM attempts WHERE exam_id=? AND normalized_name=?',
+                  (exam_id, normalize_student_name(student_name)))
+        row = c.fetchone()
+        return row['token'], False, row['submitted_at'] is not None
+    c.execute('INSERT INTO sessions (token, exam_id, start_time, end_time, student_name, question_state, tag, class) VALUES (?,?,?,?,?,?,?,?)',
+              (token, exam_id, start_time, end_time, student_name or None, state_json, exam_tag, student_class))
+    return token, True, False
+
+def _write_issued_sessions(conn, exam_id, exam_tag, entries):
+    """Batch form of _write_session for pre-issued tokens; entries are (token, name, class, state_json)."""
+    out = []
+    for token, name, student_class, state_json in entries:
+        # start/end stay NULL until the student first opens the URL, so the timer starts then
+        tok, created, submitted = _write_session(conn, token, exam_id, None, None, name,
+                                                 state_json, exam_tag, student_class)
+        out.append((name, student_class, tok, created, submitted))
+    return out
+
+def issue_class_tokens(exam_id, class_name=None, base_url=''):
+    """
+    Issue one session per student on a class roster in a single write transaction, e.g. the
+    night before an exam. class_name defaults to the exam's tag. Students who already have an
+    attempt keep (and get back) their existing token. Returns the slip rows, or None if the
+    exam does not exist.
+    """
+    conn = db_conn(); c = conn.cursor()
+    c.execute('SELECT id, tag, started FROM exams WHERE id=?', (exam_id,))
+    ex = c.fetchone()
+    if not ex:
+        conn.close(); return None
+    class_name = class_name or ex['tag']
+    c.execute('SELECT student_name FROM class_students WHERE class_name=? ORDER BY student_name', (class_name,))
+    names = [r['student_name'].strip() for r in c.fetchall() if r['student_name'] and r['student_name'].strip()]
+    conn.close()
+
+    blueprint = get_exam_blueprint(exam_id)
+    if not blueprint['questions']:
+        raise ValueError('no questions for exam')
+    entries = []
+    # slips are usually printed while the exam is still closed: build those states inline
+    # rather than giving a closed exam a prebuilt pool
+    started = bool(ex['started'])
+    for name in names:
+        state_json = (session_pool.take(exam_id, True) if started else None) or dump_question_state(build_presentation(blueprint))
+        entries.append((str(uuid.uuid4())[:8], name, class_name, state_json))
+    issued = db_write(_write_issued_sessions, exam_id, ex['tag'], entries) if entries else []
+
+    base_url = (base_url or '').rstrip('/')
+    slips = []
+    for name, student_class, token, created, submitted in issued:
+        slips.append({
+            'name': name,
+            'class': student_class or '',
+            'token': token,
+            'url': base_url + '/exam/' + token,
+            'status': 'submitted' if submitted else ('issued' if created else 'existing'),
+        })
+    return slips
+
+def _activate_session(conn, token, start_time, end_time):
+    # conditional so two tabs opening a pre-issued token at once agree on one start time
+    c = conn.cursor()
+    c.execute('UPDATE sessions SET start_time=?, end_time=? WHERE token=? AND start_time IS NULL',
+              (start_time, end_time, token))
+    if c.rowcount:
+        c.execute('UPDATE attempts SET started_at=? WHERE token=?', (start_time, token))
+
 @app.route('/api/start_exam', methods=['POST'])
 def start_exam():
     data = request.json or {}
@@ -642,49 +1145,14 @@ def start_exam():
     if not student_name:
         conn.close(); return jsonify({'error': 'student_name required'}), 400
 
-    # prevent duplicate submissions: if there's already a result tied to this exam & student_name
-    try:
-        c.execute('SELECT 1 FROM results r JOIN sessions s ON r.token=s.token WHERE s.exam_id=? AND LOWER(s.student_name)=LOWER(?)', (exam_id, student_name))
-        if c.fetchone():
-            conn.close(); return jsonify({'error': 'already_submitted', 'message': 'Student has already submitted this exam'}), 403
-    except Exception:
-        # fall through if DB check fails
-        pass
-
-    # fetch questions and build per-session presentation state
-    c.execute('SELECT id, question, choices, answer_index FROM questions WHERE exam_id=?', (exam_id,))
-    qrows = c.fetchall()
-    if not qrows:
-        conn.close(); return jsonify({'error': 'no questions for exam'}), 400
-
-    qlist = []
-    for r in qrows:
-        choices = json.loads(r['choices'] or '[]')
-        qlist.append({'id': r['id'], 'question': r['question'], 'choices': choices, 'answer_index': int(r['answer_index'] or 0)})
-
-    # randomize question order
-    random.shuffle(qlist)
-
-    # for each question, shuffle choices and compute presented correct_index
-    question_state = []
-    for q in qlist:
-        choices = list(q['choices'])
-        random.shuffle(choices)
-        # find presented correct index by matching value of original correct choice
-        orig_correct_idx = int(q.get('answer_index', 0))
-        orig_choice_value = (q['choices'][orig_correct_idx] if orig_correct_idx < len(q['choices']) else None)
-        presented_correct = 0
-        if orig_choice_value is not None:
-            for i, val in enumerate(choices):
-                if val == orig_choice_value:
-                    presented_correct = i
-                    break
-        question_state.append({
-            'id': q['id'],
-            'question': q['question'],
-            'choices': choices,
-            'correct_index': presented_correct
-        })
+    # per-session presentation (order + choice permutations only): prebuilt when the exam
+    # was opened, built inline if the pool ran dry
+    state_json = session_pool.take(exam_id, True)
+    if state_json is None:
+        blueprint = get_exam_blueprint(exam_id)
+        if not blueprint['questions']:
+            conn.close(); return jsonify({'error': 'no questions for exam'}), 400
+        state_json = dump_question_state(build_presentation(blueprint))
 
     start_time = int(time.time())
     duration = int(ex['duration_minutes'] or 30) * 60
@@ -692,164 +1160,426 @@ def start_exam():
     token = str(uuid.uuid4())[:8]
     exam_tag = ex['tag'] if 'tag' in ex.keys() else None
 
-    c.execute('INSERT INTO sessions (token, exam_id, start_time, end_time, student_name, question_state, tag, class) VALUES (?,?,?,?,?,?,?,?)',
-              (token, exam_id, start_time, end_time, student_name or None, json.dumps(question_state), exam_tag, student_class or None))
-    conn.commit(); conn.close()
+    conn.close()
+    # one attempt per student: the attempts insert either claims (exam, name) or fails,
+    # in which case we resume the existing session (double-clicks) or refuse (already submitted)
+    token, created, submitted = db_write(_write_session, token, exam_id, start_time, end_time, student_name,
+                                         state_json, exam_tag, student_class or None)
+    if submitted:
+        return jsonify({'error': 'already_submitted', 'message': 'Student has already submitted this exam'}), 403
 
     url = request.host_url.rstrip('/') + url_for('exam_page', token=token)
-    return jsonify({'token': token, 'url': url})
-# (moved ensure_column('sessions', 'question_order', 'TEXT') into init_db to avoid calling an undefined local function)
-ensure_column('sessions', 'question_order', 'TEXT')
+    out = {'token': token, 'url': url}
+    if not created:
+        out['resumed'] = True
+    return jsonify(out)
+
+# Rendered exam pages per token. A started session's paper and end time never change, so the
+# page only goes stale when its exam's blueprint is invalidated (generation check below).
+EXAM_PAGE_CACHE_SIZE = int(os.environ.get('CBT_EXAM_PAGE_CACHE_SIZE', '2048'))
+_exam_page_cache = LRUCache(EXAM_PAGE_CACHE_SIZE)
+# papers longer than EXAM_INLINE_QUESTIONS ship only their first page inline; the page pulls
+# the rest from /api/exam/<token>/questions as the student moves through it
+EXAM_INLINE_QUESTIONS = int(os.environ.get('CBT_EXAM_INLINE_QUESTIONS', '30'))
+EXAM_QUESTION_PAGE = int(os.environ.get('CBT_EXAM_QUESTION_PAGE', '10'))
+# how late a submission is still accepted as posted; past it, a paper that sat in the page's
+# offline outbox is graded from the answers the session autosaved before its end_time
+SUBMIT_GRACE_SECONDS = int(os.environ.get('CBT_SUBMIT_GRACE_SECONDS', '120'))
+
+def _exam_page_response(body, etag):
+    if request.if_none_match.contains_weak(etag):
+        resp = Response(status=304)
+    else:
+        resp = Response(body, mimetype='text/html')
+    resp.set_etag(etag)
+    # always revalidate: a reload costs one conditional GET and a bodiless 304
+    resp.headers['Cache-Control'] = 'private, no-cache'
+    return resp
 
 @app.route('/exam/<token>')
 def exam_page(token):
+    cached = _exam_page_cache.get(token)
+    if cached is not None:
+        exam_id, generation, etag, body = cached
+        if _blueprint_generation.get(exam_id, 0) == generation:
+            return _exam_page_response(body, etag)
+        _exam_page_cache.pop(token)
+
     conn = db_conn()
     c = conn.cursor()
     c.execute('SELECT exam_id, start_time, end_time, question_state FROM sessions WHERE token=?', (token,))
     row = c.fetchone()
+    conn.close()
     if not row:
-        conn.close()
         abort(404, description="Invalid token")
 
     exam_id = row['exam_id']
+    if row['start_time'] is None:
+        # pre-issued token opened for the first time: start the clock now, if the exam is open
+        conn = db_conn(); c = conn.cursor()
+        c.execute('SELECT duration_minutes, started FROM exams WHERE id=?', (exam_id,))
+        ex = c.fetchone()
+        conn.close()
+        if not ex or not ex['started']:
+            return render_template('base_error.html', code=403,
+                                   message='This exam has not been opened yet. Please wait and refresh.'), 403
+        now = int(time.time())
+        db_write(_activate_session, token, now, now + int(ex['duration_minutes'] or 30) * 60)
+        conn = db_conn(); c = conn.cursor()
+        c.execute('SELECT exam_id, start_time, end_time, question_state FROM sessions WHERE token=?', (token,))
+        row = c.fetchone()
+        conn.close()
     end_time = row['end_time'] if 'end_time' in row.keys() else None
 
-    # Load the saved question state from sessions
-    try:
-        qs = json.loads(row['question_state'] or '[]')
-    except Exception:
+    # rebuild the presented paper (text, shuffled choices, image_path) from the exam blueprint
+    generation = _blueprint_generation.get(exam_id, 0)
+    blueprint = get_exam_blueprint(exam_id)
+    presented = present_questions(load_question_state(row['question_state']), blueprint)
+    qs = public_questions(presented)
+    question_index = None
+    if presented and shares_exam_content(blueprint) and all(q['perm'] is not None for q in presented):
+        # the page carries only this student's order + choice permutations; the question text comes
+        # from the exam's immutable content URL, which every student's browser (and proxy) shares
+        content_hash, _ = exam_content(blueprint)
+        question_index = {'ids': [q['id'] for q in presented], 'page_size': EXAM_QUESTION_PAGE,
+                          'perm': [q['perm'] for q in presented],
+                          'content_url': url_for('exam_content_json', exam_id=exam_id, content_hash=content_hash)}
         qs = []
+    elif len(qs) > EXAM_INLINE_QUESTIONS:
+        question_index = {'ids': [q['id'] for q in qs], 'page_size': EXAM_QUESTION_PAGE}
+        qs = qs[:EXAM_QUESTION_PAGE]
 
-    # --- 🔧 Add this part: fetch image paths from the questions table ---
-    image_map = {}
-    try:
-        c.execute("SELECT id, image_path FROM questions WHERE exam_id=?", (exam_id,))
-        for r in c.fetchall():
-            image_map[str(r['id'])] = r['image_path'] or ''
-    except Exception as e:
-        print("Error fetching image paths:", e)
-
-    # Merge image_path into each question
-    for q in qs:
-        qid = str(q.get('id'))
-        if qid in image_map:
-            q['image_path'] = image_map[qid]
-        else:
-            q.setdefault('image_path', '')
-
-    conn.close()
-
-    # Calculate remaining time
-    remaining = max(0, int(end_time - int(time.time()))) if end_time else 0
-
-    # Render the exam page with updated questions (now includes image_path)
-    return render_template(
+    # the page embeds the absolute end time; the client asks /api/exam/<token>/status for the clock
+    body = render_template(
         'exam.html',
         token=token,
         title=exam_id,
         questions=qs,
-        remaining_seconds=remaining
+        question_index=question_index,
+        end_time=int(end_time or 0)
     )
+    etag = hashlib.sha1(body.encode('utf-8')).hexdigest()[:20]
+    _exam_page_cache.put(token, (exam_id, generation, etag, body))
+    return _exam_page_response(body, etag)
+
+@app.route('/api/exam/<token>/questions')
+def exam_questions_page(token):
+    """A slice of the student's presented paper: ?offset=0&limit=10 (limit capped at 50)."""
+    try:
+        offset = max(0, int(request.args.get('offset', 0)))
+        limit = min(50, max(1, int(request.args.get('limit', EXAM_QUESTION_PAGE))))
+    except ValueError:
+        return jsonify({'error': 'offset and limit must be integers'}), 400
+    conn = db_conn(); c = conn.cursor()
+    c.execute('SELECT exam_id, start_time, question_state FROM sessions WHERE token=?', (token,))
+    row = c.fetchone()
+    conn.close()
+    if not row:
+        return jsonify({'error': 'invalid token'}), 404
+    if row['start_time'] is None:
+        return jsonify({'error': 'exam not started'}), 403
+    qs = public_questions(present_questions(load_question_state(row['question_state']),
+                                            get_exam_blueprint(row['exam_id'])))
+    return jsonify({'total': len(qs), 'offset': offset, 'limit': limit,
+                    'questions': qs[offset:offset + limit]})
+
+@app.route('/api/exam_content/<exam_id>/<content_hash>.json')
+def exam_content_json(exam_id, content_hash):
+    """Answer-free exam content at a content-addressed URL, cacheable by browsers and LAN proxies."""
+    body_hash, body = exam_content(get_exam_blueprint(exam_id))
+    if body_hash != content_hash:
+        # stale link (questions edited since the page was rendered): the page falls back to paging
+        resp = jsonify({'error': 'content changed'})
+        resp.status_code = 404
+        resp.headers['Cache-Control'] = 'no-store'
+        return resp
+    if request.if_none_match.contains_weak(body_hash):
+        resp = Response(status=304)
+    else:
+        resp = Response(body, mimetype='application/json')
+    resp.set_etag(body_hash)
+    resp.headers['Cache-Control'] = 'public, max-age=31536000, immutable'
+    return resp
+
+def exam_bundle_urls(token, exam_id, question_state):
+    """Every URL an exam page needs to keep working offline (see static/js/exam-sw.js)."""
+    urls = [url_for('exam_page', token=token)]
+    urls += [static_url(f) for f in ('css/exam.css', 'js/exam.js', 'logo.png', 'images/logo.ico')]
+    blueprint = get_exam_blueprint(exam_id)
+    presented = present_questions(load_question_state(question_state), blueprint)
+    if presented and shares_exam_content(blueprint) and all(q['perm'] is not None for q in presented):
+        urls.append(url_for('exam_content_json', exam_id=exam_id, content_hash=exam_content(blueprint)[0]))
+    elif len(presented) > EXAM_INLINE_QUESTIONS:
+        for offset in range(EXAM_QUESTION_PAGE, len(presented), EXAM_QUESTION_PAGE):
+            urls.append(url_for('exam_questions_page', token=token, offset=offset, limit=EXAM_QUESTION_PAGE))
+    for q in presented:
+        src = q['image_path']
+        if not src or src in urls:
+            continue
+        urls.append(src)
+        stem, ext = os.path.splitext(src)
+        for variant, _ in images.VARIANTS:
+            # processed uploads have size variants next to them; the page's srcset may pick one
+            rel = f'{stem}_{variant}{ext}'
+            path = safe_join(app.static_folder, rel[len('/static/'):]) if rel.startswith('/static/') else None
+            if path and os.path.isfile(path):
+                urls.append(rel)
+    return urls
+
+@app.route('/api/exam/<token>/manifest')
+def exam_manifest(token):
+    """The offline bundle for one exam session: {'version', 'urls'}."""
+    conn = db_conn(); c = conn.cursor()
+    c.execute('SELECT exam_id, start_time, question_state FROM sessions WHERE token=?', (token,))
+    row = c.fetchone()
+    conn.close()
+    if not row:
+        return jsonify({'error': 'invalid token'}), 404
+    if row['start_time'] is None:
+        return jsonify({'error': 'exam not started'}), 403
+    urls = exam_bundle_urls(token, row['exam_id'], row['question_state'])
+    resp = jsonify({'version': hashlib.sha1('\n'.join(urls).encode('utf-8')).hexdigest()[:12], 'urls': urls})
+    resp.headers['Cache-Control'] = 'no-cache'
+    return resp
+
+@app.route('/exam-sw.js')
+def exam_service_worker():
+    # served from the site root so it may control /exam/ pages; never cached long, so updates land
+    resp = send_from_directory(os.path.join(app.static_folder, 'js'), 'exam-sw.js',
+                               mimetype='text/javascript', max_age=0)
+    resp.headers['Cache-Control'] = 'no-cache'
+    return resp
+
+@app.route('/api/autosave/<token>', methods=['POST'])
+def autosave(token):
+    """
+    Answer deltas from the exam page: JSON {"answers": {question_id: "B", other_id: null}}.
+    null clears an answer. Buffered in memory and flushed in batches (see AutosaveBuffer).
+    """
+    data = request.get_json(silent=True) or {}
+    deltas = data.get('answers')
+    if not isinstance(deltas, dict) or len(deltas) > AUTOSAVE_MAX_DELTAS:
+        return jsonify({'error': 'answers must be an object of at most %d entries' % AUTOSAVE_MAX_DELTAS}), 400
+    clean = {}
+    for qid, ans in deltas.items():
+        if ans is None or ans == '':
+            clean[str(qid)[:64]] = None
+        else:
+            clean[str(qid)[:64]] = str(ans).strip().upper()[:8]
+
+    end_time = _autosave_sessions.get(token)
+    if end_time is None:
+        conn = db_conn(); c = conn.cursor()
+        c.execute('SELECT end_time FROM sessions WHERE token=?', (token,))
+        row = c.fetchone()
+        submitted = False
+        if row:
+            c.execute('SELECT 1 FROM results WHERE token=? LIMIT 1', (token,))
+            submitted = c.fetchone() is not None
+        conn.close()
+        if not row:
+            return jsonify({'error': 'invalid token'}), 404
+        end_time = -1 if submitted else (row['end_time'] or 0)
+        _autosave_sessions.put(token, end_time)
+    if end_time == -1:
+        return jsonify({'error': 'already submitted'}), 409
+    if end_time and int(time.time()) > end_time + SUBMIT_GRACE_SECONDS:
+        return jsonify({'error': 'exam time expired'}), 403
+
+    autosave_buffer.add(token, clean)
+    return jsonify({'ok': True, 'saved': len(clean)})
+
+@app.route('/api/exam/<token>/status')
+def exam_status(token):
+    """Server clock and time left for a session; the cached exam page syncs its timer with this."""
+    conn = db_conn(); c = conn.cursor()
+    c.execute('SELECT end_time FROM sessions WHERE token=?', (token,))
+    row = c.fetchone()
+    if not row:
+        conn.close(); return jsonify({'error': 'invalid token'}), 404
+    c.execute('SELECT 1 FROM results WHERE token=? LIMIT 1', (token,))
+    submitted = c.fetchone() is not None
+    conn.close()
+    now = int(time.time())
+    end_time = row['end_time'] or 0
+    resp = jsonify({
+        'server_time': now,
+        'end_time': end_time,
+        'remaining_seconds': max(0, end_time - now) if end_time else 0,
+        'submitted': submitted,
+        # server-side draft, so a student moved to another PC continues where they were
+        'answers': {} if submitted else autosave_buffer.answers(token),
+    })
+    resp.headers['Cache-Control'] = 'no-store'
+    return resp
+
+# Idempotent submits: the page sends one key per token (Idempotency-Key header or
+# request_id in the body) with every attempt. Once a result carries that key, further
+# attempts are answered with the stored score and touch nothing: no rewrite, no result
+# files, no audit entry. Recent keys are kept in memory so a retry storm never reaches SQLite.
+_submitted_keys = LRUCache(int(os.environ.get('CBT_SUBMIT_KEY_CACHE', '4096')))   # token -> (key, response)
+_submit_locks = [threading.Lock() for _ in range(64)]
+
+def _submit_lock(token):
+    return _submit_locks[hash(token) % len(_submit_locks)]
+
+def _stored_submission(c, token, request_id):
+    """{'score', 'total'} of the result written by request_id, or None."""
+    hit = _submitted_keys.get(token)
+    if hit and hit[0] == request_id:
+        return hit[1]
+    c.execute('SELECT score, total FROM results WHERE token=? AND request_id=?', (token, request_id))
+    row = c.fetchone()
+    if not row:
+        return None
+    out = {'score': row['score'], 'total': row['total']}
+    _submitted_keys.put(token, (request_id, out))
+    return out
+
+def _write_result(conn, rid, token, name, answers, score, submitted_at, total, response_rows, request_id=None):
+    """
+    Replace any prior result for this token and persist the new one including the session name.
+    Returns the stored {'score', 'total'} instead when request_id already produced the result
+    (a duplicate that raced past the check in submit, e.g. from another worker process).
+    """
+    c = conn.cursor()
+    if request_id:
+        c.execute('SELECT score, total FROM results WHERE token=? AND request_id=?', (token, request_id))
+        row = c.fetchone()
+        if row:
+            return {'score': row[0], 'total': row[1]}
+    c.execute('DELETE FROM responses WHERE result_id IN (SELECT id FROM results WHERE token=?)', (token,))
+    c.execute('DELETE FROM results WHERE token=?', (token,))
+    c.execute('INSERT INTO results (id,token,name,answers,score,submitted_at,total,request_id) VALUES (?,?,?,?,?,?,?,?)',
+              (rid, token, name, json.dumps(answers), score, submitted_at, total, request_id))
+    c.executemany('INSERT INTO responses (result_id, question_id, presented_index, selected_index, is_correct) VALUES (?,?,?,?,?)',
+                  [(rid,) + r for r in response_rows])
+    c.execute('UPDATE attempts SET submitted_at=? WHERE token=?', (submitted_at, token))
+    c.execute('DELETE FROM autosaves WHERE token=?', (token,))
+    return None
+
+def _replayed(out):
+    resp = jsonify(out)
+    resp.headers['Idempotent-Replayed'] = 'true'
+    return resp
 
 @app.route('/api/submit/<token>', methods=['POST'])
 def submit(token):
     """
     Submit answers for a session token.
     Use the student_name stored in the sessions row (ignore client-supplied name to avoid
-    accidental reuse/spoofing). Compute score from the per-session question_state and
-    persist answers_detail and name into results.
+    accidental reuse/spoofing). Compute score from the per-session question_state, persist
+    the result with the session name and one responses row per question.
+    A retry carrying the same idempotency key gets the stored result back unchanged.
     """
-    data = request.json or {}
+    data = request.get_json(silent=True) or {}
+    request_id = (request.headers.get('Idempotency-Key') or data.get('request_id') or '').strip()[:64] or None
+    if request_id:
+        hit = _submitted_keys.get(token)
+        if hit and hit[0] == request_id:
+            return _replayed(hit[1])
+        with _submit_lock(token):
+            return _submit(token, data, request_id)
+    return _submit(token, data, None)
+
+def _submit(token, data, request_id):
     answers = data.get('answers') or {}
 
     conn = db_conn(); c = conn.cursor()
+    if request_id:
+        stored = _stored_submission(c, token, request_id)
+        if stored:
+            conn.close(); return _replayed(stored)
     c.execute('SELECT exam_id, start_time, end_time, student_name FROM sessions WHERE token=?', (token,))
     row = c.fetchone()
     if not row:
         conn.close(); return jsonify({'error': 'invalid token'}), 400
 
-    # enforce time limit
+    # enforce time limit; the grace period covers submissions queued offline while the LAN was
+    # down. Past it the posted answers can't be trusted (the clock ran out long ago), so the
+    # paper is graded from what was autosaved before end_time, if anything
     now = int(time.time())
-    if 'end_time' in row.keys() and row['end_time'] and now > row['end_time']:
-        conn.close(); return jsonify({'error': 'exam time expired'}), 403
+    late = 'end_time' in row.keys() and row['end_time'] and now > row['end_time'] + SUBMIT_GRACE_SECONDS
+    if late:
+        c.execute('SELECT question_id, answer FROM autosaves WHERE token=? AND updated_at<=?', (token, row['end_time']))
+        answers = {r['question_id']: r['answer'] for r in c.fetchall()}
+        if not answers:
+            conn.close(); return jsonify({'error': 'exam time expired'}), 403
+        app.logger.info("late submission for %s (%ds past end_time): grading %d autosaved answers only",
+                        token, now - row['end_time'], len(answers))
 
     exam_id = row['exam_id']
 
+    # answers autosaved from this or another PC fill in whatever the final payload lacks
+    saved = autosave_buffer.answers(token) if not late else None
+    if saved:
+        answers = dict(saved, **answers)
+
     # Prefer the session-stored student name always (prevents a client reusing a different name).
     session_name = row['student_name'] if 'student_name' in row.keys() and row['student_name'] else None
     name = session_name or (data.get('name') or '').strip()
 
-    # load the per-session question_state (presentation order + shuffled choices)
+    # rebuild the presented paper from the compact session state + exam blueprint
     c.execute('SELECT question_state FROM sessions WHERE token=?', (token,))
     srow = c.fetchone()
-    try:
-        qstate = json.loads(srow['question_state'] or '[]') if srow else []
-    except Exception:
-        qstate = []
+    blueprint = get_exam_blueprint(exam_id)
+    qstate = present_questions(load_question_state(srow['question_state'] if srow else None), blueprint)
 
-    # build detailed answers and compute score using session's correct_index
-    score = 0
-    answers_detail = []
-    for q in qstate:
-        qid = q.get('id')
-        qtext = q.get('question') or ''
-        choices = q.get('choices') or []
-        correct_index = int(q.get('correct_index') or 0)
-
-        # accept either numeric index or letter (a/b/c...) from client
-        sel_idx = None
-        try:
-            raw = answers.get(qid)
-            if raw is None or raw == '':
-                sel_idx = None
-            elif isinstance(raw, (int, float)):
-                sel_idx = int(raw)
-            else:
-                s = str(raw).strip()
-                if s.isdigit():
-                    sel_idx = int(s)
-                elif len(s) >= 1 and s[0].isalpha():
-                    sel_idx = ord(s[0].upper()) - 65
-                else:
-                    sel_idx = None
-        except Exception:
-            sel_idx = None
-
-        sel_text = (choices[sel_idx] if (sel_idx is not None and 0 <= sel_idx < len(choices)) else '')
-        correct_text = (choices[correct_index] if 0 <= correct_index < len(choices) else '')
-        is_correct = (sel_idx is not None and sel_idx == correct_index)
-        if is_correct:
-            score += 1
+    # grade the whole paper in one vectorized pass against the session's presented key
+    qids = [q['id'] for q in qstate]
+    selected = grading.selections(answers, qids)
+    score, correct = grading.grade(grading.as_key([q['correct_index'] for q in qstate]), selected)
 
-        sel_label = (chr(65 + sel_idx) if (sel_idx is not None and 0 <= sel_idx < 26) else None)
+    # build per-question responses rows and the compact summary for the per-subject result files
+    answers_detail = []
+    response_rows = []
+    for pos, q in enumerate(qstate):
+        qid = q['id']
+        choices = q['choices']
+        correct_index = q['correct_index']
+        sel_idx = int(selected[pos])
+        is_correct = bool(correct[pos])
+        sel_valid = 0 <= sel_idx < len(choices)
+
+        sel_label = chr(65 + sel_idx) if 0 <= sel_idx < 26 else None
         correct_label = (chr(65 + correct_index) if 0 <= correct_index < 26 else None)
 
+        # map the presented option back to its index in questions.choices
+        canonical_sel = None
+        if sel_valid and q['perm'] is not None:
+            canonical_sel = q['perm'][sel_idx]
+        elif sel_valid and qid in blueprint['by_id']:
+            try:
+                canonical_sel = blueprint['by_id'][qid]['choices'].index(choices[sel_idx])
+            except ValueError:
+                canonical_sel = None
+        response_rows.append((qid, pos, canonical_sel, 1 if is_correct else 0))
+
         answers_detail.append({
             'id': qid,
-            'question': qtext,
-            'choices': choices,
-            'selected_index': sel_idx,
             'selected_label': sel_label,
-            'selected_text': sel_text,
-            'correct_index': correct_index,
             'correct_label': correct_label,
-            'correct_text': correct_text,
-            'is_correct': bool(is_correct)
+            'is_correct': is_correct
         })
 
     submitted_at = int(time.time())
     rid = str(uuid.uuid4())[:8]
 
-    # Replace any prior result for this token and persist new result including the session name.
-    c.execute('DELETE FROM results WHERE token=?', (token,))
+    conn.close()
+    _autosave_sessions.put(token, -1)       # stop taking autosaves for this session
+    autosave_buffer.discard(token)
     try:
-        c.execute('INSERT INTO results (id,token,name,answers,answers_detail,score,submitted_at,total) VALUES (?,?,?,?,?,?,?,?)',
-                  (rid, token, name, json.dumps(answers), json.dumps(answers_detail), score, submitted_at, len(qstate)))
-    except sqlite3.OperationalError:
-        # fallback if schema missing optional columns
-        c.execute('INSERT INTO results (id,token,answers,score,submitted_at) VALUES (?,?,?,?,?)',
-                  (rid, token, json.dumps(answers), score, submitted_at))
-    conn.commit(); conn.close()
+        stored = db_write(_write_result, rid, token, name, answers, score, submitted_at, len(qstate), response_rows, request_id)
+    except Exception:
+        _autosave_sessions.pop(token)
+        raise
+    if stored:
+        _submitted_keys.put(token, (request_id, stored))
+        return _replayed(stored)
+    if request_id:
+        _submitted_keys.put(token, (request_id, {'score': score, 'total': len(qstate)}))
+    else:
+        _submitted_keys.pop(token)
 
     # persist to per-subject files (best-effort)
     try:
@@ -884,14 +1614,25 @@ def _sanitize_filename(s: str) -> str:
     s = re.sub(r'[^a-z0-9_\-\.]', '', s)
     return s[:120] or 'unknown'
 
-def save_result_to_excel(name, token, exam_id, score, total, submitted_at, answers_detail=None):
-    """
-    Save results using the exam TITLE instead of the teacher.subject field.
-    Each subject (exam title) will have its own result file.
-    """
+# =====================================
+# Per-subject result files
+# =====================================
+#
+# Every submission is also recorded in results_<subject>.csv and, for tagged exams,
+# results_tag_<tag>.csv. Those CSVs are append-only journals (journal.py: locked, fsync'd);
+# the matching .xlsx workbooks are materialized from them every RESULT_XLSX_INTERVAL_S
+# and on download, instead of re-reading and rewriting the workbook per submission.
+# Submit only queues the row; one background worker drains the queue and appends each
+# journal once per batch, however many rows for it arrived meanwhile.
+
+RESULT_FILES_DELAY_MS = int(os.environ.get('CBT_RESULT_FILES_DELAY_MS', '500'))
+RESULT_XLSX_INTERVAL_S = int(os.environ.get('CBT_RESULT_XLSX_INTERVAL_S', '30'))
+
+def _result_file_targets(exam_id, row_fields):
+    """(row, [journal paths]) for one submission; the exam title names the subject file."""
+    name, token, score, total, submitted_at, answers_detail = row_fields
     exam_title = ''
     exam_tag = ''
-
     try:
         conn = db_conn()
         c = conn.cursor()
@@ -907,11 +1648,9 @@ def save_result_to_excel(name, token, exam_id, score, total, submitted_at, answe
         exam_title = f"exam_{exam_id}"
         exam_tag = ''
 
-    # ✅ Build safe filenames based on title/tag
     subject_label = _sanitize_filename(exam_title or f"exam_{exam_id}")
-    tag_label = _sanitize_filename(exam_tag or '')
+    tag_label = _sanitize_filename(exam_tag or '') if exam_tag else ''
 
-    # ✅ Build data row
     row = {
         'tag': exam_tag or '',
         'subject': exam_title or '',
@@ -921,76 +1660,177 @@ def save_result_to_excel(name, token, exam_id, score, total, submitted_at, answe
         'total': total,
         'submitted_at': datetime.fromtimestamp(submitted_at).isoformat()
     }
-
-    # ✅ Include answers if present
     if answers_detail is not None:
         row['answers_detail'] = json.dumps(answers_detail, ensure_ascii=False)
 
-    # ✅ Save to XLSX & CSV using exam title as file name
-    fname_xlsx = os.path.join(BASE_DIR, f'results_{subject_label}.xlsx')
-    fname_csv = os.path.join(BASE_DIR, f'results_{subject_label}.csv')
-    fname_tag_xlsx = os.path.join(BASE_DIR, f'results_tag_{tag_label}.xlsx') if tag_label else None
-    fname_tag_csv = os.path.join(BASE_DIR, f'results_tag_{tag_label}.csv') if tag_label else None
-
-    if pd:
-        try:
-            df_row = pd.DataFrame([row])
-            if os.path.exists(fname_xlsx):
+    labels = [f'results_{subject_label}'] + ([f'results_tag_{tag_label}'] if tag_label else [])
+    return row, [os.path.join(BASE_DIR, label + '.csv') for label in labels]
+
+def _xlsx_for(journal_path):
+    return os.path.splitext(journal_path)[0] + '.xlsx'
+
+class ResultFileWriter:
+    def __init__(self, delay_ms, xlsx_interval_s):
+        self.delay = max(0.0, delay_ms / 1000.0)
+        self.xlsx_interval = max(1, xlsx_interval_s)
+        self._cond = threading.Condition()
+        self._queue = deque()            # (enqueued_at, exam_id, row fields)
+        self._dirty = set()              # journals appended to since their xlsx was last built
+        self._last_materialize = 0.0
+        self._thread = None
+        # held while files are written; rebuild_result_files takes it too
+        self.write_lock = threading.RLock()
+        self.enqueued = 0
+        self.rows_written = 0
+        self.file_writes = 0
+        self.batches = 0
+        self.errors = 0
+        self.last_lag_ms = 0
+        self.max_lag_ms = 0
+        self.materialized = 0
+
+    def put(self, exam_id, *row_fields):
+        with self._cond:
+            self._queue.append((time.time(), exam_id, row_fields))
+            self.enqueued += 1
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='result-files', daemon=True)
+                self._thread.start()
+            self._cond.notify()
+
+    def discard_tokens(self, tokens):
+        """Drop queued rows for tokens whose files were just rebuilt from the database (hold write_lock)."""
+        tokens = set(tokens)
+        with self._cond:
+            kept = [item for item in self._queue if item[2][1] not in tokens]
+            dropped = len(self._queue) - len(kept)
+            self._queue = deque(kept)
+        return dropped
+
+    def flush(self):
+        """Write everything queued so far; returns the number of rows written."""
+        _ensure_result_journals()
+        with self.write_lock:
+            with self._cond:
+                batch, self._queue = list(self._queue), deque()
+            if not batch:
+                return 0
+            by_path = OrderedDict()
+            for _, exam_id, fields in batch:
                 try:
-                    existing = pd.read_excel(fname_xlsx)
-                    df = pd.concat([existing, df_row], ignore_index=True)
+                    row, paths = _result_file_targets(exam_id, fields)
                 except Exception:
-                    df = df_row
-            else:
-                df = df_row
-
-            df.to_excel(fname_xlsx, index=False)
-
-            # Tag-based copies
-            if tag_label:
+                    self.errors += 1
+                    app.logger.exception("could not build result row for exam %s", exam_id)
+                    continue
+                for path in paths:
+                    by_path.setdefault(path, []).append(row)
+            for path, rows in by_path.items():
                 try:
-                    if os.path.exists(fname_tag_xlsx):
-                        existing_tag = pd.read_excel(fname_tag_xlsx)
-                        df_tag = pd.concat([existing_tag, df_row], ignore_index=True)
-                    else:
-                        df_tag = df_row
-                    df_tag.to_excel(fname_tag_xlsx, index=False)
+                    journal.append(path, rows)
+                    self.file_writes += 1
+                    with self._cond:
+                        self._dirty.add(path)
                 except Exception:
-                    pass
+                    self.errors += 1
+                    app.logger.exception("failed to write %d row(s) to %s", len(rows), path)
+            lag = int((time.time() - batch[0][0]) * 1000)
+            self.last_lag_ms = lag
+            self.max_lag_ms = max(self.max_lag_ms, lag)
+            self.batches += 1
+            self.rows_written += len(batch)
+            return len(batch)
+
+    def materialize(self, journal_path=None):
+        """
+        Rebuild the xlsx of journal_path (after writing out queued rows), or of every
+        journal appended to since the last pass. Returns the number of workbooks written.
+        """
+        if pd is None:
+            return 0
+        _ensure_result_journals()
+        if journal_path is not None:
+            self.flush()
+            paths = [journal_path]
+        else:
+            with self._cond:
+                paths, self._dirty = sorted(self._dirty), set()
+            self._last_materialize = time.time()
+        written = 0
+        for path in paths:
+            try:
+                if journal.materialize(path, _xlsx_for(path)):
+                    written += 1
+            except Exception:
+                self.errors += 1
+                app.logger.exception("failed to materialize %s", _xlsx_for(path))
+        self.materialized += written
+        return written
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._queue:
+                    due = self._last_materialize + self.xlsx_interval - time.time()
+                    if self._dirty and due <= 0:
+                        break
+                    self._cond.wait(due if self._dirty else None)
+                has_rows = bool(self._queue)
+            try:
+                if has_rows:
+                    time.sleep(self.delay)          # let a burst of submissions pile up into one batch
+                    self.flush()
+                if self._dirty and time.time() - self._last_materialize >= self.xlsx_interval:
+                    self.materialize()
+            except Exception:
+                app.logger.exception("result file writer loop error")
+
+    def stats(self):
+        with self._cond:
+            queued = len(self._queue)
+            oldest = self._queue[0][0] if self._queue else None
+            dirty = len(self._dirty)
+        return {'queued': queued, 'lag_ms': int((time.time() - oldest) * 1000) if oldest else 0,
+                'last_lag_ms': self.last_lag_ms, 'max_lag_ms': self.max_lag_ms, 'enqueued': self.enqueued,
+                'rows_written': self.rows_written, 'file_writes': self.file_writes, 'batches': self.batches,
+                'errors': self.errors, 'delay_ms': int(self.delay * 1000),
+                'xlsx_stale': dirty, 'xlsx_materialized': self.materialized, 'xlsx_interval_s': self.xlsx_interval}
+
+result_file_writer = ResultFileWriter(RESULT_FILES_DELAY_MS, RESULT_XLSX_INTERVAL_S)
+atexit.register(result_file_writer.materialize)
+atexit.register(result_file_writer.flush)           # atexit runs last-registered first
 
-            # Always keep a CSV version for each
-            df.to_csv(fname_csv, index=False)
-            if tag_label:
-                try:
-                    df.to_csv(fname_tag_csv, index=False)
-                except Exception:
-                    pass
-            return
-        except Exception:
-            app.logger.exception("Failed to write xlsx for exam %s", exam_title)
-
-    # Fallback to CSV append
-    write_header = not os.path.exists(fname_csv)
-    fieldnames = list(row.keys())
-    with open(fname_csv, 'a', newline='', encoding='utf-8') as fh:
-        writer = csv.DictWriter(fh, fieldnames=fieldnames)
-        if write_header:
-            writer.writeheader()
-        writer.writerow(row)
-
-    if tag_label:
-        write_header_t = not os.path.exists(fname_tag_csv)
-        with open(fname_tag_csv, 'a', newline='', encoding='utf-8') as fh2:
-            writer2 = csv.DictWriter(fh2, fieldnames=fieldnames)
-            if write_header_t:
-                writer2.writeheader()
-            writer2.writerow(row)
+def save_result_to_excel(name, token, exam_id, score, total, submitted_at, answers_detail=None):
+    """
+    Queue a submission for the per-subject result files (named after the exam TITLE, not
+    teacher.subject). Returns at once; result_file_writer writes it in the background.
+    """
+    result_file_writer.put(exam_id, name, token, score, total, submitted_at, answers_detail)
 
 @app.route('/api/results_csv/<exam_id>')
 def results_csv(exam_id):
     # endpoint disabled temporarily while we rework export logic
     return jsonify({'error': 'results_csv disabled temporarily'}), 410
 
+def _write_uploaded_students(conn, exam_id, names, class_name):
+    c = conn.cursor()
+    inserted = 0
+    for name in names:
+        if not name: continue
+        c.execute('SELECT id FROM registered_students WHERE exam_id=? AND LOWER(student_name)=LOWER(?)', (exam_id, name))
+        if c.fetchone(): continue
+        sid = str(uuid.uuid4())[:8]
+        c.execute('INSERT INTO registered_students (id,exam_id,student_name) VALUES (?,?,?)', (sid, exam_id, name))
+        # also attach to class if requested
+        if class_name:
+            try:
+                csid = str(uuid.uuid4())[:8]
+                c.execute('INSERT INTO class_students (id,class_name,student_name) VALUES (?,?,?)', (csid, class_name, name))
+            except Exception:
+                pass
+        inserted += 1
+    return inserted
+
 @app.route('/api/upload_students', methods=['POST'])
 def upload_students():
     exam_id = request.form.get('exam_id')
@@ -1021,22 +1861,8 @@ def upload_students():
     except Exception:
         conn.close(); return jsonify({'error': 'Failed parsing file'}), 400
 
-    inserted = 0
-    for name in names:
-        if not name: continue
-        c.execute('SELECT id FROM registered_students WHERE exam_id=? AND LOWER(student_name)=LOWER(?)', (exam_id, name))
-        if c.fetchone(): continue
-        sid = str(uuid.uuid4())[:8]
-        c.execute('INSERT INTO registered_students (id,exam_id,student_name) VALUES (?,?,?)', (sid, exam_id, name))
-        # also attach to class if requested
-        if class_name:
-            try:
-                csid = str(uuid.uuid4())[:8]
-                c.execute('INSERT INTO class_students (id,class_name,student_name) VALUES (?,?,?)', (csid, class_name, name))
-            except Exception:
-                pass
-        inserted += 1
-    conn.commit(); conn.close()
+    conn.close()
+    inserted = db_write(_write_uploaded_students, exam_id, names, class_name)
     return jsonify({'ok': True, 'count': inserted})
 
 @app.route('/api/add_student', methods=['POST'])
@@ -1053,9 +1879,9 @@ def add_student():
     c.execute('SELECT id FROM registered_students WHERE exam_id=? AND LOWER(student_name)=LOWER(?)', (exam_id, name))
     if c.fetchone():
         conn.close(); return jsonify({'ok': True, 'note': 'already registered'})
+    conn.close()
     sid = str(uuid.uuid4())[:8]
-    c.execute('INSERT INTO registered_students (id,exam_id,student_name) VALUES (?,?,?)', (sid, exam_id, name))
-    conn.commit(); conn.close()
+    db_execute('INSERT INTO registered_students (id,exam_id,student_name) VALUES (?,?,?)', (sid, exam_id, name))
     return jsonify({'ok': True, 'student_id': sid})
 
 @app.route('/api/list_students/<exam_id>')
@@ -1182,6 +2008,82 @@ def teacher_student_scores():
         'overall_avg': overall_avg
     })
 
+@app.route('/api/question_stats/<exam_id>')
+def question_stats(exam_id):
+    """
+    Per-question item analysis for an exam, computed set-based from the responses table:
+    attempts, correct, skipped, facility (% correct) and how often each option was chosen.
+    Available to the exam's teacher (X-Teacher-Token) or an admin.
+    """
+    teacher = get_teacher_from_request()
+    if not teacher and not is_admin_request():
+        return jsonify({'error': 'teacher or admin auth required'}), 401
+
+    conn = db_conn(); c = conn.cursor()
+    try:
+        c.execute('SELECT id, title, teacher_id FROM exams WHERE id=?', (exam_id,))
+        ex = c.fetchone()
+        if not ex:
+            return jsonify({'error': 'exam not found'}), 404
+        if teacher and not is_admin_request() and ex['teacher_id'] and ex['teacher_id'] != teacher['id']:
+            return jsonify({'error': 'not allowed to view this exam'}), 403
+
+        c.execute('''
+            SELECT q.id, q.question, q.choices, q.answer_index,
+                   COUNT(rs.result_id) AS attempts,
+                   COALESCE(SUM(rs.is_correct), 0) AS correct,
+                   COALESCE(SUM(rs.selected_index IS NULL), 0) AS skipped
+            FROM questions q
+            LEFT JOIN responses rs ON rs.question_id = q.id
+            WHERE q.exam_id = ?
+            GROUP BY q.id
+        ''', (exam_id,))
+        rows = c.fetchall()
+
+        c.execute('''
+            SELECT rs.question_id, rs.selected_index, COUNT(1) AS cnt
+            FROM responses rs
+            JOIN questions q ON q.id = rs.question_id
+            WHERE q.exam_id = ? AND rs.selected_index IS NOT NULL
+            GROUP BY rs.question_id, rs.selected_index
+        ''', (exam_id,))
+        picks = {}
+        for r in c.fetchall():
+            picks.setdefault(r['question_id'], {})[r['selected_index']] = r['cnt']
+
+        c.execute('''
+            SELECT rs.result_id, rs.question_id, rs.is_correct
+            FROM responses rs
+            JOIN questions q ON q.id = rs.question_id
+            WHERE q.exam_id = ?
+        ''', (exam_id,))
+        _, matrix, seen = grading.matrix_from_rows(c.fetchall(), [r['id'] for r in rows])
+        discrimination = grading.item_stats(matrix, seen)['discrimination']
+    finally:
+        conn.close()
+
+    out = []
+    for j, r in enumerate(rows):
+        try:
+            choices = json.loads(r['choices'] or '[]')
+        except Exception:
+            choices = []
+        counts = picks.get(r['id'], {})
+        attempts = r['attempts'] or 0
+        out.append({
+            'id': r['id'],
+            'question': r['question'],
+            'answer_index': r['answer_index'],
+            'attempts': attempts,
+            'correct': r['correct'],
+            'skipped': r['skipped'],
+            'facility': round(r['correct'] * 100.0 / attempts, 1) if attempts else 0,
+            # top 27% minus bottom 27% of candidates by total score; near 0 or negative = check the key
+            'discrimination': discrimination[j] if j < len(discrimination) else None,
+            'choice_counts': [counts.get(i, 0) for i in range(len(choices))]
+        })
+    return jsonify({'ok': True, 'exam_id': exam_id, 'title': ex['title'], 'questions': out})
+
 @app.route('/api/login_teacher', methods=['POST'])
 def login_teacher():
     data = request.json or {}
@@ -1227,10 +2129,10 @@ def teacher_create_exam():
     except Exception:
         duration = 30
     tag = (data.get('tag') or '').strip() or None
+    sample_size, sample_by_topic = parse_sampling(data)
     exam_id = str(uuid.uuid4())[:8]
-    conn = db_conn(); c = conn.cursor()
-    c.execute('INSERT INTO exams (id,title,duration_minutes,teacher_id,tag) VALUES (?,?,?,?,?)', (exam_id, title, duration, teacher['id'], tag))
-    conn.commit(); conn.close()
+    db_execute('INSERT INTO exams (id,title,duration_minutes,teacher_id,tag,sample_size,sample_by_topic) VALUES (?,?,?,?,?,?,?)',
+               (exam_id, title, duration, teacher['id'], tag, sample_size, sample_by_topic))
     return jsonify({'ok': True, 'exam_id': exam_id})
 
 @app.route('/api/set_exam_state', methods=['POST'])
@@ -1242,21 +2144,452 @@ def set_exam_state():
         return jsonify({'error': 'admin auth required'}), 401
     if not exam_id:
         return jsonify({'error': 'exam_id required'}), 400
-    conn = db_conn(); c = conn.cursor()
-    c.execute('UPDATE exams SET started=? WHERE id=?', (1 if started else 0, exam_id))
-    conn.commit(); conn.close()
+    db_execute('UPDATE exams SET started=? WHERE id=?', (1 if started else 0, exam_id))
+    if started:
+        session_pool.open_exam(exam_id)
+    else:
+        session_pool.close_exam(exam_id)
     return jsonify({'ok': True, 'exam_id': exam_id, 'started': started})
 
+@app.route('/api/set_exam_sampling', methods=['POST'])
+def set_exam_sampling():
+    """
+    Serve each student K questions drawn from the exam's bank instead of all of them.
+    JSON: { "exam_id": "...", "sample_size": 40 (0/null = all), "stratify": true (spread over topics) }
+    """
+    data = request.get_json(silent=True) or {}
+    exam_id = data.get('exam_id')
+    teacher = get_teacher_from_request()
+    if not exam_id:
+        return jsonify({'error': 'exam_id required'}), 400
+    conn = db_conn(); c = conn.cursor()
+    c.execute('SELECT teacher_id FROM exams WHERE id=?', (exam_id,))
+    er = c.fetchone()
+    conn.close()
+    if not er:
+        return jsonify({'error': 'exam not found'}), 404
+    if not is_admin_request() and not (teacher and er['teacher_id'] == teacher['id']):
+        return jsonify({'error': 'not allowed'}), 403
+    sample_size, sample_by_topic = parse_sampling(data)
+    db_execute('UPDATE exams SET sample_size=?, sample_by_topic=? WHERE id=?', (sample_size, sample_by_topic, exam_id))
+    invalidate_exam_blueprint(exam_id)
+    return jsonify({'ok': True, 'exam_id': exam_id, 'sample_size': sample_size, 'stratify': bool(sample_by_topic)})
+
+# =====================================
+# Regrading after an answer key fix
+# =====================================
+#
+# A corrected answer_index is applied to every stored response in one set-based pass
+# inside a single writer transaction: responses.is_correct is recomputed per question
+# and results.score re-summed for just the results that answered those questions.
+# The per-subject result files are then rewritten from the database.
+
+def parse_key_fixes(items):
+    """[{question_id, answer_index}] or {question_id: answer_index} -> {qid: int}; ValueError on bad input."""
+    if isinstance(items, dict):
+        items = [{'question_id': k, 'answer_index': v} for k, v in items.items()]
+    if not isinstance(items, list) or not items:
+        raise ValueError('fixes must be a non-empty list of {question_id, answer_index}')
+    fixes = {}
+    for it in items:
+        if not isinstance(it, dict) or not it.get('question_id'):
+            raise ValueError('each fix needs question_id and answer_index')
+        idx = grading.parse_choice(it.get('answer_index'))
+        if idx == grading.NO_ANSWER:
+            raise ValueError(f"bad answer_index for {it['question_id']}")
+        fixes[str(it['question_id'])] = idx
+    return fixes
+
+def _write_regrade(conn, fixes):
+    c = conn.cursor()
+    qids = json.dumps(list(fixes))
+    c.executemany('UPDATE questions SET answer_index=? WHERE id=?', [(i, q) for q, i in fixes.items()])
+    c.executemany('UPDATE responses SET is_correct=(selected_index IS NOT NULL AND selected_index=?) WHERE question_id=?',
+                  [(i, q) for q, i in fixes.items()])
+    c.execute('''
+        UPDATE results SET score=(SELECT COALESCE(SUM(is_correct), 0) FROM responses WHERE result_id=results.id)
+        WHERE id IN (SELECT DISTINCT result_id FROM responses WHERE question_id IN (SELECT value FROM json_each(?)))
+    ''', (qids,))
+    return c.rowcount
+
+def regrade_questions(fixes, teacher=None):
+    """
+    Apply corrected answer keys {question_id: answer_index} and rescore every affected result.
+    teacher (a teachers row) limits the fix to that teacher's exams; None = admin.
+    Raises ValueError for unknown questions / out-of-range indexes and PermissionError
+    for another teacher's exam. Returns {questions, exams, results, files}.
+    """
+    conn = db_conn(); c = conn.cursor()
+    c.execute('''
+        SELECT q.id, q.exam_id, q.choices, q.answer_index, e.teacher_id
+        FROM questions q LEFT JOIN exams e ON e.id = q.exam_id
+        WHERE q.id IN (SELECT value FROM json_each(?))
+    ''', (json.dumps(list(fixes)),))
+    rows = {r['id']: r for r in c.fetchall()}
+    conn.close()
+    missing = [q for q in fixes if q not in rows]
+    if missing:
+        raise ValueError('unknown question(s): ' + ', '.join(missing[:10]))
+    changed = {}
+    for qid, idx in fixes.items():
+        r = rows[qid]
+        try:
+            n = len(json.loads(r['choices'] or '[]'))
+        except Exception:
+            n = 0
+        if not 0 <= idx < n:
+            raise ValueError(f'answer_index {idx} out of range for {qid} ({n} choices)')
+        if teacher is not None and r['teacher_id'] != teacher['id']:
+            raise PermissionError(f'question {qid} belongs to another teacher')
+        if idx != r['answer_index']:
+            changed[qid] = idx
+    exam_ids = sorted({rows[q]['exam_id'] for q in changed})
+
+    rescored = db_write(_write_regrade, changed) if changed else 0
+    if rescored:
+        _submitted_keys.clear()         # replayed submits must report the new scores
+    for exam_id in exam_ids:
+        invalidate_exam_blueprint(exam_id)
+    files = rebuild_result_files(exam_ids) if exam_ids else []
+    return {'questions': len(changed), 'unchanged': len(fixes) - len(changed),
+            'exams': exam_ids, 'results': rescored, 'files': files}
+
+def _answers_detail(question_state, blueprint, selected):
+    """answers_detail (presented order/labels) rebuilt from stored canonical selections {qid: index}."""
+    out = []
+    for q in present_questions(load_question_state(question_state), blueprint):
+        bq = blueprint['by_id'].get(q['id'])
+        canon = selected.get(q['id'])
+        sel = correct = -1
+        if q['perm'] is not None:
+            correct = q['correct_index']
+            sel = q['perm'].index(canon) if canon in q['perm'] else -1
+        elif bq:
+            # legacy paper: match stored option text against the presented choices
+            def presented(i):
+                try:
+                    return q['choices'].index(bq['choices'][i])
+                except (IndexError, ValueError):
+                    return -1
+            correct = presented(bq['answer_index'])
+            sel = presented(canon) if canon is not None else -1
+        out.append({
+            'id': q['id'],
+            'selected_label': chr(65 + sel) if 0 <= sel < 26 else None,
+            'correct_label': chr(65 + correct) if 0 <= correct < 26 else None,
+            'is_correct': sel >= 0 and sel == correct,
+        })
+    return out
+
+def rebuild_result_files(exam_ids, create=False):
+    """
+    Rewrite the results_<subject>.* / results_tag_<tag>.* files that cover exam_ids from the
+    database (same rows save_result_to_excel appends): the journal is replaced atomically and
+    its xlsx materialized again. Only files that already exist are rebuilt unless create is
+    set (then missing files with at least one result are written too). Returns the
+    rewritten file names.
+    """
+    conn = db_conn(); c = conn.cursor()
+    c.execute('SELECT id, title, tag FROM exams')
+    exams = {r['id']: ((r['title'] or '').strip(), (r['tag'] or '').strip()) for r in c.fetchall()}
+    groups = {}        # file label -> exam ids writing to it
+    for eid in exam_ids:
+        title, tag = exams.get(eid, ('', ''))
+        groups.setdefault(f'results_{_sanitize_filename(title or f"exam_{eid}")}', set())
+        if tag:
+            groups.setdefault(f'results_tag_{_sanitize_filename(tag)}', set())
+    for eid, (title, tag) in exams.items():
+        subject_file = f'results_{_sanitize_filename(title or f"exam_{eid}")}'
+        if subject_file in groups:
+            groups[subject_file].add(eid)
+        if tag and f'results_tag_{_sanitize_filename(tag)}' in groups:
+            groups[f'results_tag_{_sanitize_filename(tag)}'].add(eid)
+
+    written = []
+    rebuilt_tokens = set()
+    # write out what is queued, then rebuild; rows queued meanwhile for results the rebuild
+    # already contains are dropped so they are not appended a second time
+    result_file_writer.write_lock.acquire()
+    try:
+        result_file_writer.flush()
+        for label, eids in sorted(groups.items()):
+            path = os.path.join(BASE_DIR, label + '.csv')
+            exists = os.path.exists(path) or os.path.exists(_xlsx_for(path))
+            if not exists and not create:
+                continue
+            c.execute('''
+                SELECT r.id, r.token, r.name, r.score, r.total, r.submitted_at, s.exam_id, s.question_state
+                FROM results r JOIN sessions s ON s.token = r.token
+                WHERE s.exam_id IN (SELECT value FROM json_each(?))
+                ORDER BY r.submitted_at, r.rowid
+            ''', (json.dumps(sorted(eids)),))
+            results = c.fetchall()
+            c.execute('''
+                SELECT rs.result_id, rs.question_id, rs.selected_index
+                FROM responses rs JOIN results r ON r.id = rs.result_id JOIN sessions s ON s.token = r.token
+                WHERE s.exam_id IN (SELECT value FROM json_each(?))
+            ''', (json.dumps(sorted(eids)),))
+            selected = {}
+            for r in c.fetchall():
+                selected.setdefault(r['result_id'], {})[r['question_id']] = r['selected_index']
+            rows = []
+            for r in results:
+                title, tag = exams.get(r['exam_id'], ('', ''))
+                rows.append({
+                    'tag': tag,
+                    'subject': title,
+                    'name': r['name'] or '',
+                    'token': r['token'],
+                    'score': r['score'],
+                    'total': r['total'],
+                    'submitted_at': datetime.fromtimestamp(r['submitted_at']).isoformat() if r['submitted_at'] else '',
+                    'answers_detail': json.dumps(_answers_detail(r['question_state'], get_exam_blueprint(r['exam_id']),
+                                                                 selected.get(r['id'], {})), ensure_ascii=False),
+                })
+            if not rows and not exists:
+                continue
+            rebuilt_tokens.update(r['token'] for r in rows)
+            try:
+                journal.replace(path, rows)
+                written.append(os.path.basename(path))
+                if journal.materialize(path, _xlsx_for(path), force=True):
+                    written.append(os.path.basename(_xlsx_for(path)))
+            except Exception:
+                app.logger.exception('failed to rebuild %s', path)
+        result_file_writer.discard_tokens(rebuilt_tokens)
+    finally:
+        result_file_writer.write_lock.release()
+        conn.close()
+    return written
+
+# Result files written before the journals existed are not journals: the old writer rewrote
+# the whole results_<subject>.csv on every submit and also copied the *subject* rows into
+# results_tag_<tag>.csv. Appending to those, or materializing the tag csv over the (correct)
+# tag xlsx, would corrupt them, so the first writer in a fresh BASE_DIR rebuilds every result
+# file from the database once and leaves a marker behind.
+RESULT_JOURNALS_MARKER = '.results_journals'
+_result_journals_ready = False
+
+def _ensure_result_journals():
+    global _result_journals_ready
+    if _result_journals_ready:
+        return
+    with result_file_writer.write_lock:
+        if _result_journals_ready:
+            return
+        _result_journals_ready = True       # set first: the rebuild below flushes the writer again
+        marker = os.path.join(BASE_DIR, RESULT_JOURNALS_MARKER)
+        if os.path.exists(marker):
+            return
+        try:
+            with journal.locked(marker):
+                if os.path.exists(marker):
+                    return
+                legacy = [f for f in os.listdir(BASE_DIR)
+                          if f.startswith('results_') and f.endswith(('.csv', '.xlsx'))]
+                if legacy:
+                    conn = db_conn()
+                    try:
+                        exam_ids = [r['id'] for r in conn.execute('SELECT id FROM exams')]
+                    finally:
+                        conn.close()
+                    written = rebuild_result_files(exam_ids)
+                    app.logger.info("rebuilt %d legacy result file(s) from the database: %s",
+                                    len(written), ', '.join(written))
+                with open(marker, 'w') as fh:
+                    fh.write('1\n')
+        except Exception:
+            app.logger.exception("could not upgrade result files to journals; will retry on next start")
+
+@app.route('/api/regrade', methods=['POST'])
+def regrade():
+    """
+    Correct answer keys after an exam and rescore everyone who answered those questions.
+    JSON: { "fixes": [{"question_id": "...", "answer_index": 2 | "C"}, ...] }
+    Admin, or a teacher for questions on their own exams.
+    """
+    teacher = get_teacher_from_request()
+    if not teacher and not is_admin_request():
+        return jsonify({'error': 'teacher or admin auth required'}), 401
+    data = request.get_json(silent=True) or {}
+    try:
+        fixes = parse_key_fixes(data.get('fixes'))
+        out = regrade_questions(fixes, None if is_admin_request() else teacher)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    except PermissionError as e:
+        return jsonify({'error': str(e)}), 403
+    log_audit('regrade', teacher['id'] if teacher and not is_admin_request() else None,
+              out['exams'][0] if len(out['exams']) == 1 else None,
+              {'fixes': fixes, 'exams': out['exams'], 'results': out['results']})
+    return jsonify(dict(out, ok=True))
+
 def log_audit(action, teacher_id, exam_id, details=None):
+    # fire-and-forget: rides along with the next group commit, the request does not wait
     try:
-        conn = db_conn(); c = conn.cursor()
         aid = str(uuid.uuid4())[:8]
-        c.execute('INSERT INTO audit_logs (id,ts,action,teacher_id,exam_id,details) VALUES (?,?,?,?,?,?)',
-                  (aid, int(time.time()), action, teacher_id, exam_id, json.dumps(details or {})))
-        conn.commit(); conn.close()
+        db_execute('INSERT INTO audit_logs (id,ts,action,teacher_id,exam_id,details) VALUES (?,?,?,?,?,?)',
+                   (aid, int(time.time()), action, teacher_id, exam_id, json.dumps(details or {})), wait=False)
     except Exception:
         pass
 
+# =====================================
+# Response compression
+# =====================================
+#
+# Dynamic responses (exam pages, JSON, CSV exports) are gzip/brotli encoded when the client
+# accepts it and the body is worth it. Static files are served from the .br/.gz siblings that
+# tools/precompress_static.py writes next to them, so they cost no CPU per request.
+COMPRESS_MIN_BYTES = int(os.environ.get('CBT_COMPRESS_MIN_BYTES', '1024'))
+COMPRESS_MAX_BYTES = int(os.environ.get('CBT_COMPRESS_MAX_BYTES', str(8 * 1024 * 1024)))
+COMPRESS_GZIP_LEVEL = int(os.environ.get('CBT_COMPRESS_GZIP_LEVEL', '6'))
+COMPRESS_BROTLI_QUALITY = int(os.environ.get('CBT_COMPRESS_BROTLI_QUALITY', '5'))
+COMPRESSIBLE_MIMETYPES = ('application/json', 'application/javascript', 'application/xml', 'image/svg+xml')
+
+def is_compressible(mimetype):
+    return bool(mimetype) and (mimetype.startswith('text/') or mimetype in COMPRESSIBLE_MIMETYPES)
+
+def negotiate_encoding():
+    """'br', 'gzip' or None for the current request's Accept-Encoding."""
+    accepted = request.accept_encodings
+    if brotli is not None and accepted['br'] > 0:
+        return 'br'
+    if accepted['gzip'] > 0:
+        return 'gzip'
+    return None
+
+def compress_bytes(data, encoding):
+    if encoding == 'br':
+        return brotli.compress(data, quality=COMPRESS_BROTLI_QUALITY)
+    return gzip.compress(data, compresslevel=COMPRESS_GZIP_LEVEL, mtime=0)
+
+@app.after_request
+def compress_response(response):
+    if (response.status_code != 200 or request.method == 'HEAD'
+            or 'Content-Encoding' in response.headers or not is_compressible(response.mimetype)
+            or 'X-Sendfile' in response.headers or 'X-Accel-Redirect' in response.headers):
+        return response
+    response.vary.add('Accept-Encoding')
+    encoding = negotiate_encoding()
+    if encoding is None:
+        return response
+    if response.direct_passthrough:
+        # send_file bodies (CSV/XLSX exports): only buffer those of known, bounded size
+        if response.content_length is None or response.content_length > COMPRESS_MAX_BYTES:
+            return response
+        response.direct_passthrough = False
+    elif response.is_streamed:
+        return response
+    data = response.get_data()
+    if len(data) < COMPRESS_MIN_BYTES:
+        return response
+    compressed = compress_bytes(data, encoding)
+    if len(compressed) >= len(data):
+        return response
+    response.set_data(compressed)
+    response.headers['Content-Encoding'] = encoding
+    etag, _ = response.get_etag()
+    if etag:
+        # same content, different bytes: weak validator (If-None-Match still matches it)
+        response.set_etag(etag, weak=True)
+    return response
+
+# =====================================
+# Static files: fingerprinted URLs, precompressed siblings, optional offload
+# =====================================
+#
+# Templates link assets through static_url('logo.png') -> /static/logo.<hash>.png. A URL that
+# carries the file's current content hash never changes meaning, so it is served with
+# Cache-Control: immutable and reloads make no request at all. Content-addressed uploads
+# (static/uploads/<dir>/<hash>.<ext>, see store_question_image) are immutable the same way.
+#
+# CBT_STATIC_OFFLOAD hands the file transfer to the front-end server:
+#   x-sendfile  Apache mod_xsendfile / lighttpd (X-Sendfile: <absolute path>)
+#   x-accel     nginx; CBT_X_ACCEL_PREFIX (default /_static/) must be an internal
+#               location aliased to the static/ directory
+STATIC_IMMUTABLE_MAX_AGE = 31536000
+STATIC_OFFLOAD = (os.environ.get('CBT_STATIC_OFFLOAD') or '').strip().lower()
+X_ACCEL_PREFIX = os.environ.get('CBT_X_ACCEL_PREFIX', '/_static/')
+if STATIC_OFFLOAD == 'x-sendfile':
+    app.config['USE_X_SENDFILE'] = True
+
+_FINGERPRINTED_RE = re.compile(r'^(?P<stem>.+)\.(?P<hash>[0-9a-f]{12})(?P<ext>\.[A-Za-z0-9]+)$')
+_CONTENT_ADDRESSED_RE = re.compile(r'^uploads/.+/[0-9a-f]{16,64}(?:_[a-z0-9]+)?\.[A-Za-z0-9]+$')
+_fingerprints = {}                # absolute path -> (mtime, size, hash)
+_fingerprints_lock = threading.Lock()
+
+def file_fingerprint(path):
+    """First 12 hex digits of the file's sha256, cached until its mtime/size change."""
+    st = os.stat(path)
+    with _fingerprints_lock:
+        cached = _fingerprints.get(path)
+    if cached and cached[0] == st.st_mtime and cached[1] == st.st_size:
+        return cached[2]
+    h = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(65536), b''):
+            h.update(chunk)
+    digest = h.hexdigest()[:12]
+    with _fingerprints_lock:
+        _fingerprints[path] = (st.st_mtime, st.st_size, digest)
+    return digest
+
+def static_url(filename):
+    """url_for('static') with the content hash spliced into the file name (logo.png -> logo.<hash>.png)."""
+    path = safe_join(app.static_folder, filename)
+    if not path or not os.path.isfile(path):
+        return url_for('static', filename=filename)
+    stem, ext = os.path.splitext(filename)
+    return url_for('static', filename=f'{stem}.{file_fingerprint(path)}{ext}')
+
+app.jinja_env.globals['static_url'] = static_url
+
+def _send_static(filename, served_name, encoding=None, immutable=False):
+    mimetype = mimetypes.guess_type(filename)[0] or 'application/octet-stream'
+    if STATIC_OFFLOAD == 'x-accel':
+        response = Response(mimetype=mimetype)
+        response.headers['X-Accel-Redirect'] = X_ACCEL_PREFIX.rstrip('/') + '/' + served_name
+    else:
+        max_age = STATIC_IMMUTABLE_MAX_AGE if immutable else app.get_send_file_max_age(filename)
+        response = send_from_directory(app.static_folder, served_name, mimetype=mimetype, max_age=max_age)
+    if encoding:
+        response.headers['Content-Encoding'] = encoding
+        response.vary.add('Accept-Encoding')
+    if immutable:
+        response.headers['Cache-Control'] = f'public, max-age={STATIC_IMMUTABLE_MAX_AGE}, immutable'
+    return response
+
+def static_precompressed(filename):
+    """
+    Static view: resolves fingerprinted names, marks immutable URLs as such, and prefers a
+    precompressed .br/.gz sibling when the client accepts it.
+    """
+    immutable = bool(_CONTENT_ADDRESSED_RE.match(filename))
+    original = safe_join(app.static_folder, filename)
+    if original and not os.path.isfile(original):
+        m = _FINGERPRINTED_RE.match(filename)
+        if m:
+            real = m.group('stem') + m.group('ext')
+            real_path = safe_join(app.static_folder, real)
+            if real_path and os.path.isfile(real_path):
+                # an outdated hash still gets the current file, just without the long cache
+                immutable = file_fingerprint(real_path) == m.group('hash')
+                filename, original = real, real_path
+    if not original or not os.path.isfile(original):
+        abort(404)
+    if immutable and images.is_pending(original):
+        immutable = False           # raw upload, about to be replaced by its resized version
+    accepted = request.accept_encodings
+    for encoding, ext in (('br', '.br'), ('gzip', '.gz')):
+        if accepted[encoding] <= 0:
+            continue
+        path = original + ext
+        if os.path.isfile(path) and os.path.getmtime(path) >= os.path.getmtime(original):
+            return _send_static(filename, filename + ext, encoding, immutable)
+    return _send_static(filename, filename, None, immutable)
+
+app.view_functions['static'] = static_precompressed
+
 @app.after_request
 def set_security_headers(response):
     # basic security headers
@@ -1299,6 +2632,88 @@ def login_admin():
         return jsonify({'ok': True})
     return jsonify({'error': 'Invalid credentials'}), 401
 
+@app.route('/api/admin/reset_attempt', methods=['POST'])
+@admin_required
+def reset_attempt():
+    """
+    Let a student start an exam again (e.g. their PC died and the session expired unsubmitted).
+    JSON: { "exam_id": "...", "student_name": "..." }. Submitted attempts are kept unless "force": true.
+    """
+    data = request.get_json(silent=True) or {}
+    exam_id = (data.get('exam_id') or '').strip()
+    student_name = (data.get('student_name') or '').strip()
+    if not exam_id or not student_name:
+        return jsonify({'error': 'exam_id and student_name required'}), 400
+    sql = 'DELETE FROM attempts WHERE exam_id=? AND normalized_name=?'
+    if not data.get('force'):
+        sql += ' AND submitted_at IS NULL'
+    deleted = db_execute(sql, (exam_id, normalize_student_name(student_name)))
+    if deleted:
+        log_audit('reset_attempt', None, exam_id, {'name': student_name, 'force': bool(data.get('force'))})
+    return jsonify({'ok': True, 'reset': bool(deleted)})
+
+@app.route('/api/admin/issue_tokens', methods=['POST'])
+@admin_required
+def api_issue_tokens():
+    """
+    Pre-issue exam tokens for a whole class roster and return a printable slip list.
+    JSON: { "exam_id": "...", "class": "SS2" (defaults to the exam tag), "format": "csv" | "xlsx" | "json" }
+    """
+    data = request.get_json(silent=True) or {}
+    exam_id = (data.get('exam_id') or '').strip()
+    class_name = (data.get('class') or data.get('class_name') or '').strip() or None
+    fmt = (data.get('format') or 'csv').lower()
+    if not exam_id:
+        return jsonify({'error': 'exam_id required'}), 400
+    try:
+        slips = issue_class_tokens(exam_id, class_name, request.host_url)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    if slips is None:
+        return jsonify({'error': 'exam not found'}), 404
+    log_audit('issue_tokens', None, exam_id, {
+        'class': class_name, 'issued': sum(1 for s in slips if s['status'] == 'issued'), 'total': len(slips)})
+    if fmt == 'json':
+        return jsonify({'ok': True, 'slips': slips})
+    label = secure_filename(f"tokens_{exam_id}_{class_name or 'class'}") or 'tokens'
+    return send_slip_list(slips, fmt, label)
+
+def slip_list_bytes(slips, fmt='csv'):
+    """Render slip rows as xlsx (when pandas is available) or csv bytes; returns (bytes, ext)."""
+    cols = ['name', 'class', 'token', 'url', 'status']
+    if fmt == 'xlsx' and pd:
+        mem = io.BytesIO()
+        with pd.ExcelWriter(mem, engine='openpyxl') as writer:
+            pd.DataFrame(slips, columns=cols).to_excel(writer, index=False, sheet_name='slips')
+        return mem.getvalue(), 'xlsx'
+    si = io.StringIO()
+    writer = csv.writer(si)
+    writer.writerow(cols)
+    for s in slips:
+        writer.writerow([s[k] for k in cols])
+    return si.getvalue().encode('utf-8'), 'csv'
+
+def send_slip_list(slips, fmt, label):
+    body, ext = slip_list_bytes(slips, fmt)
+    mimetype = ('application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
+                if ext == 'xlsx' else 'text/csv')
+    return send_file(io.BytesIO(body), mimetype=mimetype, as_attachment=True, download_name=f'{label}.{ext}')
+
+@app.route('/api/admin/db_stats')
+@admin_required
+def api_db_stats():
+    """Connection pool occupancy, pool-wait and lock-retry counters."""
+    return jsonify(db_stats())
+
+@app.route('/api/admin/cache_stats')
+@admin_required
+def api_cache_stats():
+    """Hit/miss counters of the in-process caches."""
+    return jsonify({'blueprints': blueprint_cache_stats(), 'session_pool': session_pool.stats(),
+                    'exam_pages': _exam_page_cache.stats(), 'images': images.stats(),
+                    'autosave': autosave_buffer.stats(), 'submit_keys': _submitted_keys.stats(),
+                    'result_files': result_file_writer.stats()})
+
 @app.route('/api/check_admin')
 def check_admin():
     return jsonify({'is_admin': 'admin_token' in session})
@@ -1701,7 +3116,7 @@ def download_subject():
 
             # build query returning rows only for this exam_id
             q = '''
-                SELECT r.token, r.name, r.score, r.total, r.submitted_at, r.answers_detail, e.id AS exam_id,
+                SELECT r.token, r.name, r.score, r.total, r.submitted_at, e.id AS exam_id,
                     COALESCE(t.subject,'') AS subject, COALESCE(e.tag,'') AS tag
                 FROM results r
                 JOIN sessions s ON r.token = s.token
@@ -1717,7 +3132,7 @@ def download_subject():
                 conn.close(); return jsonify({'error': 'subject required (or exam_id must be supplied)'}), 400
             label = _sanitize_filename(subject)
             q = '''
-                SELECT r.token, r.name, r.score, r.total, r.submitted_at, r.answers_detail, e.id AS exam_id,
+                SELECT r.token, r.name, r.score, r.total, r.submitted_at, e.id AS exam_id,
                        COALESCE(t.subject,'') AS subject, COALESCE(e.tag,'') AS tag
                 FROM results r
                 JOIN sessions s ON r.token = s.token
@@ -1745,10 +3160,6 @@ def download_subject():
     # build export data
     data = []
     for r in rows:
-        try:
-            answers_detail = json.loads(r['answers_detail'] or '[]')
-        except Exception:
-            answers_detail = r['answers_detail'] or ''
         submitted = ''
         try:
             submitted = datetime.fromtimestamp(r['submitted_at']).isoformat() if r['submitted_at'] else ''
@@ -1762,8 +3173,7 @@ def download_subject():
             'name': (r['name'] or '') if 'name' in r.keys() else '',
             'score': r['score'] if 'score' in r.keys() else '',
             'total': (r['total'] if 'total' in r.keys() else ''),
-            'submitted_at': submitted,
-            'answers_detail': json.dumps(answers_detail, ensure_ascii=False)
+            'submitted_at': submitted
         })
 
         # Force subject column to use the exam title instead of teacher.subject
@@ -1851,24 +3261,33 @@ def download_token(token):
     fname_tag_xlsx = os.path.join(BASE_DIR, f'results_tag_{label}.xlsx')
     fname_tag_csv = os.path.join(BASE_DIR, f'results_tag_{label}.csv')
 
+    # the .xlsx is brought up to date with its journal first; it is swapped in atomically, and
+    # the csv is sent from a locked snapshot, so neither can include a half-written batch
     if fmt == 'xlsx' and pd:
-        for path in (fname_xlsx, fname_tag_xlsx):
-            if path and os.path.exists(path):
+        for journal_path, path in ((fname_csv, fname_xlsx), (fname_tag_csv, fname_tag_xlsx)):
+            if os.path.exists(journal_path):
+                try:
+                    result_file_writer.materialize(journal_path)
+                except Exception:
+                    app.logger.exception("could not materialize %s", path)
+            if os.path.exists(path):
                 return send_file(path,
                                  mimetype='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
                                  as_attachment=True,
                                  download_name=os.path.basename(path))
     # csv fallback / if requested csv
+    result_file_writer.flush()
     for path in (fname_csv, fname_tag_csv):
-        if path and os.path.exists(path):
-            return send_file(path, mimetype='text/csv', as_attachment=True, download_name=os.path.basename(path))
+        data = journal.snapshot(path)
+        if data is not None:
+            return send_file(BytesIO(data), mimetype='text/csv', as_attachment=True, download_name=os.path.basename(path))
 
     # build from DB: choose by subject first, else by tag
     conn = db_conn(); c = conn.cursor()
     try:
         if subject:
             q = '''
-            SELECT r.token, r.name, r.score, r.total, r.submitted_at, r.answers_detail, e.id AS exam_id, COALESCE(t.subject,'') AS subject, COALESCE(e.tag,'') AS tag
+            SELECT r.token, r.name, r.score, r.total, r.submitted_at, e.id AS exam_id, COALESCE(t.subject,'') AS subject, COALESCE(e.tag,'') AS tag
             FROM results r
             JOIN sessions s ON r.token = s.token
             LEFT JOIN exams e ON s.exam_id = e.id
@@ -1879,7 +3298,7 @@ def download_token(token):
             c.execute(q, (subject.lower(),))
         else:
             q = '''
-            SELECT r.token, r.name, r.score, r.total, r.submitted_at, r.answers_detail, e.id AS exam_id, COALESCE(t.subject,'') AS subject, COALESCE(e.tag,'') AS tag
+            SELECT r.token, r.name, r.score, r.total, r.submitted_at, e.id AS exam_id, COALESCE(t.subject,'') AS subject, COALESCE(e.tag,'') AS tag
             FROM results r
             JOIN sessions s ON r.token = s.token
             LEFT JOIN exams e ON s.exam_id = e.id
@@ -1894,10 +3313,6 @@ def download_token(token):
 
     data = []
     for r in rows:
-        try:
-            answers_detail = json.loads(r['answers_detail'] or '[]')
-        except Exception:
-            answers_detail = r['answers_detail'] or ''
         submitted = ''
         try:
             submitted = datetime.fromtimestamp(r['submitted_at']).isoformat() if r['submitted_at'] else ''
@@ -1911,8 +3326,7 @@ def download_token(token):
             'name': (r['name'] or '') if 'name' in r.keys() else '',
             'score': r['score'] if 'score' in r.keys() else '',
             'total': (r['total'] if 'total' in r.keys() else ''),
-            'submitted_at': submitted,
-            'answers_detail': json.dumps(answers_detail, ensure_ascii=False)
+            'submitted_at': submitted
         })
 
     # produce xlsx if requested and pandas present
@@ -0,0 +1,712 @@
+"""
+SQLite access for the CBT server.
+
+Connections are handed out from a small pool instead of being opened per call.
+Every pooled connection runs in WAL mode with a busy timeout and
+synchronous=NORMAL, so readers never block the single writer and short lock
+waits are absorbed inside SQLite instead of surfacing as "database is locked".
+Callers keep the familiar pattern:
+
+    conn = db_conn(); c = conn.cursor()
+    ...
+    conn.close()   # returns the connection to the pool
+"""
+import atexit
+import json
+import os
+import queue
+import sqlite3
+import threading
+import time
+import uuid
+from concurrent import futures
+
+BASE_DIR = os.path.dirname(__file__)
+DB = os.environ.get('CBT_DB_PATH') or os.path.join(BASE_DIR, 'cbt.db')
+
+# pool / pragma tuning (env override)
+POOL_SIZE = int(os.environ.get('CBT_DB_POOL_SIZE', '16'))
+POOL_TIMEOUT = float(os.environ.get('CBT_DB_POOL_TIMEOUT', '10'))
+BUSY_TIMEOUT_MS = int(os.environ.get('CBT_DB_BUSY_TIMEOUT_MS', '5000'))
+STATEMENT_CACHE = int(os.environ.get('CBT_DB_STATEMENT_CACHE', '256'))
+LOCK_RETRIES = int(os.environ.get('CBT_DB_LOCK_RETRIES', '5'))
+
+_stats_lock = threading.Lock()
+_stats = {
+    'connections_opened': 0,
+    'acquired': 0,
+    'pool_waits': 0,
+    'pool_wait_ms': 0.0,
+    'pool_timeouts': 0,
+    'lock_retries': 0,
+    'lock_failures': 0,
+    'leaked_released': 0,
+}
+
+
+def _count(key, n=1):
+    with _stats_lock:
+        _stats[key] += n
+
+
+def is_locked_error(exc) -> bool:
+    """True for the transient SQLITE_BUSY / SQLITE_LOCKED family of errors."""
+    if not isinstance(exc, sqlite3.OperationalError):
+        return False
+    msg = str(exc).lower()
+    return 'locked' in msg or 'busy' in msg
+
+
+def _with_lock_retry(fn, *args):
+    """
+    Run fn(*args), retrying with a short backoff when SQLite reports a lock.
+    busy_timeout already waits inside SQLite; this only covers the cases where
+    SQLite gives up immediately (e.g. a deferred transaction upgrading to write).
+    """
+    delay = 0.01
+    attempt = 0
+    while True:
+        try:
+            return fn(*args)
+        except sqlite3.OperationalError as e:
+            if not is_locked_error(e):
+                raise
+            if attempt >= LOCK_RETRIES:
+                _count('lock_failures')
+                raise
+            attempt += 1
+            _count('lock_retries')
+            time.sleep(delay)
+            delay = min(delay * 2, 0.5)
+
+
+class RetryCursor(sqlite3.Cursor):
+    def execute(self, sql, parameters=()):
+        return _with_lock_retry(super().execute, sql, parameters)
+
+    def executemany(self, sql, seq_of_parameters):
+        return _with_lock_retry(super().executemany, sql, seq_of_parameters)
+
+
+class PooledConnection(sqlite3.Connection):
+    """sqlite3 connection whose close() hands it back to its pool."""
+    _pool = None
+    _checked_out = False
+    _owner = None
+
+    def cursor(self, factory=RetryCursor):
+        return super().cursor(factory)
+
+    def execute(self, sql, parameters=()):
+        return self.cursor().execute(sql, parameters)
+
+    def executemany(self, sql, seq_of_parameters):
+        return self.cursor().executemany(sql, seq_of_parameters)
+
+    def commit(self):
+        return _with_lock_retry(super().commit)
+
+    def close(self):
+        if self._pool is not None:
+            self._pool.release(self)
+        else:
+            super().close()
+
+    def close_for_real(self):
+        sqlite3.Connection.close(self)
+
+
+def open_connection(path):
+    """Open a WAL-mode connection with busy timeout, synchronous=NORMAL and a statement cache."""
+    conn = sqlite3.connect(path,
+                           timeout=BUSY_TIMEOUT_MS / 1000.0,
+                           factory=PooledConnection,
+                           cached_statements=STATEMENT_CACHE,
+                           check_same_thread=False)
+    conn.row_factory = sqlite3.Row
+    conn.execute('PRAGMA journal_mode=WAL')
+    conn.execute(f'PRAGMA busy_timeout={int(BUSY_TIMEOUT_MS)}')
+    conn.execute('PRAGMA synchronous=NORMAL')
+    _count('connections_opened')
+    return conn
+
+
+class ConnectionPool:
+    """
+    Bounded LIFO pool of WAL-mode connections. Connections are created lazily up
+    to `size`; beyond that callers wait (counted in pool_waits / pool_wait_ms).
+    Connections a request forgot to close are reclaimed by release_thread_connections().
+    """
+
+    def __init__(self, path, size=POOL_SIZE, timeout=POOL_TIMEOUT):
+        self.path = path
+        self.size = max(1, size)
+        self.timeout = timeout
+        self._idle = queue.LifoQueue()
+        self._opened = 0
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+    def _open(self):
+        conn = open_connection(self.path)
+        conn._pool = self
+        return conn
+
+    def _held(self):
+        held = getattr(self._local, 'held', None)
+        if held is None:
+            held = self._local.held = []
+        return held
+
+    def acquire(self):
+        conn = None
+        try:
+            conn = self._idle.get_nowait()
+        except queue.Empty:
+            create = False
+            with self._lock:
+                if self._opened < self.size:
+                    self._opened += 1
+                    create = True
+            if create:
+                try:
+                    conn = self._open()
+                except Exception:
+                    with self._lock:
+                        self._opened -= 1
+                    raise
+            else:
+                _count('pool_waits')
+                t0 = time.monotonic()
+                try:
+                    conn = self._idle.get(timeout=self.timeout)
+                except queue.Empty:
+                    _count('pool_timeouts')
+                    raise sqlite3.OperationalError('database is locked (connection pool exhausted)')
+                finally:
+                    _count('pool_wait_ms', (time.monotonic() - t0) * 1000.0)
+        conn._checked_out = True
+        conn._owner = threading.get_ident()
+        self._held().append(conn)
+        _count('acquired')
+        return conn
+
+    def release(self, conn):
+        if not conn._checked_out:
+            return
+        conn._checked_out = False
+        try:
+            self._held().remove(conn)
+        except ValueError:
+            pass
+        try:
+            if conn.in_transaction:
+                conn.rollback()
+            conn.row_factory = sqlite3.Row
+        except sqlite3.Error:
+            # broken connection: drop it and let the pool open a fresh one
+            try:
+                conn.close_for_real()
+            except Exception:
+                pass
+            with self._lock:
+                self._opened -= 1
+            return
+        self._idle.put(conn)
+
+    def release_thread_connections(self):
+        """Return any connection the current thread still holds (end-of-request safety net)."""
+        held = self._held()
+        me = threading.get_ident()
+        for conn in list(held):
+            if conn._checked_out and conn._owner == me:
+                _count('leaked_released')
+                self.release(conn)
+        del held[:]
+
+    def stats(self):
+        with self._lock:
+            opened = self._opened
+        idle = self._idle.qsize()
+        return {'size': self.size, 'opened': opened, 'idle': idle, 'in_use': opened - idle}
+
+
+_pool = ConnectionPool(DB)
+
+
+def db_conn():
+    """Borrow a pooled connection (row_factory=sqlite3.Row). close() returns it."""
+    return _pool.acquire()
+
+
+def release_thread_connections():
+    _pool.release_thread_connections()
+
+
+def db_stats():
+    """Pool occupancy plus cumulative wait / lock-retry counters."""
+    with _stats_lock:
+        out = dict(_stats)
+    out['pool_wait_ms'] = round(out['pool_wait_ms'], 1)
+    out.update(_pool.stats())
+    out['writer'] = _writer.stats()
+    return out
+
+
+# =====================================
+# Single writer with group commit
+# =====================================
+#
+# SQLite allows one writer at a time. Instead of every handler racing for the write
+# lock and committing on its own, write jobs are queued to one thread that drains
+# whatever arrived within a few milliseconds and runs it as one transaction. Each
+# job runs inside its own SAVEPOINT, so a failing job is rolled back and reported
+# to its caller without affecting the rest of the batch.
+#
+#     def _insert(conn, a, b):          # runs on the writer thread; must not commit
+#         conn.execute('INSERT ...', (a, b))
+#     db_write(_insert, a, b)           # blocks until the batch is committed
+#     db_write_async(_insert, a, b)     # returns a concurrent.futures.Future
+
+WRITER_BATCH_MS = float(os.environ.get('CBT_WRITER_BATCH_MS', '3'))
+WRITER_MAX_BATCH = int(os.environ.get('CBT_WRITER_MAX_BATCH', '256'))
+WRITER_TIMEOUT = float(os.environ.get('CBT_WRITER_TIMEOUT', '30'))
+
+
+class DbWriter:
+    def __init__(self, path, batch_ms=WRITER_BATCH_MS, max_batch=WRITER_MAX_BATCH):
+        self.path = path
+        self.batch_window = max(0.0, batch_ms) / 1000.0
+        self.max_batch = max(1, max_batch)
+        self._queue = queue.Queue()
+        self._thread = None
+        self._start_lock = threading.Lock()
+        self._stats_lock = threading.Lock()
+        self._stats = {'batches': 0, 'jobs': 0, 'failed_jobs': 0, 'max_batch': 0,
+                       'last_batch': 0, 'max_queue_depth': 0, 'commit_ms': 0.0}
+
+    def _ensure_started(self):
+        if self._thread is not None and self._thread.is_alive():
+            return
+        with self._start_lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name='cbt-db-writer', daemon=True)
+                self._thread.start()
+
+    def submit(self, fn, *args):
+        if self._thread is not None and threading.current_thread() is self._thread:
+            raise RuntimeError('db_write called from inside a write job')
+        self._ensure_started()
+        fut = futures.Future()
+        self._queue.put((fn, args, fut))
+        depth = self._queue.qsize()
+        with self._stats_lock:
+            if depth > self._stats['max_queue_depth']:
+                self._stats['max_queue_depth'] = depth
+        return fut
+
+    def _collect(self):
+        first = self._queue.get()
+        if first is None:
+            return None
+        batch = [first]
+        deadline = time.monotonic() + self.batch_window
+        while len(batch) < self.max_batch:
+            remaining = deadline - time.monotonic()
+            try:
+                item = self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if item is None:
+                # shutdown requested: finish this batch, then stop
+                self._queue.put(None)
+                break
+            batch.append(item)
+        return batch
+
+    def _run(self):
+        conn = open_connection(self.path)
+        while True:
+            batch = self._collect()
+            if batch is None:
+                break
+            self._run_batch(conn, batch)
+        conn.close()
+
+    def _run_batch(self, conn, batch):
+        t0 = time.monotonic()
+        outcomes = []
+        failed = 0
+        try:
+            c = conn.cursor()
+            c.execute('BEGIN IMMEDIATE')
+            for fn, args, fut in batch:
+                if not fut.set_running_or_notify_cancel():
+                    continue
+                c.execute('SAVEPOINT write_job')
+                try:
+                    res = fn(conn, *args)
+                    c.execute('RELEASE write_job')
+                    outcomes.append((fut, res, None))
+                except Exception as e:
+                    c.execute('ROLLBACK TO write_job')
+                    c.execute('RELEASE write_job')
+                    outcomes.append((fut, None, e))
+                    failed += 1
+            conn.commit()
+        except Exception as e:
+            try:
+                conn.rollback()
+            except sqlite3.Error:
+                pass
+            for fn, args, fut in batch:
+                if not fut.done():
+                    fut.set_exception(e)
+            failed = len(batch)
+            outcomes = []
+        # resolve only after COMMIT so callers never observe uncommitted writes
+        for fut, res, err in outcomes:
+            if err is not None:
+                fut.set_exception(err)
+            else:
+                fut.set_result(res)
+        with self._stats_lock:
+            st = self._stats
+            st['batches'] += 1
+            st['jobs'] += len(batch)
+            st['failed_jobs'] += failed
+            st['last_batch'] = len(batch)
+            st['max_batch'] = max(st['max_batch'], len(batch))
+            st['commit_ms'] += (time.monotonic() - t0) * 1000.0
+
+    def stop(self, timeout=5.0):
+        if self._thread is not None and self._thread.is_alive():
+            self._queue.put(None)
+            self._thread.join(timeout)
+
+    def stats(self):
+        with self._stats_lock:
+            out = dict(self._stats)
+        out['queue_depth'] = self._queue.qsize()
+        out['avg_batch'] = round(out['jobs'] / out['batches'], 2) if out['batches'] else 0
+        out['commit_ms'] = round(out['commit_ms'], 1)
+        return out
+
+
+_writer = DbWriter(DB)
+atexit.register(_writer.stop)
+
+
+def db_write_async(fn, *args):
+    """Queue fn(conn, *args) for the writer thread; returns a Future with its result."""
+    return _writer.submit(fn, *args)
+
+
+def db_write(fn, *args, timeout=WRITER_TIMEOUT):
+    """Run fn(conn, *args) in the next group commit and return its result (re-raises its error)."""
+    return _writer.submit(fn, *args).result(timeout=timeout)
+
+
+def _execute_job(conn, sql, params):
+    return conn.execute(sql, params).rowcount
+
+
+def db_execute(sql, params=(), wait=True):
+    """Single-statement write through the writer thread; returns rowcount (or a Future if wait=False)."""
+    if not wait:
+        return db_write_async(_execute_job, sql, params)
+    return db_write(_execute_job, sql, params)
+
+
+# =====================================
+# Schema migrations
+# =====================================
+#
+# Each step is (version, description, fn(cursor)). migrate_db() applies only the
+# steps newer than MAX(schema_version.version), all inside one IMMEDIATE
+# transaction; on a current database it is a single SELECT.
+
+def _table_columns(c, table):
+    c.execute(f"PRAGMA table_info({table})")
+    return {row[1] for row in c.fetchall()}
+
+
+def _add_column(c, table, column, definition):
+    """ALTER TABLE ... ADD COLUMN unless the column is already there (pre-migration databases)."""
+    if column not in _table_columns(c, table):
+        c.execute(f"ALTER TABLE {table} ADD COLUMN {column} {definition}")
+
+
+def _m001_baseline(c):
+    c.execute('''CREATE TABLE IF NOT EXISTS exams (
+        id TEXT PRIMARY KEY,
+        title TEXT,
+        duration_minutes INTEGER,
+        started INTEGER DEFAULT 0,
+        teacher_id TEXT
+    )''')
+    c.execute('''CREATE TABLE IF NOT EXISTS questions (
+        id TEXT PRIMARY KEY,
+        exam_id TEXT,
+        question TEXT,
+        choices TEXT,
+        answer_index INTEGER,
+        image TEXT
+    )''')
+    c.execute('''CREATE TABLE IF NOT EXISTS sessions (
+        token TEXT PRIMARY KEY,
+        exam_id TEXT,
+        start_time INTEGER
+    )''')
+    # classes + class_students: pre-registered classes (SS1..SS3) and their student lists
+    c.execute('''CREATE TABLE IF NOT EXISTS classes (
+        id TEXT PRIMARY KEY,
+        name TEXT UNIQUE
+    )''')
+    c.execute('''CREATE TABLE IF NOT EXISTS class_students (
+        id TEXT PRIMARY KEY,
+        class_name TEXT,
+        student_name TEXT
+    )''')
+    c.execute('''CREATE TABLE IF NOT EXISTS results (
+        id TEXT PRIMARY KEY,
+        token TEXT,
+        answers TEXT,
+        score INTEGER,
+        submitted_at INTEGER
+    )''')
+    c.execute('''CREATE TABLE IF NOT EXISTS registered_students (
+        id TEXT PRIMARY KEY,
+        exam_id TEXT,
+        student_name TEXT
+    )''')
+    c.execute('''CREATE TABLE IF NOT EXISTS teachers (
+        id TEXT PRIMARY KEY,
+        name TEXT UNIQUE,
+        password_hash TEXT,
+        token TEXT UNIQUE
+    )''')
+    c.execute('''CREATE TABLE IF NOT EXISTS audit_logs (
+        id TEXT PRIMARY KEY,
+        ts INTEGER,
+        action TEXT,
+        teacher_id TEXT,
+        exam_id TEXT,
+        details TEXT
+    )''')
+
+    # columns that older databases picked up one ensure_column() at a time
+    _add_column(c, 'results', 'name', 'TEXT')
+    _add_column(c, 'results', 'total', 'INTEGER')
+    _add_column(c, 'results', 'student_id', 'TEXT')
+    _add_column(c, 'results', 'answers_detail', 'TEXT')    # JSON: detailed per-question responses for auditing
+    _add_column(c, 'sessions', 'student_name', 'TEXT')
+    _add_column(c, 'sessions', 'end_time', 'INTEGER')
+    _add_column(c, 'sessions', 'class', 'TEXT')            # student's class
+    _add_column(c, 'sessions', 'question_state', 'TEXT')   # JSON: per-session presentation state
+    _add_column(c, 'sessions', 'question_order', 'TEXT')
+    _add_column(c, 'sessions', 'tag', 'TEXT')
+    _add_column(c, 'exams', 'teacher_id', 'TEXT')
+    _add_column(c, 'exams', 'tag', 'TEXT')
+    _add_column(c, 'questions', 'created_by', 'TEXT')
+    _add_column(c, 'questions', 'created_at', 'INTEGER')
+    _add_column(c, 'questions', 'updated_by', 'TEXT')
+    _add_column(c, 'questions', 'updated_at', 'INTEGER')
+    _add_column(c, 'questions', 'image', 'TEXT')
+    _add_column(c, 'questions', 'image_path', 'TEXT')      # URL of an uploaded question image
+    _add_column(c, 'teachers', 'approved', 'INTEGER DEFAULT 0')   # 0 = pending, 1 = approved
+    _add_column(c, 'teachers', 'subject', 'TEXT')
+
+    # default classes
+    for cname in ('SS1', 'SS2', 'SS3'):
+        c.execute('INSERT OR IGNORE INTO classes (id,name) VALUES (?,?)', (uuid.uuid4().hex[:8], cname))
+
+    c.execute("CREATE INDEX IF NOT EXISTS idx_regstudents_exam ON registered_students(exam_id)")
+    c.execute("CREATE INDEX IF NOT EXISTS idx_questions_exam ON questions(exam_id)")
+
+
+def _m002_hot_query_indexes(c):
+    # start_exam duplicate check: sessions JOIN results ON token, filtered by exam + LOWER(student_name)
+    c.execute("CREATE INDEX IF NOT EXISTS idx_sessions_exam_student ON sessions(exam_id, LOWER(student_name))")
+    # submit / results_page / api_get_result look results up by token
+    c.execute("CREATE INDEX IF NOT EXISTS idx_results_token ON results(token)")
+    # audit log date filters (optionally narrowed to one exam), newest first
+    c.execute("CREATE INDEX IF NOT EXISTS idx_audit_logs_ts ON audit_logs(ts)")
+    c.execute("CREATE INDEX IF NOT EXISTS idx_audit_logs_exam_ts ON audit_logs(exam_id, ts)")
+    # class roster listing (ORDER BY student_name) and the case-insensitive duplicate check
+    c.execute("CREATE INDEX IF NOT EXISTS idx_class_students_class_name ON class_students(class_name, student_name)")
+    c.execute("CREATE INDEX IF NOT EXISTS idx_class_students_class_lower ON class_students(class_name, LOWER(student_name))")
+    # registered_students duplicate check in upload_students / add_student
+    c.execute("CREATE INDEX IF NOT EXISTS idx_regstudents_exam_lower ON registered_students(exam_id, LOWER(student_name))")
+
+
+def _m003_responses(c):
+    # one compact row per answered/unanswered question; replaces the answers_detail JSON blob.
+    # selected_index indexes questions.choices (the stored order), so grading and per-question
+    # analytics are plain joins against questions.answer_index.
+    c.execute('''CREATE TABLE IF NOT EXISTS responses (
+        result_id TEXT NOT NULL,
+        question_id TEXT NOT NULL,
+        presented_index INTEGER,
+        selected_index INTEGER,
+        is_correct INTEGER NOT NULL DEFAULT 0,
+        PRIMARY KEY (result_id, question_id)
+    ) WITHOUT ROWID''')
+    c.execute("CREATE INDEX IF NOT EXISTS idx_responses_question ON responses(question_id)")
+
+    # backfill from existing answers_detail blobs (selected_text -> index in questions.choices)
+    c.execute('SELECT id, choices FROM questions')
+    canonical = {}
+    for qid, choices in c.fetchall():
+        try:
+            canonical[qid] = json.loads(choices or '[]')
+        except ValueError:
+            canonical[qid] = []
+    c.execute("SELECT id, answers_detail FROM results WHERE answers_detail IS NOT NULL AND answers_detail <> ''")
+    rows = []
+    for rid, blob in c.fetchall():
+        try:
+            detail = json.loads(blob)
+        except ValueError:
+            continue
+        if not isinstance(detail, list):
+            continue
+        for pos, d in enumerate(detail):
+            if not isinstance(d, dict) or not d.get('id'):
+                continue
+            sel = None
+            if d.get('selected_index') is not None:
+                try:
+                    sel = canonical.get(d['id'], []).index(d.get('selected_text'))
+                except ValueError:
+                    sel = None
+            rows.append((rid, d['id'], pos, sel, 1 if d.get('is_correct') else 0))
+    c.executemany('INSERT OR IGNORE INTO responses (result_id, question_id, presented_index, selected_index, is_correct) '
+                  'VALUES (?,?,?,?,?)', rows)
+
+
+def normalize_student_name(name):
+    """Key used for one-attempt-per-student checks: trimmed, inner whitespace collapsed, lower-case."""
+    return ' '.join((name or '').split()).lower()
+
+
+def _m004_attempts(c):
+    # one row per (exam, student): the PRIMARY KEY makes start_exam's duplicate check an
+    # indexed insert-or-fail instead of a LOWER() join over sessions/results
+    c.execute('''CREATE TABLE IF NOT EXISTS attempts (
+        exam_id TEXT NOT NULL,
+        normalized_name TEXT NOT NULL,
+        token TEXT NOT NULL,
+        started_at INTEGER,
+        submitted_at INTEGER,
+        PRIMARY KEY (exam_id, normalized_name)
+    ) WITHOUT ROWID''')
+    c.execute("CREATE INDEX IF NOT EXISTS idx_attempts_token ON attempts(token)")
+
+    # backfill: prefer a submitted session, then the most recent one
+    c.execute('''
+        SELECT s.exam_id, s.student_name, s.token, s.start_time, MAX(r.submitted_at) AS submitted_at
+        FROM sessions s
+        LEFT JOIN results r ON r.token = s.token
+        WHERE s.exam_id IS NOT NULL AND s.student_name IS NOT NULL AND TRIM(s.student_name) <> ''
+        GROUP BY s.token
+        ORDER BY (MAX(r.submitted_at) IS NULL), s.start_time DESC
+    ''')
+    rows = [(r[0], normalize_student_name(r[1]), r[2], r[3], r[4]) for r in c.fetchall()]
+    c.executemany('INSERT OR IGNORE INTO attempts (exam_id, normalized_name, token, started_at, submitted_at) '
+                  'VALUES (?,?,?,?,?)', rows)
+
+
+def _m005_question_sampling(c):
+    # K-of-N draws: exams.sample_size NULL (or >= bank size) serves every question;
+    # sample_by_topic spreads the draw proportionally over questions.topic
+    _add_column(c, 'exams', 'sample_size', 'INTEGER')
+    _add_column(c, 'exams', 'sample_by_topic', 'INTEGER DEFAULT 0')
+    _add_column(c, 'questions', 'topic', 'TEXT')
+
+
+def _m006_autosaves(c):
+    # server-side drafts: one row per answered question, rewritten in place by batched upserts
+    c.execute('''CREATE TABLE IF NOT EXISTS autosaves (
+        token TEXT NOT NULL,
+        question_id TEXT NOT NULL,
+        answer TEXT NOT NULL,
+        updated_at INTEGER NOT NULL,
+        PRIMARY KEY (token, question_id)
+    ) WITHOUT ROWID''')
+
+
+def _m007_submit_request_ids(c):
+    # idempotency key of the submission that produced the result; a retry carrying the same
+    # key is answered from this row instead of being graded and written again
+    _add_column(c, 'results', 'request_id', 'TEXT')
+
+
+def _m008_drop_session_name_index(c):
+    # the LOWER(student_name) half only served the old sessions JOIN results duplicate check,
+    # which the attempts table replaced; per-exam exports and rebuilds still filter sessions by
+    # exam_id, so keep a plain index for those instead of paying for the expression on every insert
+    c.execute("DROP INDEX IF EXISTS idx_sessions_exam_student")
+    c.execute("CREATE INDEX IF NOT EXISTS idx_sessions_exam ON sessions(exam_id)")
+
+
+MIGRATIONS = [
+    (1, 'baseline schema', _m001_baseline),
+    (2, 'indexes for hot queries', _m002_hot_query_indexes),
+    (3, 'normalized responses table', _m003_responses),
+    (4, 'attempts table for duplicate-start checks', _m004_attempts),
+    (5, 'per-exam question sampling and question topics', _m005_question_sampling),
+    (6, 'autosaves table for server-side drafts', _m006_autosaves),
+    (7, 'results.request_id for idempotent submits', _m007_submit_request_ids),
+    (8, 'drop the unused sessions(exam_id, LOWER(student_name)) index', _m008_drop_session_name_index),
+]
+
+LATEST_SCHEMA_VERSION = MIGRATIONS[-1][0]
+
+
+def _current_version(c):
+    try:
+        c.execute('SELECT MAX(version) FROM schema_version')
+    except sqlite3.OperationalError:
+        return 0
+    row = c.fetchone()
+    return (row[0] or 0) if row else 0
+
+
+def migrate_db(conn=None):
+    """
+    Bring the schema up to LATEST_SCHEMA_VERSION. Returns the list of versions applied
+    (empty when the database was already current).
+    """
+    own = conn is None
+    if own:
+        conn = db_conn()
+    try:
+        c = conn.cursor()
+        if _current_version(c) >= LATEST_SCHEMA_VERSION:
+            return []
+        c.execute('BEGIN IMMEDIATE')
+        try:
+            c.execute('''CREATE TABLE IF NOT EXISTS schema_version (
+                version INTEGER PRIMARY KEY,
+                description TEXT,
+                applied_at INTEGER
+            )''')
+            # re-read under the write lock: another process may have migrated meanwhile
+            current = _current_version(c)
+            applied = []
+            for version, description, step in MIGRATIONS:
+                if version <= current:
+                    continue
+                step(c)
+                c.execute('INSERT INTO schema_version (version, description, applied_at) VALUES (?,?,?)',
+                          (version, description, int(time.time())))
+                applied.append(version)
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        return applied
+    finally:
+        if own:
+            conn.close()
@@ -0,0 +1,197 @@
+"""
+Scoring of answer sheets against answer keys.
+
+A paper is graded as two integer vectors of the same length: the key (index of the
+correct option per question, -1 when a question has no valid answer) and the
+selection (index the student picked, -1 for blank/unreadable). A sheet scores one
+point per position where the two agree and the selection is not blank.
+
+grade() does one sheet; grade_batch() does many at once and returns the full
+sheets x questions correctness matrix, which item_stats() turns into per-question
+difficulty / discrimination figures for analytics. Keys and selections may be in
+presented order (per-student shuffles, as submit uses them) or in stored order
+(one shared key, which is what the matrix wants for analytics).
+
+NumPy is used when installed (it comes with pandas); otherwise the same functions
+fall back to plain lists with identical results.
+"""
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+NO_ANSWER = -1
+MAX_CHOICES = 256       # anything larger is garbage, not an option index (and keeps int16 safe)
+
+
+# what browsers actually post ("A".."Z", "a".."z", "0".."25"), resolved with one dict lookup
+_COMMON = {None: NO_ANSWER, '': NO_ANSWER}
+_COMMON.update({chr(65 + i): i for i in range(26)})
+_COMMON.update({chr(97 + i): i for i in range(26)})
+_COMMON.update({str(i): i for i in range(26)})
+
+
+def parse_choice(raw):
+    """
+    Option index from what a browser or answer sheet sent: 2, "2", "c", "C) ...".
+    Returns NO_ANSWER for blanks and anything unreadable.
+    """
+    if raw.__class__ is str:
+        i = _COMMON.get(raw)
+        if i is not None:
+            return i
+    if raw is None or raw == '' or isinstance(raw, bool):
+        return NO_ANSWER
+    if isinstance(raw, (int, float)):
+        try:
+            i = int(raw)
+        except (ValueError, OverflowError):     # nan / inf
+            return NO_ANSWER
+        return i if 0 <= i < MAX_CHOICES else NO_ANSWER
+    s = str(raw).strip()
+    if s.isdecimal():
+        return int(s) if len(s) <= 3 and int(s) < MAX_CHOICES else NO_ANSWER
+    if s and 'A' <= s[0].upper() <= 'Z':
+        return ord(s[0].upper()) - 65
+    return NO_ANSWER
+
+
+def selections(answers, qids):
+    """Selection vector for one sheet: answers {qid: raw} read in qids order."""
+    get = (answers or {}).get
+    sel = [parse_choice(get(qid)) for qid in qids]
+    return np.asarray(sel, dtype=np.int16) if np is not None else sel
+
+
+def selection_matrix(sheets, qids):
+    """sheets x questions selections for many answer dicts sharing one question order."""
+    rows = [[parse_choice((a or {}).get(qid)) for qid in qids] for a in sheets]
+    if np is not None:
+        return np.asarray(rows, dtype=np.int16).reshape(len(rows), len(qids))
+    return rows
+
+
+def as_key(indexes):
+    return np.asarray(indexes, dtype=np.int16) if np is not None else [int(i) for i in indexes]
+
+
+def grade(key, selected):
+    """(score, correct) for one sheet; correct is a bool vector in the key's order."""
+    if np is not None:
+        key = np.asarray(key, dtype=np.int16)
+        selected = np.asarray(selected, dtype=np.int16)
+        correct = (selected == key) & (selected >= 0)
+        return int(correct.sum()), correct
+    correct = [s >= 0 and s == k for k, s in zip(key, selected)]
+    return sum(correct), correct
+
+
+def grade_batch(keys, selected):
+    """
+    Grade many sheets at once. keys is one key shared by every sheet (1-D) or one
+    key per sheet (2-D, e.g. per-student shuffles); selected is sheets x questions.
+    Returns (scores, correct) where correct is the sheets x questions bool matrix.
+    """
+    if np is not None:
+        keys = np.asarray(keys, dtype=np.int16)
+        selected = np.asarray(selected, dtype=np.int16)
+        if selected.ndim == 1:
+            selected = selected.reshape(1, -1)
+        correct = (selected == keys) & (selected >= 0)      # a 1-D key broadcasts over rows
+        return correct.sum(axis=1), correct
+    shared = bool(keys) and not isinstance(keys[0], (list, tuple))
+    correct = [[s >= 0 and s == k for k, s in zip(keys if shared else keys[i], row)]
+               for i, row in enumerate(selected)]
+    return [sum(r) for r in correct], correct
+
+
+def matrix_from_rows(rows, qids):
+    """
+    Correctness matrix from stored responses: rows of (sheet id, question id, is_correct),
+    columns in qids order. Every response row marks its question as shown to that sheet,
+    so K-of-N papers leave the questions a sheet never saw out of the seen mask.
+    Returns (sheet ids, correct matrix, seen mask).
+    """
+    col = {qid: j for j, qid in enumerate(qids)}
+    sheets = {}
+    for sheet, qid, ok in rows:
+        cells = sheets.setdefault(sheet, ([], []))
+        if qid in col:
+            cells[0].append(col[qid])
+            if ok:
+                cells[1].append(col[qid])
+    ids = list(sheets)
+    if np is not None:
+        seen = np.zeros((len(ids), len(qids)), dtype=bool)
+        m = np.zeros((len(ids), len(qids)), dtype=bool)
+        for i, sheet in enumerate(ids):
+            seen[i, sheets[sheet][0]] = True
+            m[i, sheets[sheet][1]] = True
+        return ids, m, seen
+    seen = [[False] * len(qids) for _ in ids]
+    m = [[False] * len(qids) for _ in ids]
+    for i, sheet in enumerate(ids):
+        for j in sheets[sheet][0]:
+            seen[i][j] = True
+        for j in sheets[sheet][1]:
+            m[i][j] = True
+    return ids, m, seen
+
+
+def item_stats(correct, seen=None):
+    """
+    Per-question figures from a correctness matrix (stored question order):
+    difficulty = share of sheets that got it right, discrimination = difficulty in
+    the top 27% of total scores minus difficulty in the bottom 27%. With a seen mask
+    (K-of-N papers) each question only counts the sheets it was shown on; a question
+    nobody saw gets None for both.
+    """
+    if np is not None:
+        m = np.asarray(correct, dtype=bool)
+        if m.ndim != 2 or not m.shape[0]:
+            return {'difficulty': [], 'discrimination': []}
+        if seen is None:
+            totals = m.sum(axis=1)
+            k = max(1, int(round(m.shape[0] * 0.27)))
+            order = np.argsort(totals, kind='stable')
+            low, high = m[order[:k]], m[order[-k:]]
+            return {
+                'difficulty': m.mean(axis=0).round(4).tolist(),
+                'discrimination': (high.mean(axis=0) - low.mean(axis=0)).round(4).tolist(),
+            }
+        shown = np.asarray(seen, dtype=bool)
+        m = m & shown
+        order = np.argsort(m.sum(axis=1), kind='stable')
+        difficulty, discrimination = [], []
+        for j in range(m.shape[1]):
+            ranked = order[shown[order, j]]         # sheets shown question j, lowest total first
+            if not ranked.size:
+                difficulty.append(None)
+                discrimination.append(None)
+                continue
+            k = max(1, int(round(ranked.size * 0.27)))
+            col = m[:, j]
+            difficulty.append(round(float(col[ranked].mean()), 4))
+            discrimination.append(round(float(col[ranked[-k:]].mean() - col[ranked[:k]].mean()), 4))
+        return {'difficulty': difficulty, 'discrimination': discrimination}
+    rows = [list(r) for r in correct]
+    if not rows:
+        return {'difficulty': [], 'discrimination': []}
+    n = len(rows[0])
+    shown = [list(r) for r in seen] if seen is not None else [[True] * n for _ in rows]
+    rows = [[bool(v and s) for v, s in zip(r, sr)] for r, sr in zip(rows, shown)]
+    order = sorted(range(len(rows)), key=lambda i: sum(rows[i]))
+
+    def share(idx, j):
+        return sum(1 for i in idx if rows[i][j]) / len(idx)
+    difficulty, discrimination = [], []
+    for j in range(n):
+        ranked = [i for i in order if shown[i][j]]
+        if not ranked:
+            difficulty.append(None)
+            discrimination.append(None)
+            continue
+        k = max(1, int(round(len(ranked) * 0.27)))
+        difficulty.append(round(share(ranked, j), 4))
+        discrimination.append(round(share(ranked[-k:], j) - share(ranked[:k], j), 4))
+    return {'difficulty': difficulty, 'discrimination': discrimination}
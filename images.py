@@ -0,0 +1,192 @@
+"""
+Processing for uploaded question images.
+
+Uploads are stored content-addressed: the file name is the sha256 of the uploaded
+bytes, so re-uploading the same picture (for another exam, or in the next batch)
+reuses the existing file and two different "diagram.png"s can never collide.
+
+store() only hashes the upload and writes it to its final name, then returns the
+URL at once. A small thread pool then resizes and recompresses it in the background:
+
+    <hash>.<ext>        main image, longest side <= CBT_IMAGE_MAX_PX (default 1600)
+    <hash>_md.<ext>     medium variant (CBT_IMAGE_MD_PX, default 800)
+    <hash>_sm.<ext>     thumbnail (CBT_IMAGE_SM_PX, default 400)
+
+The main file is swapped in with os.replace, so readers only ever see a complete image.
+Photos are written as progressive JPEG and images with transparency as optimized PNG.
+Without Pillow, uploads are still stored content-addressed, just not processed.
+"""
+import hashlib
+import io
+import os
+import threading
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+try:
+    from PIL import Image, ImageOps
+except ImportError:
+    Image = None
+    ImageOps = None
+
+MAX_PX = int(os.environ.get('CBT_IMAGE_MAX_PX', '1600'))
+VARIANTS = (
+    ('md', int(os.environ.get('CBT_IMAGE_MD_PX', '800'))),
+    ('sm', int(os.environ.get('CBT_IMAGE_SM_PX', '400'))),
+)
+JPEG_QUALITY = int(os.environ.get('CBT_IMAGE_JPEG_QUALITY', '82'))
+WORKERS = int(os.environ.get('CBT_IMAGE_WORKERS', str(min(4, os.cpu_count() or 1))))
+
+_pool = None
+_pool_lock = threading.Lock()
+_pending = {}                     # path -> Future, so a duplicate upload does not queue twice
+_stats = {'stored': 0, 'deduplicated': 0, 'processed': 0, 'failed': 0, 'bytes_in': 0, 'bytes_out': 0}
+_stats_lock = threading.Lock()
+
+
+def _count(key, n=1):
+    with _stats_lock:
+        _stats[key] += n
+
+
+def _executor():
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = ThreadPoolExecutor(max_workers=max(1, WORKERS), thread_name_prefix='cbt-images')
+        return _pool
+
+
+def _has_alpha(img):
+    return img.mode in ('RGBA', 'LA', 'PA') or (img.mode == 'P' and 'transparency' in img.info)
+
+
+def output_extension(data, filename):
+    """Extension the processed image will have: .png for images with transparency, else .jpg."""
+    if Image is None:
+        return os.path.splitext(filename or '')[1].lower() or '.bin'
+    try:
+        with Image.open(io.BytesIO(data)) as img:    # header only, no decode
+            return '.png' if _has_alpha(img) or img.format == 'GIF' else '.jpg'
+    except Exception:
+        return os.path.splitext(filename or '')[1].lower() or '.bin'
+
+
+def variant_name(name, variant):
+    stem, ext = os.path.splitext(name)
+    return f'{stem}_{variant}{ext}'
+
+
+def _atomic_write(path, data):
+    tmp = f'{path}.{uuid.uuid4().hex[:8]}.tmp'
+    with open(tmp, 'wb') as f:
+        f.write(data)
+    os.replace(tmp, path)
+
+
+def _magic(ext):
+    return b'\x89PNG' if ext == '.png' else b'\xff\xd8'
+
+
+def _encode(img, ext):
+    out = io.BytesIO()
+    if ext == '.png':
+        img.save(out, format='PNG', optimize=True)
+    else:
+        if img.mode not in ('RGB', 'L'):
+            img = img.convert('RGB')
+        img.save(out, format='JPEG', quality=JPEG_QUALITY, optimize=True, progressive=True)
+    return out.getvalue()
+
+
+def process(path):
+    """Resize/recompress the main image at path and write its variants."""
+    try:
+        with open(path, 'rb') as f:
+            raw = f.read()
+        ext = os.path.splitext(path)[1]
+        with Image.open(io.BytesIO(raw)) as src:
+            rotated = src.getexif().get(0x0112, 1) != 1
+            img = ImageOps.exif_transpose(src)      # phone photos: honour the camera orientation
+            img.load()
+        main = img.copy()
+        main.thumbnail((MAX_PX, MAX_PX), Image.LANCZOS)
+        data = _encode(main, ext)
+        # keep the upload itself when it is already small, upright and in the right format
+        if len(data) < len(raw) or main.size != img.size or rotated or not raw.startswith(_magic(ext)):
+            _atomic_write(path, data)
+        else:
+            data = raw
+        for variant, px in VARIANTS:
+            v = img.copy()
+            v.thumbnail((px, px), Image.LANCZOS)
+            _atomic_write(variant_name(path, variant), _encode(v, ext))
+        _count('processed')
+        _count('bytes_in', len(raw))
+        _count('bytes_out', len(data))
+    except Exception:
+        _count('failed')
+        raise
+    finally:
+        with _pool_lock:
+            _pending.pop(path, None)
+
+
+def store(data, filename, directory):
+    """
+    Store an uploaded image under its content hash in directory and queue its processing.
+    Returns the stored file name (<sha256[:32]><ext>).
+    """
+    name = hashlib.sha256(data).hexdigest()[:32] + output_extension(data, filename)
+    path = os.path.join(directory, name)
+    with _pool_lock:
+        duplicate = path in _pending or os.path.exists(path)
+        if not duplicate:
+            _pending[path] = None           # claim it before writing
+    if duplicate:
+        _count('deduplicated')
+        return name
+    try:
+        os.makedirs(directory, exist_ok=True)
+        _atomic_write(path, data)
+    except Exception:
+        with _pool_lock:
+            _pending.pop(path, None)
+        raise
+    _count('stored')
+    if Image is None:
+        with _pool_lock:
+            _pending.pop(path, None)
+        return name
+    future = _executor().submit(process, path)
+    with _pool_lock:
+        if path in _pending:                # not finished already
+            _pending[path] = future
+    return name
+
+
+def is_pending(path):
+    """True while path still holds the raw upload (its processed version is not written yet)."""
+    with _pool_lock:
+        return path in _pending
+
+
+def wait(timeout=None):
+    """Block until every queued image has been processed (CLI tools, shutdown)."""
+    with _pool_lock:
+        pending = [f for f in _pending.values() if f is not None]
+    for f in pending:
+        try:
+            f.result(timeout=timeout)
+        except Exception:
+            pass
+
+
+def stats():
+    with _stats_lock:
+        out = dict(_stats)
+    with _pool_lock:
+        out['pending'] = len(_pending)
+    out['workers'] = WORKERS
+    out['pillow'] = Image is not None
+    return out
@@ -0,0 +1,180 @@
+"""
+Append-only CSV journals for the per-subject / per-tag result files.
+
+results_<label>.csv is the journal: rows are only ever appended, each batch in a
+single write followed by fsync, so a crash loses at most the batch being written
+and never corrupts earlier rows. results_<label>.xlsx is derived from it by
+materialize(), which writes a temp file and swaps it in with os.replace, so a
+reader opening the .xlsx sees either the old or the new workbook, never half of one.
+
+Writers and readers coordinate through a lock on a sidecar <journal>.lock file
+(fcntl.flock on POSIX, msvcrt.locking on Windows) plus an in-process lock, so
+several worker processes can share the files. The sidecar is locked rather than
+the journal itself because replace() swaps the journal's inode.
+"""
+import contextlib
+import csv
+import io
+import os
+import threading
+import uuid
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+try:
+    import msvcrt
+except ImportError:
+    msvcrt = None
+
+try:
+    import pandas as pd
+except Exception:
+    pd = None
+
+_locks = {}
+_locks_guard = threading.Lock()
+
+
+def _thread_lock(path):
+    with _locks_guard:
+        return _locks.setdefault(os.path.abspath(path), threading.RLock())
+
+
+@contextlib.contextmanager
+def locked(path, shared=False):
+    """Hold the journal lock for path (shared for readers where the OS supports it)."""
+    with _thread_lock(path):
+        fh = open(path + '.lock', 'a+b')
+        try:
+            if fcntl is not None:
+                fcntl.flock(fh.fileno(), fcntl.LOCK_SH if shared else fcntl.LOCK_EX)
+            elif msvcrt is not None:
+                fh.seek(0)
+                msvcrt.locking(fh.fileno(), msvcrt.LK_LOCK, 1)
+            yield
+        finally:
+            try:
+                if fcntl is not None:
+                    fcntl.flock(fh.fileno(), fcntl.LOCK_UN)
+                elif msvcrt is not None:
+                    fh.seek(0)
+                    msvcrt.locking(fh.fileno(), msvcrt.LK_UNLCK, 1)
+            finally:
+                fh.close()
+
+
+def _header(path):
+    try:
+        with open(path, newline='', encoding='utf-8') as fh:
+            return next(csv.reader(fh), None)
+    except FileNotFoundError:
+        return None
+
+
+def _fsync_dir(path):
+    if os.name != 'posix':
+        return
+    fd = os.open(os.path.dirname(os.path.abspath(path)), os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+def append(path, rows):
+    """Append rows (dicts) to the journal; columns follow the existing header, or the first row's keys."""
+    if not rows:
+        return 0
+    with locked(path):
+        fieldnames = _header(path)
+        new = not fieldnames
+        if new:
+            fieldnames = list(rows[0].keys())
+        buf = io.StringIO()
+        writer = csv.DictWriter(buf, fieldnames=fieldnames, extrasaction='ignore', lineterminator='\n')
+        if new:
+            writer.writeheader()
+        writer.writerows(rows)
+        with open(path, 'ab') as fh:
+            fh.write(buf.getvalue().encode('utf-8'))
+            fh.flush()
+            os.fsync(fh.fileno())
+        if new:
+            _fsync_dir(path)
+    return len(rows)
+
+
+def replace(path, rows):
+    """Rewrite a journal from scratch (regrade rebuilds) with an atomic rename."""
+    fieldnames = list(rows[0].keys()) if rows else (_header(path) or ['name', 'score'])
+    buf = io.StringIO()
+    writer = csv.DictWriter(buf, fieldnames=fieldnames, extrasaction='ignore', lineterminator='\n')
+    writer.writeheader()
+    writer.writerows(rows)
+    with locked(path):
+        _atomic_write(path, buf.getvalue().encode('utf-8'))
+
+
+def _atomic_write(path, data):
+    stem, ext = os.path.splitext(path)
+    tmp = f'{stem}.{uuid.uuid4().hex[:8]}.tmp{ext}'
+    with open(tmp, 'wb') as fh:
+        fh.write(data)
+        fh.flush()
+        os.fsync(fh.fileno())
+    os.replace(tmp, path)
+    _fsync_dir(path)
+
+
+def _snapshot(path):
+    with locked(path, shared=True):
+        try:
+            with open(path, 'rb') as fh:
+                data = fh.read()
+                mtime = os.fstat(fh.fileno()).st_mtime_ns
+        except FileNotFoundError:
+            return None, None
+    end = data.rfind(b'\n')
+    return (data[:end + 1] if end >= 0 else data), mtime
+
+
+def snapshot(path):
+    """
+    Bytes of the journal as of now, cut after the last complete row, or None if it
+    does not exist. Taken under the lock, so no half-written batch is included.
+    """
+    return _snapshot(path)[0]
+
+
+def is_stale(journal_path, xlsx_path):
+    """True when the .xlsx is missing or older than its journal."""
+    try:
+        j = os.stat(journal_path).st_mtime_ns
+    except FileNotFoundError:
+        return False
+    try:
+        return os.stat(xlsx_path).st_mtime_ns < j
+    except FileNotFoundError:
+        return True
+
+
+def materialize(journal_path, xlsx_path, force=False):
+    """Rebuild xlsx_path from a snapshot of the journal. Returns True if it was written."""
+    if pd is None or (not force and not is_stale(journal_path, xlsx_path)):
+        return False
+    data, mtime = _snapshot(journal_path)
+    if data is None:
+        return False
+    df = pd.read_csv(io.BytesIO(data), dtype=str, keep_default_na=False)
+    for col in ('score', 'total'):
+        if col in df.columns:
+            df[col] = pd.to_numeric(df[col], errors='coerce')
+    out = io.BytesIO()
+    df.to_excel(out, index=False, engine='openpyxl')
+    with locked(xlsx_path):
+        _atomic_write(xlsx_path, out.getvalue())
+        # stamp it with the journal time it reflects: rows appended meanwhile keep it stale
+        os.utime(xlsx_path, ns=(mtime, mtime))
+    return True
@@ -0,0 +1,99 @@
+// Service worker for exam pages (served at /exam-sw.js, scope /exam/).
+//
+// When an exam opens, the page posts the list from /api/exam/<token>/manifest and
+// everything the exam needs is cached up front. If the LAN drops mid-exam the student
+// can keep navigating, images keep showing and reloads are answered from the cache.
+//  - /static/... and /api/exam_content/... answered with Cache-Control: immutable
+//    (fingerprinted / content-addressed URLs): cache first, kept for good
+//  - other /static/... (e.g. a raw upload still being resized), exam pages and
+//    question pages: network first, cache when offline
+//  - everything else (status, submit, autosave) goes straight to the network
+const STATIC_CACHE = 'cbt-static-v2';
+const PAGES_CACHE = 'cbt-pages-v2';
+
+self.addEventListener('install', () => self.skipWaiting());
+
+self.addEventListener('activate', (event) => {
+  event.waitUntil((async () => {
+    const keep = [STATIC_CACHE, PAGES_CACHE];
+    for (const key of await caches.keys()) {
+      if (key.startsWith('cbt-') && !keep.includes(key)) await caches.delete(key);
+    }
+    await self.clients.claim();
+  })());
+});
+
+function isAsset(url) {
+  return url.pathname.startsWith('/static/') || url.pathname.startsWith('/api/exam_content/');
+}
+
+// only the server knows whether a URL can never change; trust its header, not the path
+function isImmutable(res) {
+  return res.ok && /\bimmutable\b/.test(res.headers.get('Cache-Control') || '');
+}
+
+function isExamPage(url) {
+  return url.pathname.startsWith('/exam/') || /^\/api\/exam\/[^/]+\/questions$/.test(url.pathname);
+}
+
+async function precache(urls) {
+  const [staticCache, pagesCache] = await Promise.all([caches.open(STATIC_CACHE), caches.open(PAGES_CACHE)]);
+  let cached = 0;
+  // one by one and tolerant: a missing image must not abort the rest of the bundle
+  for (const u of urls) {
+    const url = new URL(u, self.location.origin);
+    try {
+      if (isAsset(url) && await staticCache.match(url)) { cached++; continue; }
+      const res = await fetch(url, { credentials: 'same-origin' });
+      if (res.ok) { await (isImmutable(res) ? staticCache : pagesCache).put(url, res); cached++; }
+    } catch (e) { /* offline already; whatever is cached stays */ }
+  }
+  return cached;
+}
+
+self.addEventListener('message', (event) => {
+  const msg = event.data || {};
+  if (msg.type === 'precache' && Array.isArray(msg.urls)) {
+    event.waitUntil(precache(msg.urls).then((cached) => {
+      if (event.source) event.source.postMessage({ type: 'precached', cached, total: msg.urls.length });
+    }));
+  }
+});
+
+self.addEventListener('fetch', (event) => {
+  const req = event.request;
+  if (req.method !== 'GET') return;
+  const url = new URL(req.url);
+  if (url.origin !== self.location.origin) return;
+
+  if (isAsset(url)) {
+    event.respondWith((async () => {
+      const [staticCache, pagesCache] = await Promise.all([caches.open(STATIC_CACHE), caches.open(PAGES_CACHE)]);
+      const hit = await staticCache.match(req, { ignoreVary: true });
+      if (hit) return hit;
+      try {
+        const res = await fetch(req);
+        if (isImmutable(res)) staticCache.put(req, res.clone());
+        else if (res.ok) pagesCache.put(req, res.clone());
+        return res;
+      } catch (e) {
+        const stale = await pagesCache.match(req, { ignoreVary: true });
+        if (stale) return stale;
+        throw e;
+      }
+    })());
+  } else if (isExamPage(url)) {
+    event.respondWith((async () => {
+      const cache = await caches.open(PAGES_CACHE);
+      try {
+        const res = await fetch(req);
+        if (res.ok) cache.put(req, res.clone());
+        return res;
+      } catch (e) {
+        const hit = await cache.match(req, { ignoreVary: true });
+        if (hit) return hit;
+        throw e;
+      }
+    })());
+  }
+});
@@ -0,0 +1,697 @@
+let questions = [];
+// Long papers arrive with only their first page inline plus the full id list; the other
+// questions are placeholders ({id, pending: true}) filled from /api/exam/<token>/questions.
+// When the index also has a content_url, nothing is inline: the exam's shared content is
+// fetched once from that immutable URL and this student's choice permutations applied to it.
+let questionIndex = null;
+try {
+  const questionsData = document.getElementById('questions-data').textContent;
+  questions = JSON.parse(questionsData);
+  const indexEl = document.getElementById('question-index-data');
+  if (indexEl) {
+    questionIndex = JSON.parse(indexEl.textContent);
+    const loaded = {};
+    questions.forEach(q => { loaded[q.id] = q; });
+    questions = questionIndex.ids.map(id => loaded[id] || { id, pending: true });
+  }
+  if (!Array.isArray(questions) || questions.length === 0) {
+    throw new Error('Invalid or empty questions data');
+  }
+} catch (e) {
+  console.error('Error parsing questions:', e, 'Raw data:', document.getElementById('questions-data').textContent);
+  document.getElementById('errorNotice').style.display = 'block';
+  document.getElementById('errorNotice').innerText = 'Error loading exam questions. Please try again or contact support.';
+  document.getElementById('questions').style.display = 'none';
+  document.getElementById('submitBtn').disabled = true;
+  document.getElementById('reviewBtn').disabled = true;
+  document.getElementById('prevBtn').disabled = true;
+  document.getElementById('nextBtn').disabled = true;
+}
+
+let token = '';
+try {
+  token = JSON.parse(document.getElementById('token-data').textContent);
+} catch (e) {
+  console.error('Error parsing token:', e);
+}
+
+let pageSize = (questionIndex && questionIndex.page_size) || questions.length || 10;
+const PREFETCH_AHEAD = 3;
+const loadingPages = new Set();
+
+async function loadExamContent() {
+  try {
+    const res = await fetch(questionIndex.content_url);
+    if (!res.ok) throw new Error('HTTP ' + res.status);
+    const content = (await res.json()).questions || {};
+    questions = questions.map((q, i) => {
+      const c = content[q.id];
+      const perm = questionIndex.perm[i];
+      if (!c || !q.pending || !perm) return q;
+      return { id: q.id, question: c.question, image_path: c.image_path, choices: perm.map(j => c.choices[j]) };
+    });
+  } catch (e) {
+    console.error('Failed to load exam content, falling back to paged questions', e);
+  }
+}
+const contentReady = (questionIndex && questionIndex.content_url) ? loadExamContent() : Promise.resolve();
+
+async function loadQuestionPage(offset) {
+  offset = Math.floor(offset / pageSize) * pageSize;
+  if (loadingPages.has(offset)) return;
+  loadingPages.add(offset);
+  try {
+    const res = await fetch(`/api/exam/${encodeURIComponent(token)}/questions?offset=${offset}&limit=${pageSize}`);
+    if (!res.ok) throw new Error('HTTP ' + res.status);
+    const js = await res.json();
+    (js.questions || []).forEach((q, i) => {
+      if (questions[offset + i] && questions[offset + i].id === q.id) questions[offset + i] = q;
+    });
+  } catch (e) {
+    console.error('Failed to load questions at', offset, e);
+  } finally {
+    loadingPages.delete(offset);
+  }
+}
+
+// make sure the current question and the next few are loaded
+async function ensureQuestions(index) {
+  const wanted = [];
+  for (let i = index; i < Math.min(questions.length, index + 1 + PREFETCH_AHEAD); i++) {
+    if (questions[i].pending) wanted.push(Math.floor(i / pageSize) * pageSize);
+  }
+  await Promise.all([...new Set(wanted)].map(loadQuestionPage));
+}
+
+// The page is cached and served with an ETag, so it carries the absolute end time rather
+// than a countdown; /api/exam/<token>/status supplies the server clock to correct for skew.
+let endTime = 0;
+let clockSkew = 0;  // server time - local time, in seconds
+let remaining = 0;
+try {
+  endTime = Number(JSON.parse(document.getElementById('end-time-data').textContent));
+  if (isNaN(endTime) || endTime <= 0) {
+    throw new Error('Invalid end_time');
+  }
+  remaining = Math.max(0, Math.round(endTime - Date.now() / 1000));
+} catch (e) {
+  console.error('Error parsing end_time:', e, 'Raw data:', document.getElementById('end-time-data').textContent);
+  remaining = 0;
+  document.getElementById('errorNotice').style.display = 'block';
+  document.getElementById('errorNotice').innerText += ' Error loading exam timer. Exam may have expired.';
+  document.getElementById('submitBtn').disabled = true;
+}
+
+function computeRemaining() {
+  return Math.max(0, Math.round(endTime - (Date.now() / 1000 + clockSkew)));
+}
+
+async function syncStatus() {
+  try {
+    const ctl = new AbortController();
+    setTimeout(() => ctl.abort(), 5000);
+    const res = await fetch(`/api/exam/${encodeURIComponent(token)}/status`, { cache: 'no-store', signal: ctl.signal });
+    if (!res.ok) return null;
+    const st = await res.json();
+    if (st.end_time) endTime = Number(st.end_time);
+    if (st.server_time) clockSkew = Number(st.server_time) - Date.now() / 1000;
+    remaining = computeRemaining();
+    mergeServerAnswers(st.answers);
+    return st;
+  } catch (e) {
+    return null;  // offline: keep counting down against the embedded end time
+  }
+}
+
+const timerEl = document.getElementById('timer');
+const qContainer = document.getElementById('questions');
+const submitBtn = document.getElementById('submitBtn');
+const draftStatus = document.getElementById('draftStatus');
+const serverNotice = document.getElementById('serverNotice');
+const progressFill = document.getElementById('progressFill');
+const prevBtn = document.getElementById('prevBtn');
+const nextBtn = document.getElementById('nextBtn');
+const reviewBtn = document.getElementById('reviewBtn');
+const questionCounter = document.getElementById('questionCounter');
+const unansweredList = document.getElementById('unansweredList');
+
+let answers = {}; // qid -> letter (A, B, C, ...)
+let currentQuestionIndex = 0; // Track current question
+const DRAFT_KEY = 'cbt:answers:' + token;
+let draftSavedTimer = null;
+
+// Restore draft (normalize to LETTER values)
+try {
+  const s = localStorage.getItem(DRAFT_KEY);
+  if (s) {
+    const parsed = JSON.parse(s) || {};
+    for (const k of Object.keys(parsed)) {
+      const v = parsed[k];
+      if (v === null || v === '') { delete parsed[k]; continue; }
+      if (typeof v === 'number' || /^\d+$/.test(String(v))) {
+        const idx = Number(v);
+        parsed[k] = String.fromCharCode(65 + idx);
+      } else if (typeof v === 'string') {
+        const s0 = String(v).trim();
+        if (/^[A-Za-z]$/.test(s0)) parsed[k] = s0.toUpperCase();
+        else if (/^\d+$/.test(s0)) parsed[k] = String.fromCharCode(65 + Number(s0));
+        else parsed[k] = s0.toUpperCase();
+      } else {
+        delete parsed[k];
+      }
+    }
+    answers = parsed;
+  }
+} catch (e) {
+  console.error('Error restoring draft:', e);
+}
+
+// Render current question
+function escapeHtml(s) {
+  return String(s || '').replace(/[&<>"']/g, m => ({'&':'&amp;','<':'&lt;','>':'&gt;','"':'&quot;',"'" :'&#39;'}[m]));
+}
+
+// Processed uploads (<hash>.<ext>) have _sm/_md variants next to them; let the browser pick
+// the smallest that fits. If a variant is not written yet, fall back to the main image.
+function imageSrcset(src) {
+  const m = /^(\/static\/uploads\/[\w\/]+\/[0-9a-f]{32})(\.[a-z]+)$/.exec(src || '');
+  if (!m) return '';
+  return ` srcset="${m[1]}_sm${m[2]} 400w, ${m[1]}_md${m[2]} 800w, ${src} 1600w"` +
+         ` sizes="(max-width: 700px) 90vw, 490px" onerror="if (this.srcset) this.removeAttribute('srcset');"`;
+}
+
+function render() {
+  qContainer.innerHTML = '';
+  unansweredList.style.display = 'none';
+  const q = questions[currentQuestionIndex];
+  if (!q) return;
+
+  questionCounter.innerText = `Question ${currentQuestionIndex + 1} of ${questions.length}`;
+  if (q.pending) {
+    const idx = currentQuestionIndex;
+    prevBtn.disabled = idx === 0;
+    nextBtn.disabled = idx === questions.length - 1;
+    qContainer.innerHTML = '<div class="question small">Loading question...</div>';
+    ensureQuestions(idx).then(() => {
+      if (currentQuestionIndex !== idx) return;
+      if (questions[idx].pending) {
+        qContainer.innerHTML = '<div class="question small">Could not load this question. Check your connection, then press Next and Previous to retry.</div>';
+      } else {
+        render();
+      }
+    });
+    return;
+  }
+  ensureQuestions(currentQuestionIndex);
+
+  const div = document.createElement('div');
+  div.className = 'question';
+  let html = `<div><strong>Q${currentQuestionIndex + 1}.</strong> ${escapeHtml(q.question)}</div>`;
+  if (q.image) {
+    html += `<div><img src="${q.image}" alt="Question image" style="max-width:300px;margin-top:10px;border-radius:8px;"></div>`;
+  }
+  // 👇 show image if the question has one
+  if (q.image_path) {
+    html += `<div style="margin-top:10px">
+              <img src="${q.image_path}"${imageSrcset(q.image_path)}
+                    alt="Question image"
+                    style="max-width:50%;border-radius:8px;box-shadow:0 1px 3px rgba(0,0,0,0.1)">
+            </div>`;
+  }
+
+  html += '<div style="margin-top:12px">';
+  (q.choices || []).forEach((ch, i) => {
+    const id = `q_${q.id}_${i}`;
+    const letter = String.fromCharCode(65 + i); // A, B, C, ...
+    html += `<label class="label"><input type="radio" name="r_${q.id}" value="${letter}" id="${id}"> ${letter}. ${escapeHtml(ch)}</label>`;
+  });
+  html += '</div>';
+  div.innerHTML = html;
+  qContainer.appendChild(div);
+
+  // Update navigation buttons
+  prevBtn.disabled = currentQuestionIndex === 0;
+  nextBtn.disabled = currentQuestionIndex === questions.length - 1;
+
+  // Add radio listeners
+  const radios = div.querySelectorAll('input[type="radio"]');
+  radios.forEach(r => {
+    r.addEventListener('change', (ev) => {
+      // store letter (A/B/...)
+      answers[q.id] = String(ev.target.value).toUpperCase();
+      scheduleDraftSave();
+      queueAutosave(q.id, answers[q.id]);
+      updateProgress();
+    });
+  });
+
+  // Restore saved choice
+  if (answers[q.id] !== undefined) {
+    const sel = div.querySelector(`input[value="${answers[q.id]}"]`);
+    if (sel) sel.checked = true;
+  }
+}
+if (questions.length > 0) contentReady.then(render);
+
+// Navigation
+prevBtn.addEventListener('click', () => {
+  if (currentQuestionIndex > 0) {
+    currentQuestionIndex--;
+    render();
+  }
+});
+nextBtn.addEventListener('click', () => {
+  if (currentQuestionIndex < questions.length - 1) {
+    currentQuestionIndex++;
+    render();
+  }
+});
+
+// Keyboard navigation
+document.addEventListener('keydown', (ev) => {
+  if (ev.key === 'ArrowLeft' && currentQuestionIndex > 0) {
+    currentQuestionIndex--;
+    render();
+  } else if (ev.key === 'ArrowRight' && currentQuestionIndex < questions.length - 1) {
+    currentQuestionIndex++;
+    render();
+  }
+});
+
+// Review unanswered questions
+reviewBtn.addEventListener('click', () => {
+  const unanswered = questions.filter(q => answers[q.id] === undefined);
+  if (unanswered.length === 0) {
+    unansweredList.style.display = 'block';
+    unansweredList.innerHTML = '<div class="small success">All questions answered!</div>';
+    return;
+  }
+  unansweredList.style.display = 'block';
+  unansweredList.innerHTML = '<div class="small">Unanswered questions (click to jump):</div>';
+  unanswered.forEach((q, idx) => {
+    const qIndex = questions.findIndex(que => que.id === q.id);
+    const div = document.createElement('div');
+    div.innerText = q.pending ? `Q${qIndex + 1}` : `Q${qIndex + 1}: ${q.question.substring(0, 50)}...`;
+    div.addEventListener('click', () => {
+      currentQuestionIndex = qIndex;
+      render();
+    });
+    unansweredList.appendChild(div);
+  });
+});
+
+// Save draft to localStorage
+function saveDraft() {
+  try {
+    localStorage.setItem(DRAFT_KEY, JSON.stringify(answers || {}));
+    draftStatus.innerText = 'Saved';
+    draftStatus.style.color = 'var(--success)';
+  } catch (e) {
+    console.error('Failed to save draft', e);
+    draftStatus.innerText = 'Save failed';
+    draftStatus.style.color = 'var(--danger)';
+  }
+  if (draftSavedTimer) { clearTimeout(draftSavedTimer); draftSavedTimer = null; }
+}
+
+function scheduleDraftSave() {
+  draftStatus.innerText = 'Saving...';
+  draftStatus.style.color = 'var(--muted)';
+  if (draftSavedTimer) clearTimeout(draftSavedTimer);
+  draftSavedTimer = setTimeout(saveDraft, 700);
+}
+
+// Server-side autosave: answer changes are sent as deltas, batched over a couple of seconds.
+// Failed sends keep their deltas and go out with the next batch.
+const AUTOSAVE_DELAY_MS = 2000;
+let autosaveDeltas = {};
+let autosaveTimer = null;
+
+function queueAutosave(qid, letter) {
+  autosaveDeltas[qid] = letter === undefined ? null : letter;
+  if (!autosaveTimer) autosaveTimer = setTimeout(sendAutosave, AUTOSAVE_DELAY_MS);
+}
+
+async function sendAutosave() {
+  autosaveTimer = null;
+  const batch = autosaveDeltas;
+  if (!Object.keys(batch).length) return;
+  autosaveDeltas = {};
+  try {
+    const res = await fetch(`/api/autosave/${encodeURIComponent(token)}`, {
+      method: 'POST',
+      headers: { 'Content-Type': 'application/json' },
+      body: JSON.stringify({ answers: batch }),
+      keepalive: true
+    });
+    if (res.status >= 500) throw new Error('HTTP ' + res.status);
+  } catch (e) {
+    autosaveDeltas = Object.assign(batch, autosaveDeltas);
+    if (!autosaveTimer) autosaveTimer = setTimeout(sendAutosave, AUTOSAVE_DELAY_MS * 3);
+  }
+}
+
+// answers saved on the server (e.g. from another PC) fill in what this browser does not have
+function mergeServerAnswers(serverAnswers) {
+  let merged = 0;
+  for (const [qid, letter] of Object.entries(serverAnswers || {})) {
+    if (answers[qid] === undefined && letter) { answers[qid] = letter; merged++; }
+  }
+  if (!merged) return;
+  saveDraft();
+  updateProgress();
+  const q = questions[currentQuestionIndex];
+  if (q && !q.pending) render();
+}
+
+document.addEventListener('visibilitychange', () => {
+  if (document.visibilityState === 'hidden' && autosaveTimer) {
+    clearTimeout(autosaveTimer);
+    sendAutosave();
+  }
+});
+
+function updateProgress() {
+  const total = questions.length || 1;
+  const answered = Object.keys(answers).length;
+  const pct = Math.round((answered / total) * 100);
+  progressFill.style.width = pct + '%';
+}
+if (questions.length > 0) updateProgress();
+
+// check for unanswered questions; returns true if user confirmed or all answered
+function checkUnanswered() {
+  const unanswered = questions.filter(q => !answers.hasOwnProperty(q.id));
+  if (unanswered.length === 0) return true;
+  const msg = `You have ${unanswered.length} unanswered question(s). Continue submission?`;
+  return confirm(msg);
+}
+
+// Beforeunload guard
+function beforeUnloadHandler(e) {
+  try {
+    const s = localStorage.getItem(DRAFT_KEY);
+    if (s && Object.keys(JSON.parse(s) || {}).length > 0) {
+      e.preventDefault();
+      e.returnValue = 'You have answers saved locally. Leaving will discard them.';
+      return e.returnValue;
+    }
+  } catch (e) {}
+}
+window.addEventListener('beforeunload', beforeUnloadHandler);
+
+// Timer and auto-submit
+function updateTimer() {
+  const mins = Math.floor(remaining / 60);
+  const secs = remaining % 60;
+  timerEl.innerText = `${String(mins).padStart(2, '0')}:${String(secs).padStart(2, '0')}`;
+  if (remaining <= 0) {
+    lockUI();
+    autoSubmit();
+    clearInterval(timerInterval);
+  }
+  remaining = computeRemaining();
+}
+
+//Start countdown timer once the server clock is known (a lab PC's clock can be far off)
+let timerInterval = null;
+function startTimer() {
+  timerInterval = setInterval(updateTimer, 1000);
+  updateTimer();
+}
+if (endTime > 0) syncStatus().then(startTimer); else startTimer();
+
+function lockUI() {
+  document.querySelectorAll('input, button').forEach(el => el.classList.add('disabled'));
+  submitBtn.disabled = true;
+}
+
+// Submissions go through an outbox in localStorage: if the LAN is down the answers stay
+// queued (also across a reload) and are sent when the connection returns. Retries are
+// spread out with random delays so a whole lab does not hit the server at the same moment.
+const OUTBOX_KEY = 'cbt:outbox:' + token;
+let outboxTimer = null;
+
+// One idempotency key per token, kept across reloads: a retry, the timer's autoSubmit and
+// a click on Submit all carry the same key, so the server records the result only once.
+const SUBMIT_ID_KEY = 'cbt:submit-id:' + token;
+function submitRequestId() {
+  let id = null;
+  try { id = localStorage.getItem(SUBMIT_ID_KEY); } catch (e) {}
+  if (!id) {
+    id = (window.crypto && crypto.randomUUID) ? crypto.randomUUID()
+      : Date.now().toString(36) + '-' + Math.random().toString(36).slice(2, 12);
+    try { localStorage.setItem(SUBMIT_ID_KEY, id); } catch (e) {}
+  }
+  return id;
+}
+
+function postSubmission(payload) {
+  return fetch('/api/submit/' + token, {
+    method: 'POST',
+    headers: { 'Content-Type': 'application/json', 'Idempotency-Key': payload.request_id },
+    body: JSON.stringify(payload)
+  });
+}
+
+async function isAlreadySubmitted(res) {
+  if (res.status !== 403 && res.status !== 409) return false;
+  try {
+    const body = await res.clone().json();
+    return /^already[ _]submitted$/.test(body.error || '');
+  } catch (e) {
+    return false;
+  }
+}
+
+function finishExam() {
+  window.removeEventListener('beforeunload', beforeUnloadHandler);
+  window.location.href = '/results/' + token;
+}
+
+async function flushOutbox() {
+  let payload = null;
+  try { payload = JSON.parse(localStorage.getItem(OUTBOX_KEY) || 'null'); } catch (e) {}
+  if (!payload) return true;
+  if (!payload.request_id) payload.request_id = submitRequestId();   // queued by an older page
+  let res = null;
+  try {
+    res = await postSubmission(payload);
+  } catch (e) {
+    res = null;   // network down
+  }
+  if (res && (res.ok || await isAlreadySubmitted(res))) {
+    // recorded (now or by an earlier attempt): nothing left to send
+    localStorage.removeItem(OUTBOX_KEY);
+    if (outboxTimer) { clearTimeout(outboxTimer); outboxTimer = null; }
+    finishExam();
+    return true;
+  }
+  if (res && res.status < 500) {
+    // refused (e.g. time expired): keep the answers on this computer, the invigilator can retry
+    let msg = 'HTTP ' + res.status;
+    try { msg = (await res.json()).error || msg; } catch (e) {}
+    draftStatus.innerText = 'Submission refused (' + msg + '). Your answers are kept on this computer; ask the invigilator before closing this page.';
+    draftStatus.style.color = 'var(--danger)';
+    submitBtn.disabled = false;
+    return false;
+  }
+  draftStatus.innerText = 'Offline: answers saved on this computer, will submit when the connection returns. Do not close this page.';
+  draftStatus.style.color = 'var(--danger)';
+  scheduleOutboxRetry(3000 + Math.random() * 12000);
+  return false;
+}
+
+function scheduleOutboxRetry(delay) {
+  if (outboxTimer) clearTimeout(outboxTimer);
+  outboxTimer = setTimeout(() => { outboxTimer = null; flushOutbox(); }, delay);
+}
+
+window.addEventListener('online', () => {
+  if (localStorage.getItem(OUTBOX_KEY)) scheduleOutboxRetry(Math.random() * 5000);
+});
+
+async function submitAnswers() {
+  const payload = { answers, request_id: submitRequestId() };
+  const storedName = localStorage.getItem('cbt:student_name');
+  if (storedName) payload.name = storedName;
+  try {
+    localStorage.setItem(OUTBOX_KEY, JSON.stringify(payload));
+  } catch (e) {
+    console.error('Could not queue submission', e);
+  }
+  lockUI();
+  draftStatus.innerText = 'Submitting...';
+  draftStatus.style.color = 'var(--muted)';
+  if (!localStorage.getItem(OUTBOX_KEY)) {
+    // storage full/disabled: fall back to a direct attempt
+    try {
+      const res = await postSubmission(payload);
+      if (!res.ok && !(await isAlreadySubmitted(res))) throw new Error('HTTP ' + res.status);
+      finishExam();
+    } catch (e) {
+      console.error('Submit failed:', e);
+      draftStatus.innerText = 'Submit failed. Please try again.';
+      draftStatus.style.color = 'var(--danger)';
+      submitBtn.disabled = false;
+    }
+    return;
+  }
+  await flushOutbox();
+}
+
+async function autoSubmit() {
+  if (localStorage.getItem(OUTBOX_KEY)) return flushOutbox();   // already queued
+  if (!checkUnanswered()) {
+    alert('You have unanswered questions, but time is up. Submitting now.');
+  }
+  await submitAnswers();
+}
+
+submitBtn.addEventListener('click', async () => {
+  if (!checkUnanswered()) {
+    const confirmed = confirm('You have unanswered questions. Do you really want to submit?');
+    if (!confirmed) return;
+  }
+  await submitAnswers();
+});
+
+// a submission queued before a reload/crash is sent as soon as the page is back
+if (localStorage.getItem(OUTBOX_KEY)) {
+  lockUI();
+  flushOutbox();
+}
+
+// Offline bundle: the service worker caches everything listed in the exam's manifest.
+// Service workers only run on https or localhost; elsewhere the outbox above still applies.
+async function setupOfflineBundle() {
+  if (!('serviceWorker' in navigator) || !window.isSecureContext) return;
+  try {
+    await navigator.serviceWorker.register('/exam-sw.js', { scope: '/exam/' });
+    const res = await fetch(`/api/exam/${encodeURIComponent(token)}/manifest`);
+    if (!res.ok) return;
+    const manifest = await res.json();
+    const reg = await navigator.serviceWorker.ready;
+    if (reg.active) reg.active.postMessage({ type: 'precache', urls: manifest.urls || [] });
+  } catch (e) {
+    console.warn('Offline bundle unavailable:', e);
+  }
+}
+if (token) setupOfflineBundle();
+
+// Calculator toggle + logic (scoped to avoid collisions)
+(function(){
+  const popup = document.getElementById('calcPopup');
+  const toggleBtn = document.getElementById('calcToggleBtn');
+  const closeBtn = document.getElementById('calcCloseBtn');
+  const display = popup.querySelector('#calc-display');
+  const prevDisplay = popup.querySelector('#calc-previous-operand');
+  const buttons = popup.querySelectorAll('.calculator-button');
+
+  let calcState = {
+    current: '0',
+    previous: '',
+    operation: null,
+    shouldReset: false
+  };
+
+  function formatDisplay(v){ return String(v); }
+
+  function resetCalcScreen(){
+    calcState.current = '';
+    calcState.shouldReset = false;
+  }
+
+  function appendCalcNumber(n){
+    if (calcState.current === '0' || calcState.shouldReset) resetCalcScreen();
+    if (n === '.' && calcState.current.includes('.')) return;
+    calcState.current = (calcState.current || '') + n;
+    updateCalcUI();
+  }
+
+  function chooseCalcOp(op){
+    if (calcState.current === '') return;
+    if (calcState.previous !== ''){
+      computeCalc();
+    }
+    calcState.operation = op;
+    calcState.previous = calcState.current;
+    calcState.current = '';
+    updateCalcUI();
+  }
+
+  function computeCalc(){
+    const prev = parseFloat(calcState.previous);
+    const curr = parseFloat(calcState.current);
+    if (isNaN(prev) || isNaN(curr)) return;
+    let out;
+    switch(calcState.operation){
+      case '+': out = prev + curr; break;
+      case '-': out = prev - curr; break;
+      case '*': out = prev * curr; break;
+      case '/': out = curr === 0 ? '∞' : (prev / curr); break;
+      default: return;
+    }
+    calcState.current = String(out);
+    calcState.operation = null;
+    calcState.previous = '';
+    calcState.shouldReset = true;
+    updateCalcUI();
+  }
+
+  function clearCalc(){
+    calcState.current = '0'; calcState.previous=''; calcState.operation=null; calcState.shouldReset=false;
+    updateCalcUI();
+  }
+
+  function delCalc(){
+    if (calcState.shouldReset){ calcState.current='0'; calcState.shouldReset=false; updateCalcUI(); return; }
+    if (!calcState.current || calcState.current.length <= 1) calcState.current='0';
+    else calcState.current = calcState.current.slice(0,-1);
+    updateCalcUI();
+  }
+
+  function updateCalcUI(){
+    display.textContent = formatDisplay(calcState.current || '0');
+    prevDisplay.textContent = (calcState.previous ? (calcState.previous + (calcState.operation ? (' ' + calcState.operation) : '')) : '');
+  }
+
+  // attach button handlers
+  buttons.forEach(btn=>{
+    const action = btn.dataset.action;
+    const val = btn.dataset.val;
+    btn.addEventListener('click', (e)=>{
+      if (action === 'num') appendCalcNumber(val);
+      else if (action === 'op') chooseCalcOp(val);
+      else if (action === 'eval') computeCalc();
+      else if (action === 'clear') clearCalc();
+      else if (action === 'del') delCalc();
+    });
+  });
+
+  // Toggle overlay
+function toggleCalc() {
+  const open = popup.classList.toggle('open');
+  popup.setAttribute('aria-hidden', String(!open));
+  if (open) {
+      setTimeout(() => popup.querySelector('[data-action="num"]')?.focus(), 150);
+    }
+  }
+  toggleBtn.addEventListener('click', toggleCalc);
+  closeBtn.addEventListener('click', toggleCalc);
+
+
+  // allow keyboard interaction when calculator open (digits + ops + Enter/Esc)
+  document.addEventListener('keydown', (ev)=>{
+    if (!overlay.classList.contains('open')) return;
+    if (/^[0-9]$/.test(ev.key)) { appendCalcNumber(ev.key); ev.preventDefault(); }
+    if (ev.key === '.') { appendCalcNumber('.'); ev.preventDefault(); }
+    if (['+','-','*','/'].includes(ev.key)) { chooseCalcOp(ev.key); ev.preventDefault(); }
+    if (ev.key === 'Enter') { computeCalc(); ev.preventDefault(); }
+    if (ev.key === 'Backspace') { delCalc(); ev.preventDefault(); }
+    if (ev.key === 'Escape') { toggleCalc(); ev.preventDefault(); }
+  });
+
+  // initialize UI
+  updateCalcUI();
+})();
@@ -0,0 +1,115 @@
+"""
+Measure bytes on the wire with and without response compression for the pages and
+APIs a class hits on exam day, plus the static assets (run tools/precompress_static.py
+first to include the precompressed siblings).
+
+    python tools/bench_compression.py
+    python tools/bench_compression.py --questions 200 --students 300
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+import uuid
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+
+
+def seed(conn, questions, students):
+    rnd = random.Random(7)
+    exam_id = uuid.uuid4().hex[:8]
+    now = int(time.time())
+    words = ('photosynthesis chlorophyll mitochondria equation velocity triangle hypotenuse '
+             'adjective paragraph constitution parliament latitude longitude molecule').split()
+
+    def sentence(n):
+        return ' '.join(rnd.choice(words) for _ in range(n)).capitalize()
+
+    conn.execute('INSERT INTO exams (id,title,duration_minutes,started,tag) VALUES (?,?,?,?,?)',
+                 (exam_id, 'Bench Exam', 60, 1, 'SS2'))
+    conn.executemany('INSERT INTO questions (id,exam_id,question,choices,answer_index) VALUES (?,?,?,?,?)',
+                     [(uuid.uuid4().hex[:8], exam_id, sentence(18) + '?',
+                       json.dumps([sentence(4) for _ in range(4)]), q % 4) for q in range(questions)])
+    names = [f'{rnd.choice(["Ada", "Bola", "Chidi", "Dayo", "Emeka"])} Student{i:04d}' for i in range(students)]
+    conn.executemany('INSERT INTO class_students (id,class_name,student_name) VALUES (?,?,?)',
+                     [(uuid.uuid4().hex[:8], 'SS2', n) for n in names])
+    tokens = []
+    for n in names:
+        tok = uuid.uuid4().hex[:8]
+        tokens.append(tok)
+        conn.execute('INSERT INTO sessions (token,exam_id,start_time,end_time,student_name) VALUES (?,?,?,?,?)',
+                     (tok, exam_id, now, now + 3600, n))
+        conn.execute('INSERT INTO results (id,token,name,score,submitted_at,total) VALUES (?,?,?,?,?,?)',
+                     (uuid.uuid4().hex[:8], tok, n, rnd.randint(0, questions), now, questions))
+    conn.commit()
+    return exam_id
+
+
+def main():
+    p = argparse.ArgumentParser()
+    p.add_argument('--questions', type=int, default=100)
+    p.add_argument('--students', type=int, default=300)
+    args = p.parse_args()
+
+    tmpdir = tempfile.mkdtemp(prefix='cbt_bench_')
+    os.environ['CBT_DB_PATH'] = os.path.join(tmpdir, 'bench.db')
+    sys.path.insert(0, str(ROOT))
+    import app as cbt  # noqa: E402  (must import after CBT_DB_PATH is set)
+    from db import db_conn  # noqa: E402
+
+    conn = db_conn()
+    exam_id = seed(conn, args.questions, args.students)
+    conn.close()
+
+    client = cbt.app.test_client()
+    client.post('/api/login_admin', json={'username': cbt.ADMIN_USERNAME, 'password': cbt.ADMIN_PASSWORD})
+    token = client.post('/api/start_exam', json={'exam_id': exam_id, 'student_name': 'Bench Taker'}).get_json()['token']
+    page = client.get(f'/exam/{token}').get_data(as_text=True)
+    content_url = None
+    if 'question-index-data' in page:
+        index = json.loads(page.split('id="question-index-data" type="application/json">')[1].split('</script>')[0])
+        content_url = index.get('content_url')
+
+    targets = [
+        ('exam page', f'/exam/{token}'),
+        ('exam content json', content_url),
+        ('questions page (paged API)', f'/api/exam/{token}/questions?offset=0&limit=50'),
+        ('list_exams', '/api/list_exams'),
+        ('class roster', '/api/list_class_students?class=SS2'),
+        ('results CSV export', f'/api/download_subject?exam_id={exam_id}&format=csv'),
+        ('static exam.js', '/static/js/exam.js'),
+        ('static exam.css', '/static/css/exam.css'),
+    ]
+    encodings = [('identity', None), ('gzip', 'gzip')]
+    if cbt.brotli is not None:
+        encodings.append(('br', 'br, gzip'))
+
+    print(f"{'endpoint':30} " + ' '.join(f'{name:>10}' for name, _ in encodings) + '   saved')
+    totals = {name: 0 for name, _ in encodings}
+    for label, url in targets:
+        if not url:
+            continue
+        sizes = {}
+        for name, header in encodings:
+            headers = {'Accept-Encoding': header} if header else {'Accept-Encoding': 'identity'}
+            resp = client.get(url, headers=headers)
+            sizes[name] = len(resp.get_data())
+            resp.close()
+            totals[name] += sizes[name]
+        best = min(sizes.values())
+        saved = 1 - best / sizes['identity'] if sizes['identity'] else 0
+        print(f'{label:30} ' + ' '.join(f'{sizes[n]:>10,}' for n, _ in encodings) + f'   {saved:5.0%}')
+
+    best = min(totals.values())
+    print(f"{'total':30} " + ' '.join(f'{totals[n]:>10,}' for n, _ in encodings)
+          + f"   {1 - best / totals['identity']:5.0%}")
+    print(f'\nPer class of {args.students} (each endpoint once per student): '
+          f"{totals['identity'] * args.students / 1e6:.1f} MB -> {best * args.students / 1e6:.1f} MB")
+
+
+if __name__ == '__main__':
+    main()
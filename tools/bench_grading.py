@@ -0,0 +1,147 @@
+"""
+Compare the per-question grading loop submit used to run with grading.py, for one
+sheet at a time (what submit does) and for a whole batch of queued/offline sheets
+(including building the sheets x questions correctness matrix analytics reuse).
+Every path must produce the same scores; the tool exits non-zero if they differ.
+
+    python tools/bench_grading.py
+    python tools/bench_grading.py --questions 60 --sheets 20000
+"""
+import argparse
+import random
+import sys
+import time
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+import grading  # noqa: E402
+
+
+def make_sheets(questions, sheets, choices, seed):
+    """Per-student shuffled papers (presented key) and the raw answers a browser would post."""
+    rnd = random.Random(seed)
+    qids = [f'q{i:04d}' for i in range(questions)]
+    stored_key = [rnd.randrange(choices) for _ in qids]
+    papers = []
+    for _ in range(sheets):
+        order = qids[:]
+        rnd.shuffle(order)
+        keys, answers = [], {}
+        for qid in order:
+            perm = list(range(choices))
+            rnd.shuffle(perm)
+            correct = perm.index(stored_key[int(qid[1:])])
+            keys.append(correct)
+            r = rnd.random()
+            if r < 0.55:
+                answers[qid] = chr(65 + correct)        # the client posts letters
+            elif r < 0.9:
+                answers[qid] = chr(65 + rnd.randrange(choices))
+            elif r < 0.95:
+                answers[qid] = str(rnd.randrange(choices))
+            # else: left blank
+        papers.append((order, keys, answers))
+    return papers
+
+
+def loop_grade(order, keys, answers):
+    """The per-question loop submit used before grading.py (parsing and comparison only)."""
+    score = 0
+    correct = []
+    for qid, correct_index in zip(order, keys):
+        sel_idx = None
+        try:
+            raw = answers.get(qid)
+            if raw is None or raw == '':
+                sel_idx = None
+            elif isinstance(raw, (int, float)):
+                sel_idx = int(raw)
+            else:
+                s = str(raw).strip()
+                if s.isdigit():
+                    sel_idx = int(s)
+                elif len(s) >= 1 and s[0].isalpha():
+                    sel_idx = ord(s[0].upper()) - 65
+        except Exception:
+            sel_idx = None
+        ok = sel_idx is not None and sel_idx == correct_index
+        score += ok
+        correct.append({'id': qid, 'is_correct': ok})
+    return score, correct
+
+
+def timed(fn):
+    t0 = time.perf_counter()
+    out = fn()
+    return out, (time.perf_counter() - t0) * 1000.0
+
+
+def main():
+    p = argparse.ArgumentParser()
+    p.add_argument('--questions', type=int, default=50)
+    p.add_argument('--sheets', type=int, default=5000)
+    p.add_argument('--choices', type=int, default=4)
+    p.add_argument('--seed', type=int, default=11)
+    args = p.parse_args()
+
+    papers = make_sheets(args.questions, args.sheets, args.choices, args.seed)
+    backend = 'numpy ' + grading.np.__version__ if grading.np is not None else 'pure python (numpy not installed)'
+    print(f'{args.sheets} sheets x {args.questions} questions, grading backend: {backend}\n')
+
+    loop_scores, t_loop = timed(lambda: [loop_grade(*p)[0] for p in papers])
+
+    def one_by_one():
+        return [grading.grade(grading.as_key(keys), grading.selections(ans, order))[0]
+                for order, keys, ans in papers]
+    single_scores, t_single = timed(one_by_one)
+
+    def batch():
+        # per-student shuffles: one key row per sheet, selections read in each sheet's own order
+        keys = [k for _, k, _ in papers]
+        sel = [[grading.parse_choice(ans.get(q)) for q in order] for order, _, ans in papers]
+        scores, _ = grading.grade_batch(keys, sel)
+        return [int(s) for s in scores]
+    batch_scores, t_batch = timed(batch)
+
+    # analytics: shared stored-order key, matrix + item statistics in one go
+    qids = sorted(papers[0][0])
+    sheets = [ans for _, _, ans in papers]
+
+    def matrix():
+        sel = grading.selection_matrix(sheets, qids)
+        scores, correct = grading.grade_batch(grading.as_key([0] * len(qids)), sel)
+        return grading.item_stats(correct)
+    _, t_matrix = timed(matrix)
+
+    # re-grading already parsed sheets (e.g. after an answer key fix): comparison only
+    key_rows = [k for _, k, _ in papers]
+    sel_rows = [[grading.parse_choice(ans.get(q)) for q in order] for order, _, ans in papers]
+    _, t_loop_cmp = timed(lambda: [sum(1 for k, s in zip(kr, sr) if s >= 0 and s == k)
+                                   for kr, sr in zip(key_rows, sel_rows)])
+    if grading.np is not None:
+        key_rows = grading.np.asarray(key_rows, dtype=grading.np.int16)
+        sel_rows = grading.np.asarray(sel_rows, dtype=grading.np.int16)
+    _, t_batch_cmp = timed(lambda: grading.grade_batch(key_rows, sel_rows))
+
+    rows = [
+        ('per-question loop (old submit)', t_loop),
+        ('grading.grade, one sheet at a time', t_single),
+        ('grading.grade_batch, all sheets', t_batch),
+        ('selection matrix + item_stats', t_matrix),
+    ]
+    for name, ms in rows:
+        print(f'{name:38} {ms:9.1f} ms  {ms * 1000.0 / args.sheets:8.1f} us/sheet  x{t_loop / ms:5.1f}')
+    print('\npre-parsed selections, comparison only:')
+    for name, ms in (('python loop', t_loop_cmp), ('grading.grade_batch', t_batch_cmp)):
+        print(f'{name:38} {ms:9.1f} ms  {ms * 1000.0 / args.sheets:8.1f} us/sheet  x{t_loop_cmp / ms:5.1f}')
+
+    if not (loop_scores == single_scores == batch_scores):
+        bad = sum(1 for a, b, c in zip(loop_scores, single_scores, batch_scores) if not a == b == c)
+        print(f'\nMISMATCH: {bad} sheet(s) scored differently')
+        sys.exit(1)
+    print(f'\nAll {args.sheets} scores identical (mean {sum(loop_scores) / len(loop_scores):.2f}/{args.questions}).')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,169 @@
+"""
+Seed a throwaway database with exam-day sized data, then check the query plan
+and timing of every hot statement. Exits non-zero if any of them regresses to a
+full table scan of a table it is expected to search by index.
+
+    python tools/bench_query_plans.py                  # default ~50k sessions/results
+    python tools/bench_query_plans.py --students 2000 --exams 100 --runs 200
+"""
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+import uuid
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+
+# statement name -> (sql, params builder, aliases that must be SEARCHed, never SCANned)
+HOT_QUERIES = [
+    ('start_exam attempt lookup',
+     'SELECT token, submitted_at FROM attempts WHERE exam_id=? AND normalized_name=?',
+     lambda d: (d['exam_id'], d['student_name'].lower()), {'attempts'}),
+    ('submit attempt update',
+     'EXPLAIN_ONLY UPDATE attempts SET submitted_at=? WHERE token=?',
+     lambda d: (0, d['token']), {'attempts'}),
+    ('per-exam results export',
+     'SELECT r.token, r.name, r.score, r.total, r.submitted_at FROM results r JOIN sessions s ON r.token=s.token WHERE s.exam_id=?',
+     lambda d: (d['exam_id'],), {'s', 'r'}),
+    ('submit delete prior result',
+     'EXPLAIN_ONLY DELETE FROM results WHERE token=?',
+     lambda d: (d['token'],), {'results'}),
+    ('results_page lookup',
+     'SELECT r.score, r.submitted_at, r.name, s.exam_id FROM results r JOIN sessions s ON r.token=s.token WHERE r.token=?',
+     lambda d: (d['token'],), {'r', 's'}),
+    ('autosave draft lookup',
+     'SELECT question_id, answer FROM autosaves WHERE token=?',
+     lambda d: (d['token'],), {'autosaves'}),
+    ('audit_logs by date',
+     'SELECT ts, action, teacher_id, exam_id, details FROM audit_logs WHERE ts BETWEEN ? AND ? ORDER BY ts DESC',
+     lambda d: (d['day_start'], d['day_start'] + 86399), {'audit_logs'}),
+    ('audit_logs by exam + date',
+     'SELECT ts, action, teacher_id, exam_id, details FROM audit_logs WHERE exam_id=? AND ts BETWEEN ? AND ? ORDER BY ts DESC',
+     lambda d: (d['exam_id'], d['day_start'], d['day_start'] + 86399), {'audit_logs'}),
+    ('class roster listing',
+     'SELECT id, student_name FROM class_students WHERE class_name=? ORDER BY student_name',
+     lambda d: (d['class_name'],), {'class_students'}),
+    ('class roster duplicate check',
+     'SELECT id FROM class_students WHERE class_name=? AND LOWER(student_name)=LOWER(?)',
+     lambda d: (d['class_name'], d['student_name']), {'class_students'}),
+    ('registered student duplicate check',
+     'SELECT id FROM registered_students WHERE exam_id=? AND LOWER(student_name)=LOWER(?)',
+     lambda d: (d['exam_id'], d['student_name']), {'registered_students'}),
+    ('exam questions',
+     'SELECT id, question, choices, answer_index, image_path, topic FROM questions WHERE exam_id=? ORDER BY rowid',
+     lambda d: (d['exam_id'],), {'questions'}),
+]
+
+
+def seed(conn, students, exams, questions_per_exam, audit_days):
+    rnd = random.Random(42)
+    c = conn.cursor()
+    classes = ['SS1', 'SS2', 'SS3']
+    names = [f'Student {i:05d}' for i in range(students)]
+    # full uuids: the app's 8-hex ids collide (birthday bound) at this many seeded rows
+    exam_ids = [uuid.uuid4().hex for _ in range(exams)]
+    now = int(time.time())
+
+    c.executemany('INSERT INTO exams (id,title,duration_minutes,started,tag) VALUES (?,?,?,?,?)',
+                  [(eid, f'Exam {i}', 30, 1, rnd.choice(classes)) for i, eid in enumerate(exam_ids)])
+    c.executemany('INSERT INTO questions (id,exam_id,question,choices,answer_index) VALUES (?,?,?,?,?)',
+                  [(uuid.uuid4().hex, eid, f'Question {q}', '["a","b","c","d"]', q % 4)
+                   for eid in exam_ids for q in range(questions_per_exam)])
+    c.executemany('INSERT INTO class_students (id,class_name,student_name) VALUES (?,?,?)',
+                  [(uuid.uuid4().hex, classes[i % 3], n) for i, n in enumerate(names)])
+
+    sessions, results, regs = [], [], []
+    for eid in exam_ids:
+        for n in names:
+            tok = uuid.uuid4().hex
+            sessions.append((tok, eid, now, now + 1800, n))
+            results.append((uuid.uuid4().hex, tok, n, rnd.randint(0, questions_per_exam), now))
+            regs.append((uuid.uuid4().hex, eid, n))
+    c.executemany('INSERT INTO sessions (token,exam_id,start_time,end_time,student_name) VALUES (?,?,?,?,?)', sessions)
+    c.executemany('INSERT INTO results (id,token,name,score,submitted_at) VALUES (?,?,?,?,?)', results)
+    c.executemany('INSERT INTO registered_students (id,exam_id,student_name) VALUES (?,?,?)', regs)
+    c.executemany('INSERT INTO attempts (exam_id,normalized_name,token,started_at,submitted_at) VALUES (?,?,?,?,?)',
+                  [(s[1], s[4].lower(), s[0], now, now) for s in sessions])
+
+    audit = [(uuid.uuid4().hex, now - rnd.randint(0, audit_days * 86400), 'submit_exam', None,
+              rnd.choice(exam_ids), '{}') for _ in range(len(results))]
+    c.executemany('INSERT INTO audit_logs (id,ts,action,teacher_id,exam_id,details) VALUES (?,?,?,?,?,?)', audit)
+    conn.commit()
+
+    day = time.localtime(now - 86400)
+    return {
+        'exam_id': exam_ids[len(exam_ids) // 2],
+        'student_name': names[len(names) // 2].upper(),
+        'token': sessions[len(sessions) // 2][0],
+        'class_name': 'SS2',
+        'day_start': int(time.mktime((day.tm_year, day.tm_mon, day.tm_mday, 0, 0, 0, 0, 0, -1))),
+    }, len(sessions)
+
+
+def check_plan(conn, sql, params, must_search):
+    rows = conn.execute('EXPLAIN QUERY PLAN ' + sql, params).fetchall()
+    details = [r[3] for r in rows]
+    bad = []
+    for d in details:
+        parts = d.split()
+        if len(parts) >= 2 and parts[0] == 'SCAN' and parts[1] in must_search:
+            bad.append(d)
+    return details, bad
+
+
+def time_query(conn, sql, params, runs):
+    t0 = time.perf_counter()
+    for _ in range(runs):
+        conn.execute(sql, params).fetchall()
+    return (time.perf_counter() - t0) * 1000.0 / runs
+
+
+def main():
+    p = argparse.ArgumentParser()
+    p.add_argument('--students', type=int, default=1000)
+    p.add_argument('--exams', type=int, default=50)
+    p.add_argument('--questions', type=int, default=40, help='questions per exam')
+    p.add_argument('--audit-days', type=int, default=90)
+    p.add_argument('--runs', type=int, default=100, help='timed executions per statement')
+    args = p.parse_args()
+
+    tmpdir = tempfile.mkdtemp(prefix='cbt_bench_')
+    os.environ['CBT_DB_PATH'] = os.path.join(tmpdir, 'bench.db')
+    sys.path.insert(0, str(ROOT))
+    import db  # noqa: E402  (must import after CBT_DB_PATH is set)
+
+    t0 = time.perf_counter()
+    db.migrate_db()
+    conn = db.db_conn()
+    sample, n_sessions = seed(conn, args.students, args.exams, args.questions, args.audit_days)
+    print(f"Seeded {n_sessions} sessions/results in {time.perf_counter() - t0:.1f}s ({os.environ['CBT_DB_PATH']})\n")
+
+    failures = 0
+    for name, sql, build, must_search in HOT_QUERIES:
+        params = build(sample)
+        explain_only = sql.startswith('EXPLAIN_ONLY ')
+        if explain_only:
+            sql = sql[len('EXPLAIN_ONLY '):]
+        details, bad = check_plan(conn, sql, params, must_search)
+        ms = None if explain_only else time_query(conn, sql, params, args.runs)
+        status = 'FAIL' if bad else 'ok'
+        timing = f'{ms:8.3f} ms' if ms is not None else '   (write)'
+        print(f'[{status:4}] {timing}  {name}')
+        for d in details:
+            print(f'              {d}')
+        if bad:
+            failures += 1
+
+    conn.close()
+    print()
+    if failures:
+        print(f'{failures} statement(s) fell back to a full table scan.')
+        sys.exit(1)
+    print('All hot statements use an index.')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,262 @@
+"""
+Exam-day load simulation: N students hit the real app over HTTP at the same time.
+
+Each simulated student lists classes / exams / the class roster, starts the exam, loads
+the exam page and its content, checks the timer, autosaves a few answers with think
+time in between, then waits at a barrier so every student auto-submits at the same
+instant (the timer running out). The app runs in-process on a threaded werkzeug server
+against a seeded throwaway database, with result files written to the temp dir too.
+
+    python tools/load_test.py                              # 100 students, 40 questions
+    python tools/load_test.py --students 300 --autosaves 10
+    python tools/load_test.py --ramp 50,100,200,400 --slo-ms 2000
+
+Reports p50/p95/p99/max latency, errors and "database is locked" responses per endpoint.
+The capacity figure is the largest class that kept every endpoint's p95 under --slo-ms
+with no errors (with --ramp), plus an estimate from the measured submit throughput:
+how many students can submit at once and all get an answer within the SLO.
+"""
+import argparse
+import json
+import os
+import random
+import re
+import sys
+import tempfile
+import threading
+import time
+import urllib.error
+import urllib.request
+import uuid
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+
+ENDPOINTS = ('list_classes', 'list_exams', 'list_class_students', 'start_exam', 'exam_page',
+             'exam_content', 'status', 'autosave', 'submit')
+
+
+class Recorder:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.samples = {name: [] for name in ENDPOINTS}
+        self.errors = {name: 0 for name in ENDPOINTS}
+        self.locked = {name: 0 for name in ENDPOINTS}
+        self.examples = {}
+
+    def add(self, name, ms, status, body):
+        locked = b'database is locked' in body
+        with self._lock:
+            self.samples[name].append(ms)
+            if status is None or status >= 400:
+                self.errors[name] += 1
+                self.examples.setdefault(name, f'{status}: {body[:160]!r}')
+            if locked:
+                self.locked[name] += 1
+
+
+def request(base, rec, name, path, payload=None, headers=None):
+    """One HTTP call, timed; returns (status, body bytes). Connection errors count as errors."""
+    data = json.dumps(payload).encode() if payload is not None else None
+    req = urllib.request.Request(base + path, data=data, method='POST' if data is not None else 'GET')
+    if data is not None:
+        req.add_header('Content-Type', 'application/json')
+    for k, v in (headers or {}).items():
+        req.add_header(k, v)
+    t0 = time.perf_counter()
+    status, body = None, b''
+    try:
+        with urllib.request.urlopen(req, timeout=60) as resp:
+            status, body = resp.status, resp.read()
+    except urllib.error.HTTPError as e:
+        status, body = e.code, e.read()
+    except Exception as e:
+        body = repr(e).encode()
+    rec.add(name, (time.perf_counter() - t0) * 1000.0, status, body)
+    return status, body
+
+
+def page_question_ids(html):
+    """Question ids the exam page ships (question index when present, else the inline questions)."""
+    m = re.search(r'id="question-index-data" type="application/json">(.*?)</script>', html, re.S)
+    if m:
+        idx = json.loads(m.group(1))
+        return idx.get('ids') or [], idx.get('content_url')
+    m = re.search(r'id="questions-data" type="application/json">(.*?)</script>', html, re.S)
+    return [q['id'] for q in json.loads(m.group(1))] if m else [], None
+
+
+def student(base, rec, exam_id, class_name, name, args, barrier, rnd):
+    def think():
+        time.sleep(rnd.uniform(0, args.think_ms) / 1000.0)
+
+    request(base, rec, 'list_classes', '/api/list_classes')
+    request(base, rec, 'list_exams', '/api/list_exams')
+    request(base, rec, 'list_class_students', f'/api/list_class_students?class={class_name}')
+    think()
+    status, body = request(base, rec, 'start_exam', '/api/start_exam',
+                           {'exam_id': exam_id, 'student_name': name, 'class': class_name})
+    token = json.loads(body).get('token') if status == 200 else None
+    answers = {}
+    if token:
+        status, body = request(base, rec, 'exam_page', f'/exam/{token}')
+        qids, content_url = page_question_ids(body.decode('utf-8', 'replace')) if status == 200 else ([], None)
+        if content_url:
+            request(base, rec, 'exam_content', content_url)
+        request(base, rec, 'status', f'/api/exam/{token}/status')
+        for i in range(args.autosaves):
+            think()
+            delta = {qid: rnd.choice('ABCD') for qid in rnd.sample(qids, min(len(qids), rnd.randint(1, 3)))}
+            answers.update(delta)
+            request(base, rec, 'autosave', f'/api/autosave/{token}', {'answers': delta})
+    try:
+        barrier.wait(timeout=args.barrier_timeout)    # time is up: the whole room submits together
+    except threading.BrokenBarrierError:
+        pass
+    if token:
+        key = uuid.uuid4().hex
+        request(base, rec, 'submit', f'/api/submit/{token}', {'answers': answers, 'request_id': key},
+                headers={'Idempotency-Key': key})
+
+
+def seed_exam(cbt, admin, students, questions, class_name):
+    """One started exam for class_name with its roster; returns (exam_id, names)."""
+    exam_id = uuid.uuid4().hex[:8]
+    names = [f'{class_name} Student {i:04d}' for i in range(students)]
+    conn = cbt.db_conn()
+    try:
+        conn.execute('INSERT OR IGNORE INTO classes (id, name) VALUES (?,?)', (uuid.uuid4().hex[:8], class_name))
+        conn.execute('INSERT INTO exams (id,title,duration_minutes,started,tag) VALUES (?,?,?,?,?)',
+                     (exam_id, f'Load Test {class_name}', 60, 0, class_name))
+        conn.executemany('INSERT INTO questions (id,exam_id,question,choices,answer_index) VALUES (?,?,?,?,?)',
+                         [(uuid.uuid4().hex[:8], exam_id, f'Question {q}: which option is right?',
+                           json.dumps([f'Option {c} for question {q}' for c in 'ABCD']), q % 4)
+                          for q in range(questions)])
+        conn.executemany('INSERT INTO class_students (id,class_name,student_name) VALUES (?,?,?)',
+                         [(uuid.uuid4().hex[:8], class_name, n) for n in names])
+        conn.commit()
+    finally:
+        conn.close()
+    # open it through the admin API so the session pool is warmed the way it is on exam day
+    r = admin.post('/api/set_exam_state', json={'exam_id': exam_id, 'started': True})
+    if r.status_code != 200:
+        raise SystemExit(f'could not open exam: {r.status_code} {r.get_data(as_text=True)[:200]}')
+    return exam_id, names
+
+
+def percentile(values, p):
+    if not values:
+        return 0.0
+    s = sorted(values)
+    k = (len(s) - 1) * p / 100.0
+    lo = int(k)
+    hi = min(lo + 1, len(s) - 1)
+    return s[lo] + (s[hi] - s[lo]) * (k - lo)
+
+
+def run_step(cbt, admin, base, n, args, step):
+    class_name = f'LT{step}'
+    exam_id, names = seed_exam(cbt, admin, n, args.questions, class_name)
+    if args.pool_wait:
+        time.sleep(args.pool_wait)
+    rec = Recorder()
+    barrier = threading.Barrier(n)
+    threads = [threading.Thread(target=student, args=(base, rec, exam_id, class_name, name, args, barrier,
+                                                      random.Random(args.seed + i)), daemon=True)
+               for i, name in enumerate(names)]
+    t0 = time.perf_counter()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    return rec, time.perf_counter() - t0
+
+
+def report(n, rec, wall, slo_ms):
+    print(f'\n{n} students, {wall:.1f}s wall')
+    print(f"{'endpoint':22}{'n':>6}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'max ms':>10}{'errors':>8}{'locked':>8}")
+    ok = True
+    for name in ENDPOINTS:
+        v = rec.samples[name]
+        if not v:
+            continue
+        p95 = percentile(v, 95)
+        flag = '' if p95 <= slo_ms else '  > SLO'
+        print(f'{name:22}{len(v):6d}{percentile(v, 50):10.1f}{p95:10.1f}{percentile(v, 99):10.1f}'
+              f'{max(v):10.1f}{rec.errors[name]:8d}{rec.locked[name]:8d}{flag}')
+        ok = ok and p95 <= slo_ms and not rec.errors[name]
+    for name, example in rec.examples.items():
+        print(f'  first {name} error: {example}')
+    return ok
+
+
+def main():
+    p = argparse.ArgumentParser()
+    p.add_argument('--students', type=int, default=100)
+    p.add_argument('--ramp', default='', help='comma separated class sizes to try in turn, e.g. 50,100,200,400')
+    p.add_argument('--questions', type=int, default=40)
+    p.add_argument('--autosaves', type=int, default=5, help='autosave calls per student')
+    p.add_argument('--think-ms', type=int, default=200, help='max random pause between a student\'s actions')
+    p.add_argument('--slo-ms', type=float, default=2000.0, help='p95 latency every endpoint must stay under')
+    p.add_argument('--pool-wait', type=float, default=1.0, help='seconds to let the session pool fill after opening')
+    p.add_argument('--barrier-timeout', type=float, default=300.0)
+    p.add_argument('--seed', type=int, default=1)
+    args = p.parse_args()
+
+    sizes = [int(x) for x in args.ramp.split(',') if x.strip()] if args.ramp else [args.students]
+
+    tmpdir = tempfile.mkdtemp(prefix='cbt_load_')
+    os.environ['CBT_DB_PATH'] = os.path.join(tmpdir, 'load.db')
+    os.chdir(tmpdir)                       # app.log lands here, not in the checkout
+    sys.path.insert(0, str(ROOT))
+    import app as cbt  # noqa: E402  (must import after CBT_DB_PATH is set)
+    from werkzeug.serving import make_server  # noqa: E402
+
+    cbt.BASE_DIR = tmpdir                  # per-subject result files too
+    cbt.migrate_db()
+    admin = cbt.app.test_client()
+    admin.post('/api/login_admin', json={'username': cbt.ADMIN_USERNAME, 'password': cbt.ADMIN_PASSWORD})
+
+    server = make_server('127.0.0.1', 0, cbt.app, threaded=True)
+    server.socket.listen(1024)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    base = f'http://127.0.0.1:{server.server_port}'
+    print(f'Serving on {base}, database {os.environ["CBT_DB_PATH"]}')
+
+    capacity = 0
+    best_rate = 0.0
+    try:
+        for step, n in enumerate(sizes):
+            before = cbt.db_stats()
+            rec, wall = run_step(cbt, admin, base, n, args, step)
+            ok = report(n, rec, wall, args.slo_ms)
+            after = cbt.db_stats()
+            print(f"  db: lock retries {after['lock_retries'] - before['lock_retries']}, "
+                  f"lock failures {after['lock_failures'] - before['lock_failures']}, "
+                  f"writer batches {after['writer']['batches'] - before['writer']['batches']} "
+                  f"(max batch {after['writer']['max_batch']})")
+            submits = rec.samples['submit']
+            if submits:
+                # the whole room submits together: the burst drains in about max(submit latency)
+                best_rate = max(best_rate, len(submits) / (max(submits) / 1000.0))
+            if ok:
+                capacity = n
+            elif args.ramp:
+                print(f'  {n} students breaks the SLO, stopping the ramp')
+                break
+    finally:
+        cbt.result_file_writer.flush()
+        server.shutdown()
+
+    print()
+    if args.ramp:
+        print(f'Capacity: {capacity or "fewer than " + str(sizes[0])} students within p95 < {args.slo_ms:.0f} ms, no errors')
+    else:
+        print(f'{sizes[0]} students: ' + ('within' if capacity else 'NOT within') + f' p95 < {args.slo_ms:.0f} ms, no errors')
+    if best_rate:
+        print(f'Submit burst throughput ~{best_rate:.0f}/s -> about {int(best_rate * args.slo_ms / 1000.0)} students '
+              f'can auto-submit at the same moment and all get an answer within {args.slo_ms:.0f} ms')
+
+
+if __name__ == '__main__':
+    main()
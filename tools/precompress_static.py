@@ -0,0 +1,89 @@
+"""
+Write .gz (and .br, when the brotli package is installed) siblings next to every
+compressible file under static/. The app's static view serves a sibling instead of
+the original when the browser accepts that encoding and the sibling is not older
+than the original, so run this again after changing an asset (it is part of deploying).
+
+    python tools/precompress_static.py            # compress new/changed files
+    python tools/precompress_static.py --force    # rebuild everything
+    python tools/precompress_static.py --clean    # remove all .gz/.br siblings
+"""
+import argparse
+import gzip
+import os
+from pathlib import Path
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+ROOT = Path(__file__).resolve().parent.parent
+STATIC = ROOT / 'static'
+COMPRESSIBLE = {'.js', '.css', '.html', '.json', '.svg', '.txt', '.csv', '.xml', '.ico', '.map', '.webmanifest'}
+MIN_BYTES = 512
+MIN_SAVING = 0.05    # keep a sibling only if it is at least 5% smaller
+
+
+def encoders():
+    out = [('.gz', lambda data: gzip.compress(data, compresslevel=9, mtime=0))]
+    if brotli is not None:
+        out.append(('.br', lambda data: brotli.compress(data, quality=11)))
+    return out
+
+
+def candidates(root):
+    for path in sorted(root.rglob('*')):
+        if path.is_file() and path.suffix.lower() in COMPRESSIBLE:
+            yield path
+
+
+def main():
+    p = argparse.ArgumentParser()
+    p.add_argument('--static', default=str(STATIC), help='directory to process (default: static/)')
+    p.add_argument('--force', action='store_true', help='recompress even if siblings are up to date')
+    p.add_argument('--clean', action='store_true', help='delete .gz/.br siblings and exit')
+    args = p.parse_args()
+    root = Path(args.static)
+
+    if args.clean:
+        removed = 0
+        for path in root.rglob('*'):
+            if path.suffix in ('.gz', '.br') and path.with_suffix('').exists():
+                path.unlink()
+                removed += 1
+        print(f'Removed {removed} precompressed files.')
+        return
+
+    if brotli is None:
+        print('brotli not installed: writing .gz only')
+    total_in = total_out = written = 0
+    for path in candidates(root):
+        data = path.read_bytes()
+        if len(data) < MIN_BYTES:
+            continue
+        for ext, encode in encoders():
+            target = path.with_name(path.name + ext)
+            if not args.force and target.exists() and target.stat().st_mtime >= path.stat().st_mtime:
+                continue
+            packed = encode(data)
+            if len(packed) > len(data) * (1 - MIN_SAVING):
+                if target.exists():
+                    target.unlink()
+                continue
+            tmp = target.with_name(target.name + '.tmp')
+            tmp.write_bytes(packed)
+            os.replace(tmp, target)
+            written += 1
+            total_in += len(data)
+            total_out += len(packed)
+            print(f'{target.relative_to(root)}  {len(data):>9,} -> {len(packed):>9,} bytes ({len(packed) / len(data):.0%})')
+
+    if written:
+        print(f'\nWrote {written} files: {total_in:,} -> {total_out:,} bytes')
+    else:
+        print('Everything up to date.')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,61 @@
+"""
+Correct answer keys after an exam and rescore every result that answered those questions.
+
+    python tools/regrade.py 3f2a9c1e=C 77b01d4a=0
+    python tools/regrade.py --file key_fixes.csv          # columns: question_id,answer_index
+
+answer_index is 0-based or a letter, in the question's stored choice order (the order
+the teacher uploaded, not the shuffled order a student saw). All fixes, across any
+number of exams, are applied in one transaction; the per-subject result files that
+cover the affected exams are rewritten afterwards.
+"""
+import argparse
+import csv
+import sys
+import time
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+
+
+def main():
+    p = argparse.ArgumentParser()
+    p.add_argument('fixes', nargs='*', metavar='QUESTION_ID=ANSWER')
+    p.add_argument('--file', help='csv with question_id,answer_index columns')
+    args = p.parse_args()
+
+    items = []
+    for f in args.fixes:
+        qid, sep, ans = f.partition('=')
+        if not sep:
+            p.error(f'expected QUESTION_ID=ANSWER, got {f!r}')
+        items.append({'question_id': qid.strip(), 'answer_index': ans.strip()})
+    if args.file:
+        with open(args.file, newline='', encoding='utf-8-sig') as fh:
+            items += [{'question_id': (r.get('question_id') or '').strip(), 'answer_index': (r.get('answer_index') or '').strip()}
+                      for r in csv.DictReader(fh)]
+    if not items:
+        p.error('no fixes given')
+
+    import app as cbt  # noqa: E402  (honours CBT_DB_PATH)
+
+    t0 = time.perf_counter()
+    try:
+        out = cbt.regrade_questions(cbt.parse_key_fixes(items))
+    except ValueError as e:
+        print(f'error: {e}')
+        sys.exit(1)
+    elapsed = time.perf_counter() - t0
+
+    cbt.log_audit('regrade', None, out['exams'][0] if len(out['exams']) == 1 else None,
+                  {'fixes': {i['question_id']: i['answer_index'] for i in items}, 'exams': out['exams'],
+                   'results': out['results']})
+    print(f"Changed {out['questions']} key(s) ({out['unchanged']} already correct) across "
+          f"{len(out['exams'])} exam(s); rescored {out['results']} result(s) in {elapsed:.2f}s")
+    for f in out['files']:
+        print(f'  rebuilt {f}')
+
+
+if __name__ == '__main__':
+    main()